@@ -1,10 +1,15 @@
 from django.core.exceptions import ImproperlyConfigured
+from django.http import Http404, HttpResponseBadRequest
 from django.urls import reverse
 from django.views.generic.base import ContextMixin
 
-from borgia.utils import (ACCEPTED_MENU_TYPES, is_association_manager,
-                          managers_lateral_menu, members_lateral_menu,
-                          simple_lateral_link)
+from django.core.cache import cache
+
+from borgia.utils import (ACCEPTED_MENU_TYPES, EXPORT_FORMATS,
+                          LATERAL_MENU_CACHE_TIMEOUT, KeysetPaginator,
+                          export_response, is_association_manager,
+                          lateral_menu_cache_key, managers_lateral_menu,
+                          members_lateral_menu, simple_lateral_link)
 from shops.utils import get_shops_tree, shops_lateral_menu
 
 
@@ -58,6 +63,35 @@ class LateralMenuMixin(ContextMixin):
 
 
     def get_menu(self):
+        """
+        Return the menu with the lm_active link marked.
+
+        The menu is cached per user, menu type and shop, see
+        borgia.utils.lateral_menu_cache_key. The cache returns a new copy of
+        the menu, marked without altering the cached one.
+        """
+        menu_type = self.get_menu_type()
+        key = lateral_menu_cache_key(self.request.user, menu_type,
+                                     getattr(self, 'shop', None) if menu_type == 'shops' else None)
+        nav_tree = cache.get(key)
+        if nav_tree is None:
+            nav_tree = self.build_menu()
+            cache.set(key, nav_tree, LATERAL_MENU_CACHE_TIMEOUT)
+
+        if self.lm_active is not None:
+            for link in nav_tree:
+                try:
+                    for sub in link['subs']:
+                        if sub['id'] == self.lm_active:
+                            sub['active'] = True
+                            break
+                except KeyError:
+                    if link['id'] == self.lm_active:
+                        link['active'] = True
+                        break
+        return nav_tree
+
+    def build_menu(self):
         """
         Override it with your custom menu.
         As a base, only add the main sections, depending on the user.
@@ -98,22 +132,60 @@ class LateralMenuMixin(ContextMixin):
 
             nav_tree.append(management_tree)
 
-        nav_tree = self.get_specific_menu(nav_tree)
-
-        if self.lm_active is not None:
-            for link in nav_tree:
-                try:
-                    for sub in link['subs']:
-                        if sub['id'] == self.lm_active:
-                            sub['active'] = True
-                            break
-                except KeyError:
-                    if link['id'] == self.lm_active:
-                        link['active'] = True
-                        break
-        return nav_tree
+        return self.get_specific_menu(nav_tree)
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['nav_tree'] = self.get_menu()
         return context
+
+
+class KeysetPaginationMixin:
+    """
+    Paginate a list by (datetime, pk) with a KeysetPaginator.
+
+    The page is given by POST['page'], 'next|<cursor>' or
+    'previous|<cursor>', sent by the buttons of partials/keyset_pager.html
+    along with the search form of the list.
+    """
+    paginate_by = 50
+
+    def paginate_queryset(self, queryset):
+        direction, _, cursor = self.request.POST.get('page', '').partition('|')
+        return KeysetPaginator(queryset, self.paginate_by).page(cursor, direction)
+
+
+class ExportMixin:
+    """
+    Export the objects of a list view as a file, filtered with the values of
+    its search form given in GET parameters.
+
+    The list view must define set_filters(form) and form_query(query).
+
+    :param GET['format']: format of the file, in EXPORT_FORMATS, mandatory.
+    """
+    http_method_names = ['get']
+    export_filename = None
+    export_header = None
+
+    def get_export_rows(self):
+        """
+        Override it to return the rows of the file, filtered with form_query.
+        """
+        raise ImproperlyConfigured(
+            '{0} is missing the get_export_rows method. Define {0}.get_export_rows '
+            'returning the rows of the file.'.format(self.__class__.__name__)
+        )
+
+    def get(self, request, *args, **kwargs):
+        export_format = request.GET.get('format')
+        if export_format not in EXPORT_FORMATS:
+            raise Http404
+
+        form = self.get_form_class()(request.GET)
+        if not form.is_valid():
+            return HttpResponseBadRequest()
+        self.set_filters(form)
+
+        return export_response(export_format, self.export_filename, self.export_header,
+                               self.get_export_rows())
@@ -0,0 +1,58 @@
+from django.contrib.auth.models import Group, Permission
+from django.test import RequestFactory
+
+from borgia.tests.tests_views import BaseBorgiaViewsTestCase
+from borgia.views import MembersWorkboard
+from modules.models import SelfSaleModule
+from shops.models import Shop
+from users.models import User
+
+
+class LateralMenuMixinTestCase(BaseBorgiaViewsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.shop1 = Shop.objects.get(name='firstshop')
+        self.selfsalemodule1 = SelfSaleModule.objects.create(shop=self.shop1, state=True)
+
+    def get_menu(self, user, lm_active=None):
+        view = MembersWorkboard()
+        view.request = RequestFactory().get('/')
+        view.request.user = user
+        view.lm_active = lm_active
+        return view.get_menu()
+
+    @staticmethod
+    def ids(nav_tree):
+        return [link['id'] for link in nav_tree]
+
+    def test_warm_menu_without_queries(self):
+        nav_tree = self.get_menu(self.user1)
+        with self.assertNumQueries(0):
+            self.assertListEqual(self.get_menu(self.user1), nav_tree)
+
+    def test_active_link_not_cached(self):
+        nav_tree = self.get_menu(self.user1, lm_active='lm_self_transaction_list')
+        self.assertListEqual([link['id'] for link in nav_tree if link.get('active')],
+                             ['lm_self_transaction_list'])
+        for link in self.get_menu(self.user1):
+            self.assertNotIn('active', link)
+
+    def test_invalidated_on_group_membership(self):
+        self.assertNotIn('lm_user_groups', self.ids(self.get_menu(self.user3)))
+        self.user3.groups.add(Group.objects.get(name='chiefs-firstshop'))
+        user3 = User.objects.get(pk=self.user3.pk)
+        self.assertIn('lm_user_groups', self.ids(self.get_menu(user3)))
+
+    def test_invalidated_on_module_change(self):
+        module_link = 'lm_selfsale_interface_module_firstshop'
+        self.assertIn(module_link, self.ids(self.get_menu(self.user1)))
+        for module in SelfSaleModule.objects.filter(shop=self.shop1):
+            module.state = False
+            module.save()
+        self.assertNotIn(module_link, self.ids(self.get_menu(self.user1)))
+
+    def test_invalidated_on_permission_change(self):
+        self.assertNotIn('lm_transfert_create', self.ids(self.get_menu(self.user3)))
+        self.user3.user_permissions.add(Permission.objects.get(codename='add_transfert'))
+        user3 = User.objects.get(pk=self.user3.pk)
+        self.assertIn('lm_transfert_create', self.ids(self.get_menu(user3)))
@@ -0,0 +1,99 @@
+import datetime
+
+from django.core.cache import cache
+from django.db import transaction
+from django.test import TransactionTestCase
+from django.utils.timezone import localdate, make_aware
+
+from borgia.tests.tests_views import BaseBorgiaViewsTestCase
+from borgia.utils import (LATERAL_MENU_VERSION_KEY, KeysetPaginator, encode_cursor,
+                          escape_formulas, filter_period, get_lateral_menu_version,
+                          invalidate_lateral_menus)
+from finances.models import Transfert
+
+
+class KeysetPaginatorTestCase(BaseBorgiaViewsTestCase):
+    def setUp(self):
+        super().setUp()
+        base = make_aware(datetime.datetime(2019, 1, 1, 12))
+        # Pairs of transferts at the same datetime, to check the ties
+        queryset = Transfert.objects.filter(pk__in=[
+            Transfert.objects.create(sender=self.user1, recipient=self.user2, amount=1,
+                                     datetime=base + datetime.timedelta(hours=i // 2)).pk
+            for i in range(7)])
+        self.transferts = list(queryset.order_by('-datetime', '-pk'))
+        self.paginator = KeysetPaginator(queryset, 3)
+
+    def test_first_page(self):
+        with self.assertNumQueries(1):
+            page = self.paginator.page()
+            self.assertEqual(list(page), self.transferts[:3])
+        self.assertFalse(page.has_previous())
+        self.assertTrue(page.has_next())
+
+    def test_walk_forward_and_back(self):
+        pages = [self.paginator.page()]
+        while pages[-1].has_next():
+            pages.append(self.paginator.page(pages[-1].next_cursor()))
+        self.assertEqual([obj for page in pages for obj in page], self.transferts)
+        self.assertEqual(len(pages), 3)
+
+        page = pages[-1]
+        for expected in reversed(pages[:-1]):
+            self.assertTrue(page.has_previous())
+            page = self.paginator.page(page.previous_cursor(), 'previous')
+            self.assertEqual(list(page), list(expected))
+        self.assertFalse(page.has_previous())
+
+    def test_one_query_by_page(self):
+        cursor = encode_cursor(self.transferts[3])
+        with self.assertNumQueries(1):
+            page = self.paginator.page(cursor)
+            self.assertEqual(list(page), self.transferts[4:7])
+        self.assertTrue(page.has_previous())
+        self.assertFalse(page.has_next())
+
+    def test_invalid_cursor(self):
+        for cursor in ('', 'wrong', '2019-01-01T12:00:00|a', 'wrong|1'):
+            self.assertEqual(list(self.paginator.page(cursor)), self.transferts[:3])
+
+    def test_previous_of_first(self):
+        page = self.paginator.page(encode_cursor(self.transferts[0]), 'previous')
+        self.assertEqual(list(page), self.transferts[:3])
+        self.assertFalse(page.has_previous())
+
+
+class FilterPeriodTestCase(BaseBorgiaViewsTestCase):
+    def test_date_end_included(self):
+        today = localdate()
+        late = make_aware(datetime.datetime.combine(today, datetime.time(23, 59)))
+        transfert = Transfert.objects.create(
+            sender=self.user1, recipient=self.user2, amount=1, datetime=late)
+        transferts = Transfert.objects.filter(pk=transfert.pk)
+
+        self.assertTrue(filter_period(transferts, today, today).exists())
+        self.assertTrue(filter_period(transferts, None, today).exists())
+        self.assertFalse(filter_period(
+            transferts, None, today - datetime.timedelta(days=1)).exists())
+        self.assertFalse(filter_period(
+            transferts, today + datetime.timedelta(days=1)).exists())
+
+
+class EscapeFormulasTestCase(BaseBorgiaViewsTestCase):
+    def test_escape_formulas(self):
+        self.assertEqual(escape_formulas(['=1+1', '+33', '-2', '@SUM(A1)', '\tx', '\rx']),
+                         ["'=1+1", "'+33", "'-2", "'@SUM(A1)", "'\tx", "'\rx"])
+
+    def test_other_values_unchanged(self):
+        row = ['Pizza', 'a=b', '', -2, None, datetime.date(2019, 2, 1)]
+        self.assertEqual(escape_formulas(row), row)
+
+
+class LateralMenuCommitTestCase(TransactionTestCase):
+    def test_invalidated_on_commit(self):
+        get_lateral_menu_version()
+        with transaction.atomic():
+            invalidate_lateral_menus()
+            # Menus computed now read the old rows
+            version = cache.get(LATERAL_MENU_VERSION_KEY)
+        self.assertNotEqual(cache.get(LATERAL_MENU_VERSION_KEY), version)
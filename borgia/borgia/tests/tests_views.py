@@ -1,5 +1,6 @@
 from django.contrib.auth import get_user
 from django.contrib.auth.models import Group, Permission
+from django.core.cache import cache
 from django.test import Client, TestCase
 from django.urls import NoReverseMatch, reverse
 
@@ -13,6 +14,8 @@ class BaseBorgiaViewsTestCase(TestCase):
     fixtures = ['initial', 'tests_data']
 
     def setUp(self):
+        # Changes of cached objects aren't rolled back with the database
+        cache.clear()
         members_group = Group.objects.get(name=INTERNALS_GROUP_NAME)
         externals_group = Group.objects.get(name=EXTERNALS_GROUP_NAME)
         presidents_group = Group.objects.get(name=PRESIDENTS_GROUP_NAME)
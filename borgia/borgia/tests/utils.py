@@ -2,7 +2,10 @@
 Utils for borgia tests.
 """
 
+import time
+
 from django.contrib.auth import REDIRECT_FIELD_NAME
+from django.db import OperationalError
 
 from borgia.settings import LOGIN_URL
 
@@ -12,3 +15,21 @@ def get_login_url_redirected(url_redirected):
     Return login_url with redirect url.
     """
     return LOGIN_URL + '?' + REDIRECT_FIELD_NAME + '=' + url_redirected
+
+
+def retry_on_lock(function, *args, **kwargs):
+    """
+    Call function until the database doesn't raise a lock error.
+
+    :note:: The in-memory SQLite database used for tests doesn't wait for
+    locks, it raises at once. Operations are then retried, as the busy timeout
+    of a real database would do. A retried operation has been rolled back, so
+    it can't be counted twice.
+    """
+    while True:
+        try:
+            return function(*args, **kwargs)
+        except OperationalError as error:
+            if 'locked' not in str(error):
+                raise
+            time.sleep(0.001)
@@ -1,7 +1,20 @@
+import csv
+import datetime
+import tempfile
+import uuid
+
+from openpyxl import Workbook
+
 from django.contrib.auth.models import Group, Permission
 from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
 from django.core.exceptions import ObjectDoesNotExist
+from django.db import transaction
+from django.db.models import Q, prefetch_related_objects
+from django.http import FileResponse, StreamingHttpResponse
 from django.urls import reverse
+from django.utils.dateparse import parse_datetime
+from django.utils.timezone import get_current_timezone, is_aware, make_aware
 
 from modules.models import SelfSaleModule
 from shops.models import Shop
@@ -13,6 +26,12 @@ PRESIDENTS_GROUP_NAME = 'presidents'
 VICE_PRESIDENTS_GROUP_NAME = 'vice_presidents'
 TREASURERS_GROUP_NAME = 'treasurers'
 ACCEPTED_MENU_TYPES = ['members', 'managers', 'shops']
+EXPORT_FORMATS = ['csv', 'xlsx']
+EXPORT_CHUNK_SIZE = 2000
+# Spreadsheets read a cell starting with one of these as a formula
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+LATERAL_MENU_VERSION_KEY = 'lateral_menu_version'
+LATERAL_MENU_CACHE_TIMEOUT = 60 * 60
 
 
 def simple_lateral_link(label, fa_icon, id_link, url):
@@ -23,6 +42,42 @@ def simple_lateral_link(label, fa_icon, id_link, url):
         'url': url
     }
 
+def get_lateral_menu_version():
+    """
+    Return the version stamp of cached lateral menus.
+    """
+    version = cache.get(LATERAL_MENU_VERSION_KEY)
+    if version is None:
+        version = uuid.uuid4().hex
+        cache.set(LATERAL_MENU_VERSION_KEY, version, None)
+    return version
+
+
+def invalidate_lateral_menus():
+    """
+    Change the version stamp of lateral menus, all cached menus are computed
+    again on next request.
+
+    Called by signals when groups, permissions, shops or modules change.
+
+    :note:: Inside a transaction, the version stamp is changed again when it
+    is committed: menus computed meanwhile read the old rows.
+    """
+    cache.set(LATERAL_MENU_VERSION_KEY, uuid.uuid4().hex, None)
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(invalidate_lateral_menus)
+
+
+def lateral_menu_cache_key(user, menu_type, shop=None):
+    """
+    Return the cache key of the lateral menu of the user, for the menu type
+    and the shop given.
+    """
+    return 'lateral_menu:{0}:{1}:{2}:{3}:{4}:{5}'.format(
+        get_lateral_menu_version(), user.pk, int(user.is_active), int(user.is_superuser),
+        menu_type, shop.pk if shop is not None else '')
+
+
 def members_lateral_menu(nav_tree, user):
     """
     Lateral Menu for members.
@@ -104,6 +159,7 @@ def managers_lateral_menu(nav_tree, user):
     - Events
     - Transferts
     - Rechargings
+    - Cheque deposits
     - ExceptionnalMovements
     - Groups Management
     - Configuration
@@ -151,6 +207,15 @@ def managers_lateral_menu(nav_tree, user):
             url=reverse('url_recharging_list')
         ))
 
+    # Cheques
+    if user.has_perm('finances.change_cheque'):
+        nav_tree.append(simple_lateral_link(
+            label='Remises de chèques',
+            fa_icon='bank',
+            id_link='lm_cheque_deposit_list',
+            url=reverse('url_cheque_deposit_list')
+        ))
+
     # Transferts
     if user.has_perm('finances.view_transfert'):
         nav_tree.append(simple_lateral_link(
@@ -402,3 +467,234 @@ def is_association_manager(user):
         return True
     else:
         return False
+
+
+def filter_period(queryset, date_begin=None, date_end=None):
+    """
+    Filter a queryset on datetime between two dates, both included.
+
+    :param date_begin: first day, not filtered if None.
+    :param date_end: last day, not filtered if None.
+    :type date_begin: date object
+    :type date_end: date object
+    :note:: Days are taken in the current timezone, date_end is compared
+    to the first instant of the next day so that the index on datetime is
+    used.
+    """
+    if date_begin:
+        queryset = queryset.filter(datetime__gte=make_aware(
+            datetime.datetime.combine(date_begin, datetime.time.min)))
+    if date_end:
+        queryset = queryset.filter(datetime__lt=make_aware(
+            datetime.datetime.combine(date_end + datetime.timedelta(days=1),
+                                      datetime.time.min)))
+    return queryset
+
+
+def encode_cursor(obj):
+    """
+    Return the position of obj in a KeysetPaginator, as a string.
+    """
+    return obj.datetime.isoformat() + '|' + str(obj.pk)
+
+
+def decode_cursor(cursor):
+    """
+    Return the (datetime, pk) position encoded by encode_cursor, or None if
+    the cursor is not valid.
+    """
+    value, _, pk = cursor.partition('|')
+    try:
+        position = parse_datetime(value)
+        pk = int(pk)
+    except ValueError:
+        return None
+    if position is None:
+        return None
+    if not is_aware(position):
+        position = make_aware(position, get_current_timezone())
+    return position, pk
+
+
+class KeysetPage:
+    """
+    A page of a KeysetPaginator, iterable as a list of objects.
+
+    :param object_list: objects of the page, newest first.
+    :param has_previous: there are newer objects.
+    :param has_next: there are older objects.
+    """
+
+    def __init__(self, object_list, has_previous, has_next):
+        self.object_list = object_list
+        self._has_previous = has_previous
+        self._has_next = has_next
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_previous(self):
+        return self._has_previous and bool(self.object_list)
+
+    def has_next(self):
+        return self._has_next
+
+    def has_other_pages(self):
+        return self.has_previous() or self.has_next()
+
+    def previous_cursor(self):
+        return encode_cursor(self.object_list[0])
+
+    def next_cursor(self):
+        return encode_cursor(self.object_list[-1])
+
+
+class KeysetPaginator:
+    """
+    Paginate a queryset by (datetime, pk), newest first.
+
+    Unlike django.core.paginator.Paginator, pages are not numbered: a page
+    starts right after (or before) the position given by a cursor. There is
+    no COUNT and no OFFSET, each page is one query reading per_page + 1 rows
+    of the (datetime, id) index, however deep it is.
+
+    :param queryset: queryset to paginate, its ordering is replaced.
+    :param per_page: number of objects by page.
+    :type per_page: integer
+    """
+
+    def __init__(self, queryset, per_page):
+        self.queryset = queryset
+        self.per_page = per_page
+
+    def page(self, cursor=None, direction='next'):
+        """
+        Return the page of objects older (direction 'next') or newer
+        (direction 'previous') than cursor.
+
+        :note:: The first page is returned if the cursor is missing or not
+        valid, or if there is nothing newer than it.
+        """
+        position = decode_cursor(cursor) if cursor else None
+        if position is None:
+            rows = list(self.queryset.order_by('-datetime', '-pk')[:self.per_page + 1])
+            return KeysetPage(rows[:self.per_page], False, len(rows) > self.per_page)
+
+        position_datetime, position_pk = position
+        if direction == 'previous':
+            rows = list(self.queryset.filter(
+                Q(datetime__gt=position_datetime)
+                | Q(datetime=position_datetime, pk__gt=position_pk)
+            ).order_by('datetime', 'pk')[:self.per_page + 1])
+            if not rows:
+                return self.page()
+            return KeysetPage(rows[:self.per_page][::-1], len(rows) > self.per_page, True)
+
+        rows = list(self.queryset.filter(
+            Q(datetime__lt=position_datetime)
+            | Q(datetime=position_datetime, pk__lt=position_pk)
+        ).order_by('-datetime', '-pk')[:self.per_page + 1])
+        return KeysetPage(rows[:self.per_page], True, len(rows) > self.per_page)
+
+
+def iterate_prefetched(queryset, lookups=(), chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Iterate over a queryset with a server-side cursor, by chunks of
+    chunk_size objects.
+
+    :param lookups: prefetch_related lookups applied to each chunk, as
+    queryset.iterator() ignores prefetch_related.
+    """
+    chunk = []
+    for obj in queryset.iterator(chunk_size=chunk_size):
+        chunk.append(obj)
+        if len(chunk) >= chunk_size:
+            prefetch_related_objects(chunk, *lookups)
+            yield from chunk
+            chunk = []
+    prefetch_related_objects(chunk, *lookups)
+    yield from chunk
+
+
+def escape_formulas(row):
+    """
+    Return row with the strings that a spreadsheet would read as formulas
+    prefixed with a quote, so that free text typed by members is exported as
+    text.
+    """
+    return ["'" + value if isinstance(value, str) and value.startswith(FORMULA_PREFIXES)
+            else value for value in row]
+
+
+class EchoBuffer:
+    """
+    File-like object returning what is written, for csv.writer.
+    """
+
+    def write(self, value):
+        return value
+
+
+def stream_csv(filename, header, rows):
+    """
+    Return a response streaming rows as a CSV file, one line at a time.
+
+    :note:: The file starts with a BOM, so that spreadsheets read it in UTF-8.
+    Values are escaped with escape_formulas.
+    """
+    writer = csv.writer(EchoBuffer())
+
+    def lines():
+        yield '\ufeff' + writer.writerow(header)
+        for row in rows:
+            yield writer.writerow(escape_formulas(row))
+
+    response = StreamingHttpResponse(lines(), content_type='text/csv; charset=utf-8')
+    response['Content-Disposition'] = 'attachment; filename="' + filename + '.csv"'
+    return response
+
+
+def stream_xlsx(filename, header, rows):
+    """
+    Return a response streaming rows as a XLSX file.
+
+    :note:: The workbook is write-only: rows are flushed to a temporary file
+    as they come, instead of being kept in memory. The archive is then
+    streamed by blocks. Values are escaped with escape_formulas.
+    :note:: Unlike CSV, the whole workbook is written before the first byte
+    is sent: memory stays constant, but a very long export can still reach
+    the request timeout.
+    """
+    workbook = Workbook(write_only=True)
+    worksheet = workbook.create_sheet(filename)
+    worksheet.append(header)
+    for row in rows:
+        worksheet.append(escape_formulas(row))
+
+    archive = tempfile.TemporaryFile()
+    workbook.save(archive)
+    archive.seek(0)
+    response = FileResponse(
+        archive, content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+    response['Content-Disposition'] = 'attachment; filename="' + filename + '.xlsx"'
+    return response
+
+
+def export_response(export_format, filename, header, rows):
+    """
+    Return a response streaming rows as a file.
+
+    :param export_format: format of the file, in EXPORT_FORMATS.
+    :param filename: name of the file, without extension.
+    :param header: titles of the columns.
+    :param rows: iterable of lists of values, datetimes must be naive.
+    """
+    if export_format == 'xlsx':
+        return stream_xlsx(filename, header, rows)
+    return stream_csv(filename, header, rows)
@@ -26,7 +26,7 @@ from events.models import Event
 from finances.models import ExceptionnalMovement, Recharging, Transfert
 from modules.models import SelfSaleModule
 from sales.models import Sale
-from shops.utils import get_shops_managed
+from shops.utils import get_shops_managed, sales_aggregate, sales_series
 from shops.models import Shop
 from users.forms import UserQuickSearchForm
 from users.models import User
@@ -120,7 +120,8 @@ class MembersWorkboard(LoginRequiredMixin, BorgiaView):
     def get_transactions(self):
         transactions = {'months': self.monthlist(
             datetime.datetime.now() - datetime.timedelta(days=365),
-            datetime.datetime.now()), 'all': self.request.user.list_transaction()[:5]}
+            datetime.datetime.now()),
+            'all': self.request.user.ledger_entries.order_by('-datetime', '-pk')[:5]}
 
         # Shops sales
         sale_list = Sale.objects.filter(
@@ -128,13 +129,10 @@ class MembersWorkboard(LoginRequiredMixin, BorgiaView):
         transactions['shops'] = []
         for shop in Shop.objects.all():
             list_filtered = sale_list.filter(shop=shop)
-            total = 0
-            for sale in list_filtered:
-                total += sale.amount()
             transactions['shops'].append({
                 'shop': shop,
-                'total': total,
-                'sale_list_short': list_filtered[:5],
+                'total': sales_aggregate(list_filtered)['value'],
+                'sale_list_short': list_filtered.with_products()[:5],
                 'data_months': self.data_months(list_filtered, transactions['months'])
             })
 
@@ -147,7 +145,7 @@ class MembersWorkboard(LoginRequiredMixin, BorgiaView):
         }
 
         # Rechargings
-        rechargings_list = Recharging.objects.filter(
+        rechargings_list = Recharging.objects.with_solution().filter(
             sender=self.request.user).order_by('-datetime')
         transactions['rechargings'] = {
             'recharging_list_short': rechargings_list[:5]
@@ -173,13 +171,11 @@ class MembersWorkboard(LoginRequiredMixin, BorgiaView):
         return transactions
 
     @staticmethod
-    def data_months(mlist, months):
+    def data_months(sales, months):
         amounts = [0 for _ in range(0, len(months))]
-        for obj in mlist:
-            if obj.datetime.strftime("%b-%y") in months:
-                amounts[
-                    months.index(obj.datetime.strftime("%b-%y"))] +=\
-                    abs(obj.amount())
+        for month_start, amount in sales_series(sales, 'month').items():
+            if month_start.strftime("%b-%y") in months:
+                amounts[months.index(month_start.strftime("%b-%y"))] += abs(amount)
         return amounts
 
     @staticmethod
@@ -208,11 +204,12 @@ class ManagersWorkboard(LoginRequiredMixin, PermissionRequiredMixin, BorgiaView)
         context = self.get_context_data(**kwargs)
         if (self.managers_group):
             context['group'] = self.managers_group
-            context['sale_list'] = Sale.objects.all().order_by('-datetime')[:5]
+            context['sale_list'] = Sale.objects.with_amount().with_module().select_related(
+                'operator', 'sender', 'shop').order_by('-datetime')[:5]
         elif self.shops_managed:
             context['group'] = self.shops_managed[0]
-            context['sale_list'] = self.shops_managed[0].sale_set.all().order_by(
-                '-datetime')[:5]
+            context['sale_list'] = self.shops_managed[0].sale_set.with_amount().with_module(
+            ).select_related('operator', 'sender', 'shop').order_by('-datetime')[:5]
         context['events'] = []
         for event in Event.objects.all():
             context['events'].append({
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class ConfigurationsConfig(AppConfig):
     name = 'configurations'
+
+    def ready(self):
+        # Import configurations signals
+        from configurations.signals import invalidate_configurations_cache
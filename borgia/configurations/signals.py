@@ -0,0 +1,14 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from configurations.models import Configuration
+from configurations.utils import invalidate_configurations
+
+
+@receiver(post_save, sender=Configuration)
+@receiver(post_delete, sender=Configuration)
+def invalidate_configurations_cache(**kwargs):
+    """
+    Make all processes reload configurations after a change.
+    """
+    invalidate_configurations()
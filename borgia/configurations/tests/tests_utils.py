@@ -0,0 +1,71 @@
+from django.core.cache import cache
+from django.db import transaction
+from django.test import TestCase, TransactionTestCase
+
+from configurations.models import Configuration
+from configurations.utils import (CONFIGURATIONS_VERSION_KEY,
+                                  configuration_get, configurations_get)
+
+
+class ConfigurationGetTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        Configuration.objects.create(
+            name='CENTER_NAME', description='Name', value='Center', value_type='s')
+        Configuration.objects.create(
+            name='MARGIN_PROFIT', description='Margin', value='5', value_type='f')
+
+    def test_one_query(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(configuration_get('CENTER_NAME').get_value(), 'Center')
+            self.assertEqual(configuration_get('MARGIN_PROFIT').get_value(), 5)
+            self.assertEqual(configuration_get('CENTER_NAME').get_value(), 'Center')
+
+    def test_saved(self):
+        center_name = configuration_get('CENTER_NAME')
+        center_name.value = 'New center'
+        # Modifying the returned object doesn't modify the cached one
+        self.assertEqual(configuration_get('CENTER_NAME').get_value(), 'Center')
+        center_name.save()
+        self.assertEqual(configuration_get('CENTER_NAME').get_value(), 'New center')
+
+    def test_deleted(self):
+        configuration_get('CENTER_NAME')
+        Configuration.objects.filter(name='CENTER_NAME').delete()
+        Configuration.objects.get(name='MARGIN_PROFIT').delete()
+        with self.assertRaises(Configuration.DoesNotExist):
+            configuration_get('MARGIN_PROFIT')
+
+    def test_changed_by_another_process(self):
+        configuration_get('CENTER_NAME')
+        Configuration.objects.filter(name='CENTER_NAME').update(value='New center')
+        self.assertEqual(configuration_get('CENTER_NAME').get_value(), 'Center')
+        cache.set(CONFIGURATIONS_VERSION_KEY, 'another version')
+        self.assertEqual(configuration_get('CENTER_NAME').get_value(), 'New center')
+
+    def test_not_existing(self):
+        with self.assertRaises(Configuration.DoesNotExist):
+            configuration_get('NOT_EXISTING')
+
+    def test_configurations_get(self):
+        configuration_get('CENTER_NAME')
+        with self.assertNumQueries(0):
+            configurations = configurations_get('CENTER_NAME', 'MARGIN_PROFIT')
+        self.assertEqual(configurations['CENTER_NAME'].get_value(), 'Center')
+        self.assertEqual(configurations['MARGIN_PROFIT'].get_value(), 5)
+        with self.assertRaises(Configuration.DoesNotExist):
+            configurations_get('CENTER_NAME', 'NOT_EXISTING')
+
+
+class ConfigurationCommitTestCase(TransactionTestCase):
+    def test_invalidated_on_commit(self):
+        cache.clear()
+        center_name = Configuration.objects.create(
+            name='CENTER_NAME', description='Name', value='Center', value_type='s')
+        with transaction.atomic():
+            center_name.value = 'New center'
+            center_name.save()
+            # Processes reloading now read the old row
+            version = cache.get(CONFIGURATIONS_VERSION_KEY)
+        self.assertNotEqual(cache.get(CONFIGURATIONS_VERSION_KEY), version)
+        self.assertEqual(configuration_get('CENTER_NAME').get_value(), 'New center')
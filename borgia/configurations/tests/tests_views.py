@@ -1,8 +1,12 @@
+import decimal
+
 from django.test import Client
 from django.urls import reverse
 
 from borgia.tests.tests_views import BaseBorgiaViewsTestCase
 from borgia.tests.utils import get_login_url_redirected
+from shops.models import Product, Shop
+from stocks.models import StockEntry, StockEntryProduct
 
 
 class BaseConfigurationsViewsTest(BaseBorgiaViewsTestCase):
@@ -64,6 +68,20 @@ class PriceConfigTest(BaseConfigurationsViewsTest):
     def test_offline_user_redirection(self):
         super().offline_user_redirection()
 
+    def test_post_updates_automatic_prices(self):
+        shop = Shop.objects.create(name='shop', description='Shop', color='#F4FA58')
+        product = Product.objects.create(name='beer', shop=shop)
+        stockentry = StockEntry.objects.create(operator=self.user1, shop=shop)
+        StockEntryProduct.objects.create(
+            stockentry=stockentry, product=product, quantity=10, price=decimal.Decimal(10))
+        self.assertEqual(Product.objects.get(pk=product.pk).get_automatic_price(),
+                         decimal.Decimal('1.05'))
+
+        response_client1 = self.client1.post(self.get_url(), {'margin_profit': 20})
+        self.assertEqual(response_client1.status_code, 302)
+        self.assertEqual(Product.objects.get(pk=product.pk).get_automatic_price(),
+                         decimal.Decimal('1.2'))
+
 
 class LydiaConfigTest(BaseConfigurationsViewsTest):
     url_view = 'url_lydia_config'
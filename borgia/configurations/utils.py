@@ -2,10 +2,88 @@
 Define Configurations utils.
 Including the default configurations, with the syntax:
 name: (String name, String description, String value_type, String value)
+
+Configurations are kept in memory by each process. A version stamp stored in
+the Django cache is changed each time a configuration is saved or deleted,
+so that every process reloads them on its next configuration_get.
 """
+import copy
+import uuid
+
+from django.core.cache import cache
+from django.db import transaction
 
 from configurations.models import Configuration
 
+CONFIGURATIONS_VERSION_KEY = 'configurations_version'
+
+_configurations = {
+    'version': None,
+    'objects': {}
+}
+
+
+def load_configurations(version=None):
+    """
+    Load all configurations in memory with one query.
+
+    :param version: version stamp of the loaded configurations, a new one is
+    set in the Django cache if not given.
+    """
+    if version is None:
+        version = uuid.uuid4().hex
+        cache.set(CONFIGURATIONS_VERSION_KEY, version, None)
+    _configurations['objects'] = {
+        configuration.name: configuration for configuration in Configuration.objects.all()}
+    _configurations['version'] = version
+
+
+def invalidate_configurations():
+    """
+    Change the version stamp, all processes reload configurations on their
+    next configuration_get.
+
+    :note:: Inside a transaction, the version stamp is changed again when it
+    is committed: processes reloading meanwhile read the old rows.
+    """
+    _configurations['version'] = None
+    cache.set(CONFIGURATIONS_VERSION_KEY, uuid.uuid4().hex, None)
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(invalidate_configurations)
+
 
 def configuration_get(name):
-    return Configuration.objects.get(name=name)
+    """
+    Return the configuration named name.
+
+    :raises: Configuration.DoesNotExist if there is no such configuration.
+    :note:: A copy of the configuration kept in memory is returned, it can
+    be modified and saved.
+    """
+    return configurations_get(name)[name]
+
+
+def configurations_get(*names):
+    """
+    Return the configurations named names, as a dict by name, checking the
+    version stamp once for all of them.
+
+    :raises: Configuration.DoesNotExist if one of them doesn't exist.
+    :note:: Copies of the configurations kept in memory are returned.
+    """
+    version = cache.get(CONFIGURATIONS_VERSION_KEY)
+    if version is None or version != _configurations['version']:
+        load_configurations(version)
+
+    if any(name not in _configurations['objects'] for name in names):
+        # Created without signal (bulk_create, raw SQL ...), try once again
+        load_configurations()
+
+    configurations = {}
+    for name in names:
+        try:
+            configurations[name] = copy.copy(_configurations['objects'][name])
+        except KeyError:
+            raise Configuration.DoesNotExist(
+                'Configuration matching query does not exist.')
+    return configurations
@@ -10,6 +10,8 @@ from configurations.forms import (ConfigurationBalanceForm,
                                   ConfigurationLydiaForm,
                                   ConfigurationProfitForm)
 from configurations.utils import configuration_get
+from shops.models import Product
+from shops.utils import update_automatic_prices
 
 
 class ConfigurationIndexView(LoginRequiredMixin, PermissionRequiredMixin, LateralMenuMixin, TemplateView):
@@ -103,6 +105,7 @@ class ConfigurationProfitView(ConfigurationChangeBaseView):
         margin_profit = configuration_get('MARGIN_PROFIT')
         margin_profit.value = form.cleaned_data['margin_profit']
         margin_profit.save()
+        update_automatic_prices(Product.objects.all())
         return super().form_valid(form)
 
 
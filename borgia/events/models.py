@@ -2,9 +2,10 @@ import decimal
 
 from django.core.exceptions import ObjectDoesNotExist
 from django.core.validators import MinValueValidator
-from django.db import models
+from django.db import models, transaction
 from django.utils.timezone import now
 
+from finances.models import LedgerEntry
 from users.models import User
 
 
@@ -208,6 +209,7 @@ class Event(models.Model):
         else:
             return 0
 
+    @transaction.atomic
     def pay_by_total(self, operator, recipient, total_price):
         """
         Procède au paiement de l'évenement par les participants.
@@ -228,17 +230,21 @@ class Event(models.Model):
         except (ZeroDivisionError, decimal.DivisionUndefined, decimal.DivisionByZero):
             return
 
+        self.datetime = now()
+        ledger_entries = []
         for e in self.weightsuser_set.all():
             user_price = final_price_per_weight * e.weights_participation
             e.user.debit(user_price)
             recipient.credit(user_price)
+            ledger_entries.append(self.ledger_entry(e.user, user_price))
+        LedgerEntry.objects.bulk_create(ledger_entries)
 
         self.price = total_price
-        self.datetime = now()
         self.remark = 'Paiement par Borgia (Prix total : ' + \
             str(total_price) + ')'
         self.save()
 
+    @transaction.atomic
     def pay_by_ponderation(self, operator, recipient, ponderation_price):
         """
         Procède au paiement de l'évenement par les participants.
@@ -253,20 +259,36 @@ class Event(models.Model):
         self.done = True
         self.save()
 
+        self.datetime = now()
+        ledger_entries = []
         for weights in self.weightsuser_set.all():
             weight = weights.weights_participation
             if weight != 0:
                 user_price = ponderation_price * weight
                 weights.user.debit(user_price)
                 recipient.credit(user_price)
+                ledger_entries.append(self.ledger_entry(weights.user, user_price))
+        LedgerEntry.objects.bulk_create(ledger_entries)
 
         self.payment_by_ponderation = True
         self.price = ponderation_price
-        self.datetime = now()
         self.remark = 'Paiement par Borgia (Prix par pondération: ' + \
             str(ponderation_price) + ')'
         self.save()
 
+    def ledger_entry(self, user, user_price):
+        """
+        Return the (unsaved) ledger entry of the payment of a participant.
+        """
+        return LedgerEntry(
+            user=user,
+            datetime=self.datetime,
+            kind='event',
+            amount=-user_price,
+            label=self.description.capitalize() + ' le ' + self.date.strftime("%d %h %Y"),
+            source=self
+        )
+
     def end_without_payment(self, remark):
         """
         Termine l'évènement sans effectuer de paiement
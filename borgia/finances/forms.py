@@ -8,6 +8,8 @@ from django.core.validators import RegexValidator
 from django.forms.widgets import PasswordInput
 
 from borgia.validators import autocomplete_username_validator
+from finances.models import Cheque
+from finances.utils import read_reconciliation_rows
 from users.models import User
 
 
@@ -83,6 +85,52 @@ class RechargingListForm(GenericListSearchDateForm):
             required=False)
 
 
+class RechargingImportForm(forms.Form):
+    kind = forms.ChoiceField(label='Type de relevé',
+                             choices=(('lydia', 'Lydia'), ('cheque', 'Chèques')))
+    statement = forms.FileField(
+        label='Fichier CSV',
+        help_text='Colonnes : Utilisateur, Numéro, Montant et Date (JJ/MM/AAAA, facultative)',
+        widget=forms.ClearableFileInput(attrs={'class': 'btn btn-default btn-file'}))
+
+    def clean(self):
+        """
+        Replace the file by its rows, see read_reconciliation_rows.
+        """
+        cleaned_data = super().clean()
+        statement = cleaned_data.get('statement')
+        if statement is None or 'kind' not in cleaned_data:
+            return cleaned_data
+
+        try:
+            lines = statement.read().decode('utf-8-sig').splitlines()
+        except UnicodeDecodeError:
+            raise forms.ValidationError("Le fichier doit être un CSV encodé en UTF-8")
+        try:
+            cleaned_data['statement'] = read_reconciliation_rows(lines, cleaned_data['kind'])
+        except ValueError as error:
+            raise forms.ValidationError(str(error))
+        return cleaned_data
+
+
+class ChequeDepositForm(forms.Form):
+    deposit_id = forms.CharField(label='Numéro de remise', max_length=255)
+    date_cashed = forms.DateField(
+        label="Date d'encaissement",
+        input_formats=['%d/%m/%Y'],
+        widget=forms.DateInput(attrs={'class': 'datepicker'}))
+    cheques = forms.ModelMultipleChoiceField(
+        label='Chèques',
+        queryset=Cheque.objects.filter(is_cashed=False),
+        widget=forms.MultipleHiddenInput)
+
+    def clean_deposit_id(self):
+        deposit_id = self.cleaned_data['deposit_id']
+        if Cheque.objects.filter(deposit_id=deposit_id).exists():
+            raise forms.ValidationError('Ce numéro de remise existe déjà')
+        return deposit_id
+
+
 class ExceptionnalMovementForm(forms.Form):
     type_movement = forms.ChoiceField(choices=(('debit', 'Débit'),
                                                ('credit', 'Crédit')),
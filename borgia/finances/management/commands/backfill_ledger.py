@@ -0,0 +1,83 @@
+"""
+Rebuild the ledger from the existing transactions.
+"""
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from events.models import Event
+from finances.models import (ExceptionnalMovement, LedgerEntry, Recharging,
+                             Transfert)
+from sales.models import Sale
+
+
+def iterate_by_pk(queryset, batch_size):
+    """
+    Iterate over a queryset by chunks of batch_size objects, ordered by pk.
+
+    Unlike queryset.iterator(), prefetch_related is still applied to each
+    chunk.
+    """
+    last_pk = 0
+    while True:
+        batch = list(queryset.filter(pk__gt=last_pk).order_by('pk')[:batch_size])
+        if not batch:
+            return
+        for obj in batch:
+            yield obj
+        last_pk = batch[-1].pk
+
+
+class Command(BaseCommand):
+    help = 'Delete all ledger entries and create them again from sales, transferts, ' \
+           'rechargings, exceptionnal movements and finished events.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Number of objects loaded and inserted at once.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        count = 0
+        with transaction.atomic():
+            LedgerEntry.objects.all().delete()
+            entries = []
+            for entry in self.get_entries(batch_size):
+                entries.append(entry)
+                if len(entries) >= batch_size:
+                    LedgerEntry.objects.bulk_create(entries)
+                    count += len(entries)
+                    entries = []
+            LedgerEntry.objects.bulk_create(entries)
+            count += len(entries)
+
+        self.stdout.write(self.style.SUCCESS(
+            '{0} ledger entries created.'.format(count)))
+
+    @staticmethod
+    def get_entries(batch_size):
+        sales = Sale.objects.with_products().select_related('sender', 'shop')
+        for sale in iterate_by_pk(sales, batch_size):
+            amount = sale.amount()
+            if amount != 0:
+                yield sale.ledger_entry(amount)
+
+        transferts = Transfert.objects.select_related('sender', 'recipient')
+        for transfert in iterate_by_pk(transferts, batch_size):
+            for entry in transfert.ledger_entries():
+                yield entry
+
+        rechargings = Recharging.objects.with_solution().select_related('sender')
+        for recharging in iterate_by_pk(rechargings, batch_size):
+            yield recharging.ledger_entry()
+
+        exceptionnal_movements = ExceptionnalMovement.objects.select_related(
+            'operator', 'recipient')
+        for exceptionnal_movement in iterate_by_pk(exceptionnal_movements, batch_size):
+            yield exceptionnal_movement.ledger_entry()
+
+        events = Event.objects.filter(done=True).prefetch_related('weightsuser_set__user')
+        for event in iterate_by_pk(events, batch_size):
+            for weights_user in event.weightsuser_set.all():
+                user_price = event.get_price_of_user(weights_user.user)
+                if user_price != 0:
+                    yield event.ledger_entry(weights_user.user, user_price)
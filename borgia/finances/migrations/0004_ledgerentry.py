@@ -0,0 +1,38 @@
+# Generated by Django 2.2.28 on 2026-10-18 18:38
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('finances', '0003_lydia_fee'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LedgerEntry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('datetime', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Date')),
+                ('kind', models.CharField(choices=[('sale', 'Achat'), ('transfert', 'Transfert'), ('recharging', 'Rechargement'), ('exceptionnal_movement', 'Mouvement exceptionnel'), ('event', 'Evénement')], max_length=50, verbose_name='Type')),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=9, verbose_name='Montant')),
+                ('label', models.TextField(blank=True, verbose_name='Libellé')),
+                ('source_id', models.PositiveIntegerField()),
+                ('content_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='contenttypes.ContentType')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ledger_entries', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'default_permissions': (),
+            },
+        ),
+        migrations.AddIndex(
+            model_name='ledgerentry',
+            index=models.Index(fields=['user', '-datetime'], name='finances_le_user_id_4763ac_idx'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 2.2.28 on 2026-10-18 19:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finances', '0004_ledgerentry'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='exceptionnalmovement',
+            index=models.Index(fields=['datetime', 'id'], name='finances_ex_datetim_c4de80_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recharging',
+            index=models.Index(fields=['datetime', 'id'], name='finances_re_datetim_9c8c77_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transfert',
+            index=models.Index(fields=['datetime', 'id'], name='finances_tr_datetim_2de166_idx'),
+        ),
+    ]
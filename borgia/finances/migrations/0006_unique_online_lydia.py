@@ -0,0 +1,44 @@
+# Generated by Django 2.2.28 on 2026-10-18 19:51
+
+import sys
+
+from django.db import migrations, models
+
+
+def rename_duplicate_online_lydias(apps, schema_editor):
+    """
+    Rename the online Lydias recorded more than once, before they are made
+    unique: the first one is kept, the others get a '-dup<pk>' suffix.
+
+    :note:: Renamed Lydias are reported, the users may have been credited
+    twice and their rechargings must be checked by a treasurer.
+    """
+    Lydia = apps.get_model('finances', 'Lydia')
+
+    duplicated = Lydia.objects.filter(is_online=True).values('id_from_lydia').annotate(
+        nb=models.Count('pk')).filter(nb__gt=1).values_list('id_from_lydia', flat=True)
+    kept = set()
+    for lydia in Lydia.objects.filter(is_online=True, id_from_lydia__in=list(duplicated)
+                                      ).order_by('pk'):
+        if lydia.id_from_lydia not in kept:
+            kept.add(lydia.id_from_lydia)
+            continue
+        sys.stdout.write('\n  Online Lydia {0} recorded twice, renamed {0}-dup{1}'.format(
+            lydia.id_from_lydia, lydia.pk))
+        lydia.id_from_lydia += '-dup' + str(lydia.pk)
+        lydia.save(update_fields=['id_from_lydia'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finances', '0005_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(rename_duplicate_online_lydias, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='lydia',
+            constraint=models.UniqueConstraint(condition=models.Q(is_online=True), fields=('id_from_lydia',), name='unique_online_lydia'),
+        ),
+    ]
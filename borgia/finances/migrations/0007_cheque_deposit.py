@@ -0,0 +1,49 @@
+# Generated by Django 2.2.28 on 2026-10-18 19:58
+
+from django.contrib.auth.management import create_permissions
+from django.db import migrations, models
+
+
+def grant_cheque_permissions(apps, schema_editor):
+    """
+    Allow presidents, vice presidents and treasurers to bank cheques, as in
+    the initial fixture.
+    """
+    app_config = apps.get_app_config('finances')
+    # Permissions are otherwise created after all migrations
+    app_config.models_module = True
+    create_permissions(app_config, apps=apps, verbosity=0)
+    app_config.models_module = None
+
+    Group = apps.get_model('auth', 'Group')
+    Permission = apps.get_model('auth', 'Permission')
+    permissions = Permission.objects.filter(content_type__app_label='finances',
+                                            codename__in=['change_cheque', 'view_cheque'])
+    for group in Group.objects.filter(name__in=['presidents', 'vice_presidents', 'treasurers']):
+        group.permissions.add(*permissions)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0011_update_proxy_permissions'),
+        ('finances', '0006_unique_online_lydia'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='cheque',
+            options={'default_permissions': ('change', 'view')},
+        ),
+        migrations.AddField(
+            model_name='cheque',
+            name='date_cashed',
+            field=models.DateField(blank=True, null=True, verbose_name="Date d'encaissement"),
+        ),
+        migrations.AddField(
+            model_name='cheque',
+            name='deposit_id',
+            field=models.CharField(blank=True, db_index=True, max_length=255, null=True, verbose_name='Numéro de remise'),
+        ),
+        migrations.RunPython(grant_cheque_permissions, migrations.RunPython.noop),
+    ]
@@ -4,7 +4,7 @@ from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
 from django.core.exceptions import ObjectDoesNotExist
 from django.core.validators import MinValueValidator, RegexValidator
-from django.db import models
+from django.db import models, transaction
 from django.utils.timezone import now
 
 from users.models import User
@@ -14,6 +14,25 @@ from users.models import User
 # TODO: event line in tables users, products/payments and function.
 
 
+class RechargingQuerySet(models.QuerySet):
+    """
+    QuerySet of rechargings, with a helper to load the payment solutions of
+    several rechargings at once.
+    """
+
+    def with_solution(self):
+        """
+        Prefetch the payment solution (Cash, Cheque or Lydia) of each
+        recharging and its sender, with one query per type of solution and
+        one for senders.
+
+        :note:: Rechargings are grouped by content type by the prefetch of
+        the generic foreign key, content types are read from the cache of
+        ContentType.objects.
+        """
+        return self.prefetch_related('content_solution__sender')
+
+
 class Recharging(models.Model):
     """
     Allow an operator to recharge (supply money) the balance of a sender
@@ -27,6 +46,8 @@ class Recharging(models.Model):
     solution_id = models.PositiveIntegerField()
     content_solution = GenericForeignKey('content_type', 'solution_id')
 
+    objects = RechargingQuerySet.as_manager()
+
     class Meta:
         """
         Define Permissions for Recharging.
@@ -34,6 +55,9 @@ class Recharging(models.Model):
         :note:: Initial Django Permission (add, view) are added.
         """
         default_permissions = ('add', 'view',)
+        indexes = [
+            models.Index(fields=['datetime', 'id'])
+        ]
 
     def __str__(self):
         return 'Rechargement de ' + str(self.amount()) + '€.'
@@ -42,7 +66,22 @@ class Recharging(models.Model):
         return self.content_solution.amount
 
     def pay(self):
-        self.sender.credit(self.amount())
+        with transaction.atomic():
+            self.sender.credit(self.amount())
+            self.ledger_entry().save()
+
+    def ledger_entry(self):
+        """
+        Return the (unsaved) ledger entry of the recharging.
+        """
+        return LedgerEntry(
+            user=self.sender,
+            datetime=self.datetime,
+            kind='recharging',
+            amount=self.amount(),
+            label=self.content_solution.ledger_label(),
+            source=self
+        )
 
 
 class Transfert(models.Model):
@@ -63,14 +102,36 @@ class Transfert(models.Model):
         :note:: Initial Django Permission (add, view) are added.
         """
         default_permissions = ('add', 'view',)
+        indexes = [
+            models.Index(fields=['datetime', 'id'])
+        ]
 
     def __str__(self):
         return 'Transfert de ' + self.sender.__str__() + ' à ' + self.recipient.__str__() +', ' + self.justification
 
     def pay(self):
         if self.sender.debit != self.recipient.credit:
-            self.sender.debit(self.amount)
-            self.recipient.credit(self.amount)
+            with transaction.atomic():
+                # Lock both users in a fixed order, so that two crossed
+                # transferts can't deadlock each other.
+                list(User.objects.select_for_update().filter(
+                    pk__in=[self.sender.pk, self.recipient.pk]).order_by('pk'))
+                self.sender.debit(self.amount)
+                self.recipient.credit(self.amount)
+                LedgerEntry.objects.bulk_create(self.ledger_entries())
+
+    def ledger_entries(self):
+        """
+        Return the (unsaved) ledger entries of the sender and the recipient.
+        """
+        label = ('De ' + self.sender.__str__() + ' à ' + self.recipient.__str__()
+                 + ', ' + (self.justification or ''))
+        return [
+            LedgerEntry(user=self.sender, datetime=self.datetime, kind='transfert',
+                        amount=-self.amount, label=label, source=self),
+            LedgerEntry(user=self.recipient, datetime=self.datetime, kind='transfert',
+                        amount=self.amount, label=label, source=self)
+        ]
 
 
 class ExceptionnalMovement(models.Model):
@@ -92,6 +153,9 @@ class ExceptionnalMovement(models.Model):
         :note:: Initial Django Permission (add, view) are added.
         """
         default_permissions = ('add', 'view',)
+        indexes = [
+            models.Index(fields=['datetime', 'id'])
+        ]
 
     def __str__(self):
         return 'Mouvement exceptionnel de ' + str(self.amount) + '€, ' + self.justification
@@ -100,10 +164,25 @@ class ExceptionnalMovement(models.Model):
         '''
         Add/Remove money from recipient
         '''
-        if self.is_credit:
-            self.recipient.credit(self.amount)
-        else:
-            self.recipient.debit(self.amount)
+        with transaction.atomic():
+            if self.is_credit:
+                self.recipient.credit(self.amount)
+            else:
+                self.recipient.debit(self.amount)
+            self.ledger_entry().save()
+
+    def ledger_entry(self):
+        """
+        Return the (unsaved) ledger entry of the movement.
+        """
+        return LedgerEntry(
+            user=self.recipient,
+            datetime=self.datetime,
+            kind='exceptionnal_movement',
+            amount=self.amount if self.is_credit else -self.amount,
+            label='De ' + self.operator.__str__() + ', ' + (self.justification or ''),
+            source=self
+        )
 
 
 class BaseRechargingSolution(models.Model):
@@ -134,9 +213,14 @@ class Cheque(BaseRechargingSolution):
     mandatory.
     :param cheque_number: number of the cheque (written on the paper),
     mandatory.
+    :param deposit_id: reference of the deposit slip of the cheque, only if
+    is_cashed is true.
+    :param date_cashed: date of the deposit, only if is_cashed is true.
     :type is_cashed: boolean, default False
     :type signature_date: date string, default now
     :type cheque_number: string, must match ^[0-9]{7}$
+    :type deposit_id: string
+    :type date_cashed: date string
     """
     is_cashed = models.BooleanField('Est encaissé', default=False)
     signature_date = models.DateField('Date de signature', default=now)
@@ -145,10 +229,25 @@ class Cheque(BaseRechargingSolution):
                                          RegexValidator('^[0-9]{7}$',
                                                         '''Numéro de chèque
                                                         invalide''')])
+    deposit_id = models.CharField('Numéro de remise', max_length=255, null=True,
+                                  blank=True, db_index=True)
+    date_cashed = models.DateField("Date d'encaissement", null=True, blank=True)
+
+    class Meta(BaseRechargingSolution.Meta):
+        """
+        Define Permissions for Cheque.
+
+        :note:: Initial Django Permission (change, view) are added, to bank
+        cheques and list them.
+        """
+        default_permissions = ('change', 'view',)
 
     def __str__(self):
         return 'Cheque de ' + str(self.amount) + '€, n°' + self.cheque_number
 
+    def ledger_label(self):
+        return 'Cheque n°' + self.cheque_number
+
 
 class Cash(BaseRechargingSolution):
     """
@@ -160,6 +259,9 @@ class Cash(BaseRechargingSolution):
     def __str__(self):
         return 'Cash de ' + str(self.amount) + '€'
 
+    def ledger_label(self):
+        return 'Cash'
+
 
 class Lydia(BaseRechargingSolution):
     """
@@ -184,5 +286,80 @@ class Lydia(BaseRechargingSolution):
                               max_digits=9,
                               validators=[MinValueValidator(decimal.Decimal(0))])
 
+    class Meta(BaseRechargingSolution.Meta):
+        """
+        Keep the options of BaseRechargingSolution.
+
+        :note:: An online Lydia transaction can only be recorded once, face to
+        face ones are typed by operators and aren't constrained.
+        """
+        constraints = [
+            models.UniqueConstraint(fields=['id_from_lydia'],
+                                    condition=models.Q(is_online=True),
+                                    name='unique_online_lydia')
+        ]
+
     def __str__(self):
         return 'Lydia de ' + str(self.amount) + '€, n°' + self.id_from_lydia
+
+    def ledger_label(self):
+        return 'Lydia n°' + self.id_from_lydia
+
+
+class LedgerEntry(models.Model):
+    """
+    Define a line of the history of a user balance.
+
+    The ledger is append-only and denormalized: one entry is written for each
+    user concerned when a transaction is paid (sales, transferts, rechargings,
+    exceptionnal movements and events). The history of a user is then read with
+    a single indexed query, instead of merging every type of transaction.
+
+    :note:: Entries of the existing history can be created with the
+    backfill_ledger management command.
+
+    :param user: user whose balance moved, mandatory.
+    :param datetime: date of the transaction, mandatory.
+    :param kind: type of the transaction, mandatory.
+    :param amount: signed amount, negative for a debit, mandatory.
+    :param label: human readable description, mandatory.
+    :param source: the transaction paid, mandatory.
+    :type user: User object
+    :type datetime: date string, default now
+    :type kind: string, must be in KIND_CHOICES
+    :type amount: decimal
+    :type label: string
+    :type source: Sale, Transfert, Recharging, ExceptionnalMovement or Event
+    """
+    KIND_CHOICES = (
+        ('sale', 'Achat'),
+        ('transfert', 'Transfert'),
+        ('recharging', 'Rechargement'),
+        ('exceptionnal_movement', 'Mouvement exceptionnel'),
+        ('event', 'Evénement')
+    )
+
+    user = models.ForeignKey(User, related_name='ledger_entries',
+                             on_delete=models.CASCADE)
+    datetime = models.DateTimeField('Date', default=now)
+    kind = models.CharField('Type', max_length=50, choices=KIND_CHOICES)
+    amount = models.DecimalField('Montant', decimal_places=2, max_digits=9)
+    label = models.TextField('Libellé', blank=True)
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+    source_id = models.PositiveIntegerField()
+    source = GenericForeignKey('content_type', 'source_id')
+
+    class Meta:
+        """
+        Remove default permissions for LedgerEntry.
+        """
+        default_permissions = ()
+        indexes = [
+            models.Index(fields=['user', '-datetime'])
+        ]
+
+    def __str__(self):
+        return self.get_kind_display() + ' de ' + str(self.amount) + '€, ' + self.label
+
+    def is_credit(self):
+        return self.amount > 0
@@ -0,0 +1,102 @@
+import decimal
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase
+
+from events.models import Event, WeightsUser
+from finances.models import (Cash, Cheque, ExceptionnalMovement, LedgerEntry,
+                             Recharging, Transfert)
+from modules.models import SelfSaleModule
+from sales.models import Sale, SaleProduct
+from shops.models import Product, Shop
+from users.models import User
+
+
+class LedgerEntryTestCase(TestCase):
+    def setUp(self):
+        self.user1 = User.objects.create(username='user1', balance=100)
+        self.user2 = User.objects.create(username='user2', balance=100)
+        self.shop1 = Shop.objects.create(
+            name='shop1', description='The first shop ever.', color='#F4FA58')
+        self.module1 = SelfSaleModule.objects.create(shop=self.shop1, state=True)
+        self.product1 = Product.objects.create(name='skoll', shop=self.shop1)
+
+    def create_sale(self):
+        sale = Sale.objects.create(
+            sender=self.user1, recipient=self.user2, operator=self.user1,
+            shop=self.shop1, module=self.module1)
+        SaleProduct.objects.create(
+            sale=sale, product=self.product1, quantity=2, price=decimal.Decimal('3.20'))
+        return sale
+
+    def assertLedgerEqual(self, user, expected):
+        self.assertListEqual(
+            [(entry.kind, entry.amount) for entry in
+             LedgerEntry.objects.filter(user=user).order_by('datetime', 'pk')],
+            expected)
+
+    def test_sale_pay(self):
+        sale = self.create_sale()
+        sale.pay()
+        self.assertLedgerEqual(self.user1, [('sale', decimal.Decimal('-3.20'))])
+        entry = LedgerEntry.objects.get(user=self.user1)
+        self.assertEqual(entry.source, sale)
+        self.assertEqual(entry.label, 'Shop1, skoll x 2')
+        self.assertFalse(entry.is_credit())
+
+    def test_transfert_pay(self):
+        Transfert.objects.create(
+            sender=self.user1, recipient=self.user2, amount=10, justification='beer').pay()
+        self.assertLedgerEqual(self.user1, [('transfert', decimal.Decimal(-10))])
+        self.assertLedgerEqual(self.user2, [('transfert', decimal.Decimal(10))])
+
+    def test_recharging_pay(self):
+        cheque = Cheque.objects.create(
+            sender=self.user1, amount=20, cheque_number='0000001')
+        Recharging.objects.create(
+            sender=self.user1, operator=self.user2, content_solution=cheque).pay()
+        self.assertLedgerEqual(self.user1, [('recharging', decimal.Decimal(20))])
+        self.assertEqual(LedgerEntry.objects.get(user=self.user1).label, 'Cheque n°0000001')
+
+    def test_exceptionnal_movement_pay(self):
+        ExceptionnalMovement.objects.create(
+            operator=self.user2, recipient=self.user1, amount=5, is_credit=True,
+            justification='gift').pay()
+        ExceptionnalMovement.objects.create(
+            operator=self.user2, recipient=self.user1, amount=2, is_credit=False,
+            justification='fine').pay()
+        self.assertLedgerEqual(self.user1, [('exceptionnal_movement', decimal.Decimal(5)),
+                                            ('exceptionnal_movement', decimal.Decimal(-2))])
+
+    def test_event_pay(self):
+        event = Event.objects.create(description='gala', manager=self.user2)
+        WeightsUser.objects.create(user=self.user1, event=event, weights_participation=1)
+        WeightsUser.objects.create(user=self.user2, event=event, weights_participation=3)
+        event.pay_by_total(self.user2, self.user2, decimal.Decimal(40))
+        self.assertLedgerEqual(self.user1, [('event', decimal.Decimal(-10))])
+        self.assertLedgerEqual(self.user2, [('event', decimal.Decimal(-30))])
+
+    def test_backfill_ledger(self):
+        self.create_sale().pay()
+        Transfert.objects.create(
+            sender=self.user1, recipient=self.user2, amount=10, justification='beer').pay()
+        cash = Cash.objects.create(sender=self.user1, amount=20)
+        Recharging.objects.create(
+            sender=self.user1, operator=self.user2, content_solution=cash).pay()
+        ExceptionnalMovement.objects.create(
+            operator=self.user2, recipient=self.user1, amount=5, is_credit=True,
+            justification='gift').pay()
+
+        def ledger():
+            return list(LedgerEntry.objects.order_by('user', 'kind', 'source_id').values_list(
+                'user', 'datetime', 'kind', 'amount', 'label', 'content_type', 'source_id'))
+
+        expected = ledger()
+        LedgerEntry.objects.all().delete()
+        call_command('backfill_ledger', batch_size=2, stdout=StringIO())
+        self.assertListEqual(ledger(), expected)
+
+        # Running it again doesn't duplicate entries
+        call_command('backfill_ledger', stdout=StringIO())
+        self.assertListEqual(ledger(), expected)
@@ -0,0 +1,38 @@
+import io
+from contextlib import redirect_stdout
+
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TransactionTestCase
+
+
+class UniqueOnlineLydiaMigrationTests(TransactionTestCase):
+    migrate_from = [('finances', '0005_keyset_indexes')]
+    migrate_to = [('finances', '0006_unique_online_lydia')]
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        self.migrate(MigrationExecutor(connection).loader.graph.leaf_nodes())
+
+    def test_duplicates_renamed(self):
+        apps = self.migrate(self.migrate_from)
+        User = apps.get_model('users', 'User')
+        Lydia = apps.get_model('finances', 'Lydia')
+        user = User.objects.create(username='user')
+        lydias = [Lydia.objects.create(sender=user, amount=10, id_from_lydia=number,
+                                       is_online=is_online)
+                  for number, is_online in (('TX1', True), ('TX1', True), ('TX1', False),
+                                            ('TX2', True))]
+
+        output = io.StringIO()
+        with redirect_stdout(output):
+            apps = self.migrate(self.migrate_to)
+        Lydia = apps.get_model('finances', 'Lydia')
+        self.assertEqual(list(Lydia.objects.order_by('pk').values_list('id_from_lydia', flat=True)),
+                         ['TX1', 'TX1-dup' + str(lydias[1].pk), 'TX1', 'TX2'])
+        self.assertIn('TX1-dup' + str(lydias[1].pk), output.getvalue())
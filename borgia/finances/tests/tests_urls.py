@@ -11,11 +11,18 @@ class FinancesNamedURLTests(TestCase):
             ('url_user_exceptionnalmovement_create', [], {'user_pk': 53}),
             ('url_recharging_create', [], {'user_pk': 53}),
             ('url_recharging_list', [], {}),
+            ('url_recharging_solution_list', [], {}),
+            ('url_recharging_export', [], {}),
+            ('url_recharging_import', [], {}),
             ('url_recharging_retrieve', [], {'recharging_pk': 53}),
+            ('url_cheque_deposit_list', [], {}),
+            ('url_cheque_deposit_export', [], {}),
             ('url_transfert_list', [], {}),
+            ('url_transfert_export', [], {}),
             ('url_transfert_create', [], {}),
             ('url_transfert_retrieve', [], {'transfert_pk': 53}),
             ('url_exceptionnalmovement_list', [], {}),
+            ('url_exceptionnalmovement_export', [], {}),
             ('url_exceptionnalmovement_retrieve',
              [], {'exceptionnalmovement_pk': 53}),
             ('url_self_lydia_create', [], {}),
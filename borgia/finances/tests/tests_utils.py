@@ -1,8 +1,20 @@
+import datetime
 import decimal
 
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
 from django.test import TestCase
-from finances.utils import (calculate_lydia_fee_from_total,
-                            calculate_total_amount_lydia)
+from django.utils.timezone import now
+
+from configurations.models import Configuration
+from finances.models import Cash, Cheque, LedgerEntry, Lydia, Recharging
+from finances.utils import (bank_cheques, calculate_lydia_fee_from_total,
+                            calculate_total_amount_lydia, cheque_deposit_rows,
+                            cheque_deposits, create_online_lydia_recharging,
+                            get_lydia_fee_config, read_reconciliation_rows,
+                            reconcile_rechargings, recharging_export_rows, recharging_solutions,
+                            rechargings_aggregate)
+from users.models import User
 
 
 class CalculationsLydiaTestCase(TestCase):
@@ -85,3 +97,247 @@ class CalculationsLydiaTestCase(TestCase):
             recharging_amount, base_fee, ratio_fee, tax_fee)
         expected = decimal.Decimal('53.00')
         self.assertEqual(expected, total)
+
+
+class RechargingsAggregateTestCase(TestCase):
+    def setUp(self):
+        self.user1 = User.objects.create(username='user1')
+        self.user2 = User.objects.create(username='user2')
+        for solution in (Cash.objects.create(sender=self.user1, amount=10),
+                         Cash.objects.create(sender=self.user1, amount=5),
+                         Cheque.objects.create(sender=self.user1, amount=20,
+                                               cheque_number='0000001'),
+                         Lydia.objects.create(sender=self.user1, amount=30,
+                                              id_from_lydia='1', is_online=False),
+                         Lydia.objects.create(sender=self.user1, amount=7,
+                                              id_from_lydia='2'),
+                         Lydia.objects.create(sender=self.user1, amount=8,
+                                              id_from_lydia='3')):
+            Recharging.objects.create(
+                sender=self.user1, operator=self.user2, content_solution=solution)
+        # Out of the period
+        self.old_cash = Cash.objects.create(sender=self.user1, amount=100)
+        Recharging.objects.create(
+            sender=self.user1, operator=self.user2, content_solution=self.old_cash,
+            datetime=now() - datetime.timedelta(days=30))
+        # Solution without recharging
+        Cash.objects.create(sender=self.user1, amount=1000)
+
+    def get_rechargings(self):
+        return Recharging.objects.filter(datetime__gte=now() - datetime.timedelta(days=7))
+
+    def test_rechargings_aggregate(self):
+        with self.assertNumQueries(3):
+            info = rechargings_aggregate(self.get_rechargings())
+        self.assertDictEqual(info, {
+            'cash': {'total': 15, 'nb': 2},
+            'cheque': {'total': 20, 'nb': 1},
+            'lydia_face2face': {'total': 30, 'nb': 1},
+            'lydia_online': {'total': 15, 'nb': 2},
+            'total': {'total': 80, 'nb': 6}
+        })
+
+    def test_rechargings_aggregate_empty(self):
+        info = rechargings_aggregate(Recharging.objects.none())
+        self.assertEqual(info['total'], {'total': 0, 'nb': 0})
+        self.assertEqual(info['lydia_online'], {'total': 0, 'nb': 0})
+
+    def test_recharging_solutions(self):
+        self.assertListEqual(
+            sorted(cash.amount for cash in recharging_solutions(self.get_rechargings(), 'cash')),
+            [5, 10])
+        self.assertListEqual(
+            [lydia.id_from_lydia for lydia in recharging_solutions(
+                self.get_rechargings(), 'lydia_face2face')],
+            ['1'])
+        self.assertIn(self.old_cash, recharging_solutions(Recharging.objects.all(), 'cash'))
+
+    def test_recharging_export_rows(self):
+        # One query for the rechargings, one by model of solution
+        with self.assertNumQueries(4):
+            rows = list(recharging_export_rows(self.get_rechargings()))
+        self.assertEqual(len(rows), 6)
+        self.assertEqual(rows[0][1:], ['user1', 'user2', 10, 'Espèces', '', '', ''])
+        self.assertEqual(rows[2][4:7], ['Chèque', '0000001', ''])
+        self.assertEqual(rows[3][4:7], ['Lydia face à face', '', '1'])
+        self.assertIsNone(rows[0][0].tzinfo)
+
+
+class OnlineLydiaTestCase(TestCase):
+    fixtures = ['initial']
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='user', balance=0)
+
+    def test_create_online_lydia_recharging(self):
+        recharging = create_online_lydia_recharging(self.user, 'T1', decimal.Decimal(10), 0)
+        self.assertEqual(recharging.content_solution.id_from_lydia, 'T1')
+        self.assertIsNone(create_online_lydia_recharging(self.user, 'T1', decimal.Decimal(10), 0))
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.balance, 10)
+        self.assertEqual(Recharging.objects.filter(sender=self.user).count(), 1)
+
+    def test_face2face_not_unique(self):
+        create_online_lydia_recharging(self.user, 'T1', decimal.Decimal(10), 0)
+        Lydia.objects.create(sender=self.user, amount=5, id_from_lydia='T1', is_online=False)
+        Lydia.objects.create(sender=self.user, amount=5, id_from_lydia='T1', is_online=False)
+        self.assertEqual(Lydia.objects.filter(id_from_lydia='T1').count(), 3)
+
+    def test_get_lydia_fee_config(self):
+        self.assertIsNone(get_lydia_fee_config())
+        Configuration.objects.filter(name='ENABLE_FEE_LYDIA').update(value='True')
+        Configuration.objects.filter(name='RATIO_FEE_LYDIA').update(value='1.5')
+        cache.clear()
+        with self.assertNumQueries(1):
+            config = get_lydia_fee_config()
+        self.assertEqual(config, {'base_fee': 0, 'ratio_fee': decimal.Decimal('1.50'),
+                                  'tax_fee': 0})
+
+
+class ReconciliationTestCase(TestCase):
+    fixtures = ['initial']
+
+    def setUp(self):
+        cache.clear()
+        self.operator = User.objects.create(username='operator')
+        self.user1 = User.objects.create(username='user1', balance=0)
+        self.user2 = User.objects.create(username='user2', balance=0)
+        # Recorded
+        for number, amount in (('L0', 4), ('L1', 10)):
+            Recharging.objects.create(
+                sender=self.user1, operator=self.operator,
+                content_solution=Lydia.objects.create(sender=self.user1, amount=amount,
+                                                      id_from_lydia=number))
+        # Without recharging
+        Lydia.objects.create(sender=self.user2, amount=7, id_from_lydia='L2', is_online=False)
+
+    def test_read_reconciliation_rows(self):
+        rows = read_reconciliation_rows([
+            'Numéro;Montant;Utilisateur;Date',
+            '0000001;10,50;user1;01/02/2019',
+            '',
+            '0000002;abc;user1;',
+            '12;5;user1;',
+            '0000003;5;user1;2019-02-01'
+        ], 'cheque')
+        self.assertEqual(len(rows), 4)
+        self.assertEqual(rows[0]['amount'], decimal.Decimal('10.50'))
+        self.assertEqual(rows[0]['date'], datetime.date(2019, 2, 1))
+        self.assertIsNone(rows[0]['error'])
+        self.assertEqual([row['error'] for row in rows[1:]],
+                         ['Montant invalide', 'Numéro de chèque invalide', 'Date invalide'])
+        self.assertEqual(rows[3]['line'], 6)
+
+    def test_missing_columns(self):
+        with self.assertRaises(ValueError):
+            read_reconciliation_rows(['Utilisateur,Montant', 'user1,10'], 'lydia')
+
+    def test_reconcile_rechargings(self):
+        rows = read_reconciliation_rows([
+            'Utilisateur,Numéro,Montant',
+            'user1,L1,8',
+            ',L2,7',
+            'user1,L3,5',
+            'user2,L4,3',
+            'user2,L4,3',
+            'user1,L5,12',
+            'nobody,L6,4',
+            'user1,L0,4'
+        ], 'lydia')
+        report = reconcile_rechargings(rows, 'lydia', self.operator, chunk_size=3)
+
+        self.assertEqual([row['number'] for row in report['created']], ['L2', 'L3', 'L4', 'L5'])
+        self.assertEqual([row['number'] for row in report['matched']], ['L0'])
+        self.assertEqual([row['line'] for row in report['duplicates']], [6])
+        self.assertEqual([row['error'] for row in report['unmatched']],
+                         ['Montant différent dans Borgia (10.00€)', 'Utilisateur inconnu'])
+
+        self.user1.refresh_from_db()
+        self.user2.refresh_from_db()
+        self.assertEqual(self.user1.balance, 17)
+        self.assertEqual(self.user2.balance, 10)
+        for number in ('L2', 'L3', 'L4', 'L5'):
+            lydia = Lydia.objects.get(id_from_lydia=number)
+            recharging = Recharging.objects.get(solution_id=lydia.pk, content_type__model='lydia')
+            self.assertEqual(recharging.operator, self.operator)
+            self.assertEqual(LedgerEntry.objects.get(source_id=recharging.pk,
+                                                     kind='recharging').amount, lydia.amount)
+        self.assertTrue(Lydia.objects.get(id_from_lydia='L3').is_online)
+
+        # Importing the statement again changes nothing
+        report = reconcile_rechargings(rows, 'lydia', self.operator)
+        self.assertEqual(len(report['created']), 0)
+        self.assertEqual(len(report['matched']), 5)
+        self.user1.refresh_from_db()
+        self.assertEqual(self.user1.balance, 17)
+
+    def test_import_then_callback(self):
+        reconcile_rechargings(read_reconciliation_rows(
+            ['Utilisateur,Numéro,Montant', 'user1,T9,10'], 'lydia'), 'lydia', self.operator)
+        # A late callback of the same transaction doesn't credit again
+        self.assertIsNone(create_online_lydia_recharging(self.user1, 'T9', 10, 0))
+        self.user1.refresh_from_db()
+        self.assertEqual(self.user1.balance, 10)
+        self.assertEqual(Lydia.objects.filter(id_from_lydia='T9').count(), 1)
+
+    def test_lydia_fee(self):
+        Configuration.objects.filter(name='ENABLE_FEE_LYDIA').update(value='True')
+        Configuration.objects.filter(name='BASE_FEE_LYDIA').update(value='0.10')
+        Configuration.objects.filter(name='RATIO_FEE_LYDIA').update(value='1')
+        Configuration.objects.filter(name='TAX_FEE_LYDIA').update(value='1')
+        cache.clear()
+        create_online_lydia_recharging(self.user2, 'T1', decimal.Decimal('9.80'),
+                                       decimal.Decimal('0.20'))
+        rows = read_reconciliation_rows(
+            ['Utilisateur,Numéro,Montant', 'user2,T1,10', 'user2,T2,10'], 'lydia')
+        report = reconcile_rechargings(rows, 'lydia', self.operator)
+
+        # Statement amounts are compared and created fee included
+        self.assertEqual([row['number'] for row in report['matched']], ['T1'])
+        self.assertEqual([row['number'] for row in report['created']], ['T2'])
+        lydia = Lydia.objects.get(id_from_lydia='T2')
+        self.assertEqual((lydia.amount, lydia.fee), (decimal.Decimal('9.80'),
+                                                     decimal.Decimal('0.20')))
+        self.user2.refresh_from_db()
+        self.assertEqual(self.user2.balance, decimal.Decimal('19.60'))
+
+    def test_constant_queries(self):
+        lines = ['Utilisateur,Numéro,Montant'] + [
+            'user1,{0:07d},1'.format(i) for i in range(50)]
+        ContentType.objects.get_for_model(Cheque)
+        with self.assertNumQueries(14):
+            report = reconcile_rechargings(read_reconciliation_rows(lines, 'cheque'), 'cheque',
+                                           self.operator)
+        self.assertEqual(len(report['created']), 50)
+        self.assertEqual(Cheque.objects.filter(sender=self.user1).count(), 50)
+
+
+class ChequeDepositTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='user', first_name='Jean', last_name='Dupont')
+        self.cheques = [Cheque.objects.create(sender=self.user, amount=amount,
+                                              cheque_number='000000' + str(i))
+                        for i, amount in enumerate((10, 20, 30))]
+
+    def test_bank_cheques(self):
+        cheques = Cheque.objects.filter(pk__in=[self.cheques[0].pk, self.cheques[1].pk])
+        with self.assertNumQueries(1):
+            self.assertEqual(bank_cheques(cheques, 'R1', datetime.date(2019, 2, 1)), 2)
+        # Already cashed cheques are not banked again
+        self.assertEqual(bank_cheques(Cheque.objects.all(), 'R2', datetime.date(2019, 2, 2)), 1)
+
+        cheque = Cheque.objects.get(pk=self.cheques[0].pk)
+        self.assertTrue(cheque.is_cashed)
+        self.assertEqual(cheque.deposit_id, 'R1')
+        self.assertEqual(cheque.date_cashed, datetime.date(2019, 2, 1))
+        self.assertEqual(list(cheque_deposits()), [
+            {'deposit_id': 'R2', 'date_cashed': datetime.date(2019, 2, 2), 'total': 30, 'nb': 1},
+            {'deposit_id': 'R1', 'date_cashed': datetime.date(2019, 2, 1), 'total': 30, 'nb': 2}
+        ])
+
+    def test_cheque_deposit_rows(self):
+        rows = list(cheque_deposit_rows(Cheque.objects.filter(sender=self.user)))
+        self.assertEqual(rows[0], ['0000000', 'Jean Dupont',
+                                   Cheque.objects.get(pk=self.cheques[0].pk).signature_date, 10])
+        self.assertEqual(rows[-1], ['Total', '', '', 60])
@@ -1,9 +1,23 @@
-from django.test import Client
+import csv
+import hashlib
+import io
+import threading
+from urllib.parse import quote
+
+import openpyxl
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test import Client, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
 from borgia.tests.tests_views import BaseBorgiaViewsTestCase
-from borgia.tests.utils import get_login_url_redirected
-from finances.models import Cash, ExceptionnalMovement, Recharging, Transfert
+from borgia.tests.utils import get_login_url_redirected, retry_on_lock
+from configurations.models import Configuration
+from finances.models import (Cash, Cheque, ExceptionnalMovement, Lydia, Recharging,
+                             Transfert)
+from users.models import User
 from users.tests.tests_views import BaseFocusUserViewsTestCase
 
 
@@ -14,6 +28,18 @@ class BaseFinancesViewsTestCase(BaseBorgiaViewsTestCase):
         self.recharging1 = Recharging.objects.create(
             sender=self.user2, operator=self.user1, content_solution=cash)
 
+    def create_rechargings(self, number):
+        # Online Lydia identifiers are unique
+        start = Lydia.objects.count()
+        for i in range(number):
+            for solution in (Cash.objects.create(sender=self.user2, amount=10),
+                             Cheque.objects.create(sender=self.user2, amount=20,
+                                                   cheque_number='{0:07d}'.format(i)),
+                             Lydia.objects.create(sender=self.user2, amount=30,
+                                                  id_from_lydia=str(start + i))):
+                Recharging.objects.create(
+                    sender=self.user2, operator=self.user1, content_solution=solution)
+
 
 class GeneralFinancesViewsTests(BaseFinancesViewsTestCase):
     url_view = None
@@ -71,6 +97,109 @@ class RechargingCreateTests(BaseFocusUserViewsTestCase):
 class RechargingListTests(GeneralFinancesViewsTests):
     url_view = 'url_recharging_list'
 
+    def test_constant_queries(self):
+        self.create_rechargings(1)
+        # Lateral menu and content types are cached on first request
+        self.client1.get(self.get_url())
+        with CaptureQueriesContext(connection) as context:
+            response = self.client1.get(self.get_url())
+        self.assertEqual(response.context['info']['total']['nb'], 4)
+
+        self.create_rechargings(10)
+        with self.assertNumQueries(len(context.captured_queries)):
+            response = self.client1.get(self.get_url())
+        self.assertEqual(response.context['info']['total']['nb'], 34)
+        self.assertEqual(response.context['info']['lydia_online']['total'], 330)
+
+
+class RechargingSolutionListTests(GeneralFinancesViewsTests):
+    url_view = 'url_recharging_solution_list'
+
+    def get_url(self):
+        return reverse(self.url_view) + '?kind=cash'
+
+    def test_allowed_user_get(self):
+        super().allowed_user_get()
+
+    def test_not_allowed_user_get(self):
+        super().not_allowed_user_get()
+
+    def test_offline_user_redirection(self):
+        super().offline_user_redirection()
+
+    def test_solution_list(self):
+        self.create_rechargings(25)
+        response = self.client1.get(reverse(self.url_view) + '?kind=cheque&page=2')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['solution_list']), 5)
+        self.assertEqual(response.context['query'], 'kind=cheque')
+
+        response = self.client1.get(reverse(self.url_view) + '?kind=cheque&search=nobody')
+        self.assertEqual(len(response.context['solution_list']), 0)
+
+    def test_not_existing_kind(self):
+        response = self.client1.get(reverse(self.url_view) + '?kind=bitcoin')
+        self.assertEqual(response.status_code, 404)
+
+    def test_invalid_search(self):
+        response = self.client1.get(self.get_url() + '&date_begin=yesterday')
+        self.assertEqual(response.status_code, 400)
+
+    def test_allowed_user_get(self):
+        super().allowed_user_get()
+
+    def test_not_allowed_user_get(self):
+        super().not_allowed_user_get()
+
+    def test_offline_user_redirection(self):
+        super().offline_user_redirection()
+
+
+class RechargingExportTests(GeneralFinancesViewsTests):
+    url_view = 'url_recharging_export'
+
+    def get_url(self):
+        return reverse(self.url_view) + '?format=csv'
+
+    def test_allowed_user_get(self):
+        super().allowed_user_get()
+
+    def test_not_allowed_user_get(self):
+        super().not_allowed_user_get()
+
+    def test_offline_user_redirection(self):
+        super().offline_user_redirection()
+
+    def test_csv(self):
+        self.create_rechargings(2)
+        response = self.client1.get(self.get_url())
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        rows = list(csv.reader(io.StringIO(
+            b''.join(response.streaming_content).decode('utf-8-sig'))))
+        self.assertEqual(rows[0][0], 'Date')
+        self.assertEqual(len(rows), Recharging.objects.count() + 1)
+        self.assertEqual(rows[-1][4:], ['Lydia en ligne', '', '1', '0.00'])
+
+    def test_xlsx(self):
+        self.create_rechargings(2)
+        response = self.client1.get(reverse(self.url_view) + '?format=xlsx&search=nobody')
+        workbook = openpyxl.load_workbook(io.BytesIO(b''.join(response.streaming_content)))
+        rows = list(workbook.active.values)
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0][0], 'Date')
+
+    def test_not_existing_format(self):
+        response = self.client1.get(reverse(self.url_view) + '?format=pdf')
+        self.assertEqual(response.status_code, 404)
+
+    def test_invalid_search(self):
+        response = self.client1.get(self.get_url() + '&date_begin=yesterday')
+        self.assertEqual(response.status_code, 400)
+
+
+class RechargingImportTests(GeneralFinancesViewsTests):
+    url_view = 'url_recharging_import'
+
     def test_allowed_user_get(self):
         super().allowed_user_get()
 
@@ -80,6 +209,32 @@ class RechargingListTests(GeneralFinancesViewsTests):
     def test_offline_user_redirection(self):
         super().offline_user_redirection()
 
+    def post_statement(self, content, kind='cheque'):
+        return self.client1.post(self.get_url(), {
+            'kind': kind,
+            'statement': SimpleUploadedFile('statement.csv', content.encode('utf-8'))
+        })
+
+    def test_import(self):
+        response = self.post_statement(
+            'Utilisateur;Numéro;Montant\n' + self.user2.username + ';0000001;15\nnobody;0000002;5\n')
+        self.assertEqual(response.status_code, 200)
+        report = response.context['report']
+        self.assertEqual(len(report['created']), 1)
+        self.assertEqual(len(report['unmatched']), 1)
+        recharging = Recharging.objects.get(
+            content_type__model='cheque',
+            solution_id=Cheque.objects.get(cheque_number='0000001').pk)
+        self.assertEqual(recharging.operator, self.user1)
+        self.user2.refresh_from_db()
+        self.assertEqual(self.user2.balance, 159)
+
+    def test_missing_columns(self):
+        response = self.post_statement('Utilisateur;Montant\nuser2;15\n')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('report', response.context)
+        self.assertTrue(response.context['form'].errors)
+
 
 class RechargingRetrieveTests(BaseFinancesViewsTestCase):
     url_view = 'url_recharging_retrieve'
@@ -119,6 +274,84 @@ class TransfertCreateTests(GeneralFinancesViewsTests):
         super().offline_user_redirection()
 
 
+class ChequeDepositListTests(GeneralFinancesViewsTests):
+    url_view = 'url_cheque_deposit_list'
+
+    def test_allowed_user_get(self):
+        super().allowed_user_get()
+
+    def test_not_allowed_user_get(self):
+        super().not_allowed_user_get()
+
+    def test_offline_user_redirection(self):
+        super().offline_user_redirection()
+
+    def test_bank_cheques(self):
+        self.create_rechargings(3)
+        cheques = list(Cheque.objects.filter(is_cashed=False).order_by('pk'))
+        response = self.client1.get(self.get_url())
+        self.assertEqual(response.context['pending']['nb'], len(cheques))
+
+        with CaptureQueriesContext(connection) as context:
+            response = self.client1.post(self.get_url(), {
+                'deposit_id': 'R1',
+                'date_cashed': '01/02/2019',
+                'cheques': [cheques[0].pk, cheques[1].pk]
+            })
+        self.assertEqual(len([query for query in context.captured_queries
+                              if query['sql'].startswith('UPDATE "finances_cheque"')]), 1)
+        self.assertRedirects(response, self.get_url())
+        self.assertEqual(Cheque.objects.filter(deposit_id='R1', is_cashed=True).count(), 2)
+
+        response = self.client1.get(self.get_url())
+        self.assertEqual(response.context['pending']['nb'], len(cheques) - 2)
+        self.assertEqual(response.context['deposit_list'][0]['total'], 40)
+
+        # The deposit id is unique, cashed cheques can't be selected
+        response = self.client1.post(self.get_url(), {
+            'deposit_id': 'R1', 'date_cashed': '01/02/2019', 'cheques': [cheques[2].pk]})
+        self.assertTrue(response.context['form'].errors['deposit_id'])
+        response = self.client1.post(self.get_url(), {
+            'deposit_id': 'R2', 'date_cashed': '01/02/2019', 'cheques': [cheques[0].pk]})
+        self.assertTrue(response.context['form'].errors['cheques'])
+
+
+class ChequeDepositExportTests(GeneralFinancesViewsTests):
+    url_view = 'url_cheque_deposit_export'
+
+    def setUp(self):
+        super().setUp()
+        self.create_rechargings(2)
+        Cheque.objects.update(is_cashed=True, deposit_id='R1')
+
+    def get_url(self):
+        return reverse(self.url_view) + '?format=csv&deposit_id=R1'
+
+    def test_allowed_user_get(self):
+        super().allowed_user_get()
+
+    def test_not_allowed_user_get(self):
+        super().not_allowed_user_get()
+
+    def test_offline_user_redirection(self):
+        response_offline_user = Client().get(self.get_url())
+        self.assertEqual(response_offline_user.status_code, 302)
+        self.assertRedirects(response_offline_user,
+                             get_login_url_redirected(quote(self.get_url(), safe='/')))
+
+    def test_csv(self):
+        response = self.client1.get(self.get_url())
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="remise_R1.csv"')
+        rows = list(csv.reader(io.StringIO(
+            b''.join(response.streaming_content).decode('utf-8-sig'))))
+        self.assertEqual(rows[0][0], 'Numéro de chèque')
+        self.assertEqual(rows[-1], ['Total', '', '', '40.00'])
+
+    def test_not_existing_deposit(self):
+        response = self.client1.get(reverse(self.url_view) + '?format=csv&deposit_id=R2')
+        self.assertEqual(response.status_code, 404)
+
+
 class TransfertListTests(GeneralFinancesViewsTests):
     url_view = 'url_transfert_list'
 
@@ -131,6 +364,65 @@ class TransfertListTests(GeneralFinancesViewsTests):
     def test_offline_user_redirection(self):
         super().offline_user_redirection()
 
+    def test_pages(self):
+        for _ in range(60):
+            Transfert.objects.create(sender=self.user1, recipient=self.user2, amount=1)
+        transferts = list(Transfert.objects.order_by('-datetime', '-pk'))
+
+        response = self.client1.get(self.get_url())
+        first_page = list(response.context['transfert_list'])
+        self.assertEqual(first_page, transferts[:50])
+
+        response = self.client1.post(self.get_url(), {
+            'search': '', 'date_begin': '', 'date_end': '',
+            'page': 'next|' + response.context['transfert_list'].next_cursor()})
+        self.assertEqual(list(response.context['transfert_list']), transferts[50:100])
+        self.assertFalse(response.context['transfert_list'].has_next())
+
+        response = self.client1.post(self.get_url(), {
+            'search': '', 'date_begin': '', 'date_end': '',
+            'page': 'previous|' + response.context['transfert_list'].previous_cursor()})
+        self.assertEqual(list(response.context['transfert_list']), first_page)
+
+
+class TransfertExportTests(GeneralFinancesViewsTests):
+    url_view = 'url_transfert_export'
+
+    def get_url(self):
+        return reverse(self.url_view) + '?format=csv'
+
+    def test_allowed_user_get(self):
+        super().allowed_user_get()
+
+    def test_not_allowed_user_get(self):
+        super().not_allowed_user_get()
+
+    def test_offline_user_redirection(self):
+        super().offline_user_redirection()
+
+    def test_csv(self):
+        Transfert.objects.create(sender=self.user1, recipient=self.user2,
+                                 amount=3, justification='Pizza')
+        response = self.client1.get(self.get_url())
+        rows = list(csv.reader(io.StringIO(
+            b''.join(response.streaming_content).decode('utf-8-sig'))))
+        self.assertEqual(len(rows), Transfert.objects.count() + 1)
+        self.assertEqual(rows[-1][1:], [self.user1.username, self.user2.username, '3.00', 'Pizza'])
+
+    def test_formula_escaped(self):
+        Transfert.objects.create(sender=self.user1, recipient=self.user2,
+                                 amount=3, justification='=1+1')
+        response = self.client1.get(self.get_url())
+        rows = list(csv.reader(io.StringIO(
+            b''.join(response.streaming_content).decode('utf-8-sig'))))
+        self.assertEqual(rows[-1][-1], "'=1+1")
+
+        response = self.client1.get(reverse(self.url_view) + '?format=xlsx')
+        worksheet = openpyxl.load_workbook(io.BytesIO(b''.join(response.streaming_content))).active
+        cell = list(worksheet.rows)[-1][-1]
+        self.assertEqual(cell.data_type, 's')
+        self.assertEqual(cell.value, "'=1+1")
+
 
 class TransfertRetrieveTests(BaseFinancesViewsTestCase):
     url_view = 'url_transfert_retrieve'
@@ -183,6 +475,22 @@ class ExceptionnalMovementListTests(GeneralFinancesViewsTests):
         super().offline_user_redirection()
 
 
+class ExceptionnalMovementExportTests(GeneralFinancesViewsTests):
+    url_view = 'url_exceptionnalmovement_export'
+
+    def get_url(self):
+        return reverse(self.url_view) + '?format=xlsx'
+
+    def test_allowed_user_get(self):
+        super().allowed_user_get()
+
+    def test_not_allowed_user_get(self):
+        super().not_allowed_user_get()
+
+    def test_offline_user_redirection(self):
+        super().offline_user_redirection()
+
+
 class ExceptionnalMovementRetrieveTests(BaseFinancesViewsTestCase):
     url_view = 'url_exceptionnalmovement_retrieve'
 
@@ -219,3 +527,80 @@ class ExceptionnalMovementRetrieveTests(BaseFinancesViewsTestCase):
         self.assertEqual(response_offline_user.status_code, 302)
         self.assertRedirects(response_offline_user, get_login_url_redirected(
             self.get_url(self.movement1.pk)))
+
+
+def signed_lydia_params(token, **params):
+    """
+    Return the POST parameters of a Lydia callback, signed with token.
+    """
+    params.setdefault('currency', 'EUR')
+    params.setdefault('request_id', '1')
+    params.setdefault('signed', '1')
+    params.setdefault('vendor_token', 'vendor')
+    h_sig = '&'.join(key + '=' + params[key] for key in sorted(params)) + '&' + token
+    params['sig'] = hashlib.md5(h_sig.encode()).hexdigest()
+    return params
+
+
+class SelfLydiaCallbackTests(BaseFinancesViewsTestCase):
+    def setUp(self):
+        super().setUp()
+        Configuration.objects.filter(name='API_TOKEN_LYDIA').update(value='token')
+        cache.clear()
+
+    def get_url(self):
+        return reverse('url_self_lydia_callback') + '?user_pk=' + str(self.user2.pk)
+
+    def test_callback(self):
+        params = signed_lydia_params('token', amount='10', transaction_identifier='T1')
+        response = self.client.post(self.get_url(), params)
+        self.assertEqual(response.status_code, 200)
+        self.user2.refresh_from_db()
+        self.assertEqual(self.user2.balance, 154)
+        lydia = Lydia.objects.get(id_from_lydia='T1')
+        self.assertTrue(lydia.is_online)
+        self.assertEqual(lydia.amount, 10)
+
+    def test_replayed_callback(self):
+        params = signed_lydia_params('token', amount='10', transaction_identifier='T1')
+        self.client.post(self.get_url(), params)
+        response = self.client.post(self.get_url(), params)
+        self.assertEqual(response.status_code, 200)
+        self.user2.refresh_from_db()
+        self.assertEqual(self.user2.balance, 154)
+        self.assertEqual(Lydia.objects.filter(id_from_lydia='T1').count(), 1)
+
+
+class SelfLydiaCallbackConcurrencyTests(TransactionTestCase):
+    fixtures = ['initial']
+
+    def setUp(self):
+        cache.clear()
+        Configuration.objects.filter(name='API_TOKEN_LYDIA').update(value='token')
+        self.user = User.objects.create(username='user', balance=0)
+
+    def test_parallel_callbacks(self):
+        url = reverse('url_self_lydia_callback') + '?user_pk=' + str(self.user.pk)
+        params = signed_lydia_params('token', amount='10', transaction_identifier='T1')
+        barrier = threading.Barrier(4)
+        status_codes = []
+
+        def callback():
+            try:
+                barrier.wait()
+                response = retry_on_lock(Client().post, url, params)
+                status_codes.append(response.status_code)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=callback) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(status_codes, [200] * 4)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.balance, 10)
+        self.assertEqual(Lydia.objects.filter(id_from_lydia='T1').count(), 1)
+        self.assertEqual(Recharging.objects.filter(sender=self.user).count(), 1)
@@ -1,11 +1,16 @@
 from django.urls import include, path
 
-from finances.views import (ExceptionnalMovementList,
+from finances.views import (ChequeDepositExport, ChequeDepositList,
+                            ExceptionnalMovementExport,
+                            ExceptionnalMovementList,
                             ExceptionnalMovementRetrieve, RechargingCreate,
-                            RechargingList, RechargingRetrieve,
+                            RechargingExport, RechargingImport,
+                            RechargingList,
+                            RechargingRetrieve, RechargingSolutionList,
                             SelfLydiaConfirm, SelfLydiaCreate,
                             SelfTransactionList, TransfertCreate,
-                            TransfertList, TransfertRetrieve,
+                            TransfertExport, TransfertList,
+                            TransfertRetrieve,
                             UserExceptionnalMovementCreate,
                             self_lydia_callback)
 
@@ -23,12 +28,23 @@ finances_patterns = [
         # RECHARGINGS
         path('rechargings/', include([
             path('', RechargingList.as_view(), name='url_recharging_list'),
+            path('solutions/', RechargingSolutionList.as_view(),
+                 name='url_recharging_solution_list'),
+            path('export/', RechargingExport.as_view(), name='url_recharging_export'),
+            path('import/', RechargingImport.as_view(), name='url_recharging_import'),
             path('<int:recharging_pk>/', RechargingRetrieve.as_view(),
                  name='url_recharging_retrieve')
         ])),
+        # CHEQUES
+        path('cheques/', include([
+            path('', ChequeDepositList.as_view(), name='url_cheque_deposit_list'),
+            path('export/', ChequeDepositExport.as_view(),
+                 name='url_cheque_deposit_export')
+        ])),
         # TRANSFERTS
         path('transferts/', include([
             path('', TransfertList.as_view(), name='url_transfert_list'),
+            path('export/', TransfertExport.as_view(), name='url_transfert_export'),
             path('create/', TransfertCreate.as_view(),
                  name='url_transfert_create'),
             path('<int:transfert_pk>/', TransfertRetrieve.as_view(),
@@ -38,6 +54,8 @@ finances_patterns = [
         path('exceptionnal_movements/', include([
             path('', ExceptionnalMovementList.as_view(),
                  name='url_exceptionnalmovement_list'),
+            path('export/', ExceptionnalMovementExport.as_view(),
+                 name='url_exceptionnalmovement_export'),
             path('<int:exceptionnalmovement_pk>/', ExceptionnalMovementRetrieve.as_view(),
                  name='url_exceptionnalmovement_retrieve')
         ])),
@@ -1,6 +1,58 @@
+import collections
+import csv
+import datetime
 import decimal
 import hashlib
 import operator
+import re
+import unicodedata
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Max, Sum
+from django.utils.timezone import localdate, localtime
+
+from borgia.utils import iterate_prefetched
+from configurations.utils import configurations_get
+from finances.models import Cash, Cheque, LedgerEntry, Lydia, Recharging
+from users.models import User
+
+# Lydia are split between face to face and online payments
+RECHARGING_SOLUTIONS = {
+    'cash': (Cash, None),
+    'cheque': (Cheque, None),
+    'lydia_face2face': (Lydia, False),
+    'lydia_online': (Lydia, True)
+}
+
+RECHARGING_SOLUTION_NAMES = {
+    'cash': 'Espèces',
+    'cheque': 'Chèque',
+    'lydia_face2face': 'Lydia face à face',
+    'lydia_online': 'Lydia en ligne'
+}
+
+RECHARGING_EXPORT_HEADER = ['Date', 'Utilisateur', 'Opérateur', 'Montant', 'Solution',
+                            'Numéro de chèque', 'Numéro Lydia', 'Frais Lydia']
+TRANSFERT_EXPORT_HEADER = ['Date', 'Envoyeur', 'Receveur', 'Montant', 'Justification']
+EXCEPTIONNALMOVEMENT_EXPORT_HEADER = ['Date', 'Opérateur', 'Utilisateur', 'Montant',
+                                      'Justification']
+CHEQUE_DEPOSIT_EXPORT_HEADER = ['Numéro de chèque', 'Signataire', 'Date de signature',
+                                'Montant']
+
+# Columns of the statements reconciled, the date is optional
+RECONCILIATION_COLUMNS = {
+    'utilisateur': 'username',
+    'numero': 'number',
+    'montant': 'amount',
+    'date': 'date'
+}
+RECONCILIATION_CHUNK_SIZE = 500
+# Model and field of the number of the solutions reconciled, by kind
+RECONCILIATION_SOLUTIONS = {
+    'lydia': (Lydia, 'id_from_lydia'),
+    'cheque': (Cheque, 'cheque_number')
+}
 
 
 def verify_token_lydia(params, token):
@@ -56,3 +108,461 @@ def calculate_lydia_fee_from_total(total_amount, base_fee, ratio_fee, tax_fee=1)
         tax_fee * (base_fee + ratio_fee / 100 * total_amount)
     ).quantize(decimal.Decimal('0.0001')).quantize(decimal.Decimal('.01'), decimal.ROUND_UP)
     # rounded to up. First round to 0.0001 is to remove float imprecision error, which lead 0.200000000001 to round to 0.21 instead of 0.20
+
+
+
+def get_lydia_fee_config():
+    """
+    Return the fee configuration of Lydia, loaded at once.
+
+    :returns: None if fees are disabled, else {'base_fee', 'ratio_fee',
+    'tax_fee'} as Decimal rounded to 0.01.
+    """
+    configurations = configurations_get(
+        'ENABLE_FEE_LYDIA', 'BASE_FEE_LYDIA', 'RATIO_FEE_LYDIA', 'TAX_FEE_LYDIA')
+    if not configurations['ENABLE_FEE_LYDIA'].get_value():
+        return None
+    return {
+        key: decimal.Decimal(configurations[name].get_value()).quantize(decimal.Decimal('.01'))
+        for key, name in (('base_fee', 'BASE_FEE_LYDIA'),
+                          ('ratio_fee', 'RATIO_FEE_LYDIA'),
+                          ('tax_fee', 'TAX_FEE_LYDIA'))
+    }
+
+
+def create_online_lydia_recharging(user, id_from_lydia, amount, fee):
+    """
+    Create the online Lydia, its recharging and credit the user, unless the
+    Lydia transaction was already processed.
+
+    :param id_from_lydia: transaction identifier given by Lydia.
+    :param amount: amount credited, fee excluded.
+    :param fee: fee paid by the user to Lydia.
+    :returns: the recharging, or None if id_from_lydia was already processed.
+    :note:: The unique constraint on online Lydias makes this safe from
+    concurrent calls: the Lydia is inserted first, a replay fails to insert
+    it and nothing else is done.
+    """
+    with transaction.atomic():
+        try:
+            with transaction.atomic():
+                lydia = Lydia.objects.create(
+                    sender=user,
+                    amount=amount,
+                    id_from_lydia=id_from_lydia,
+                    fee=fee,
+                    is_online=True
+                )
+        except IntegrityError:
+            return None
+
+        recharging = Recharging.objects.create(
+            sender=user,
+            operator=user,
+            content_solution=lydia
+        )
+        recharging.pay()
+    return recharging
+
+
+def get_solutions(rechargings, model):
+    """
+    Return the payment solutions of a model used by rechargings, as a lazy
+    QuerySet filtered with a subquery.
+    """
+    return model.objects.filter(pk__in=rechargings.filter(
+        content_type=ContentType.objects.get_for_model(model)).order_by().values('solution_id'))
+
+
+def recharging_solutions(rechargings, kind):
+    """
+    Return the payment solutions of a kind used by rechargings.
+
+    :param rechargings: rechargings, can be filtered.
+    :param kind: kind of solution, key of RECHARGING_SOLUTIONS.
+    :type rechargings: Recharging QuerySet
+    :type kind: string
+    :returns: lazy QuerySet of Cash, Cheque or Lydia.
+    :raises: KeyError if the kind doesn't exist.
+    """
+    model, is_online = RECHARGING_SOLUTIONS[kind]
+    solutions = get_solutions(rechargings, model)
+    if is_online is not None:
+        solutions = solutions.filter(is_online=is_online)
+    return solutions
+
+
+def rechargings_aggregate(rechargings):
+    """
+    Return the total amount and the number of rechargings for each kind of
+    payment solution, computed in database with one query per model of
+    solution.
+
+    :param rechargings: rechargings, can be filtered but not sliced.
+    :type rechargings: Recharging QuerySet
+    :returns: {kind: {'total': Decimal, 'nb': int}} for each key of
+    RECHARGING_SOLUTIONS and for 'total'.
+    """
+    result = {kind: {'total': decimal.Decimal(0), 'nb': 0}
+              for kind in list(RECHARGING_SOLUTIONS) + ['total']}
+
+    for kind in ('cash', 'cheque'):
+        aggregate = recharging_solutions(rechargings, kind).aggregate(
+            total=Sum('amount'), nb=Count('pk'))
+        # The sum is None without solution
+        result[kind] = {'total': aggregate['total'] or decimal.Decimal(0),
+                        'nb': aggregate['nb']}
+
+    for row in get_solutions(rechargings, Lydia).order_by().values('is_online').annotate(
+            total=Sum('amount'), nb=Count('pk')):
+        kind = 'lydia_online' if row['is_online'] else 'lydia_face2face'
+        result[kind] = {'total': row['total'], 'nb': row['nb']}
+
+    for kind in RECHARGING_SOLUTIONS:
+        result['total']['total'] += result[kind]['total']
+        result['total']['nb'] += result[kind]['nb']
+    return result
+
+
+def solution_kind(solution):
+    """
+    Return the key of RECHARGING_SOLUTIONS matching a payment solution.
+    """
+    if isinstance(solution, Lydia):
+        return 'lydia_online' if solution.is_online else 'lydia_face2face'
+    elif isinstance(solution, Cheque):
+        return 'cheque'
+    return 'cash'
+
+
+def export_datetime(value):
+    """
+    Return an aware datetime as a naive one in the current timezone, spreadsheets
+    don't handle timezones.
+    """
+    return localtime(value).replace(tzinfo=None)
+
+
+def recharging_export_rows(rechargings):
+    """
+    Yield the rows of RECHARGING_EXPORT_HEADER for rechargings, oldest first.
+
+    :note:: Rechargings are read by chunks, with their solutions, in constant
+    memory.
+    """
+    rechargings = rechargings.select_related('sender', 'operator').order_by('datetime', 'pk')
+    for recharging in iterate_prefetched(rechargings, ['content_solution']):
+        solution = recharging.content_solution
+        kind = solution_kind(solution)
+        yield [
+            export_datetime(recharging.datetime),
+            recharging.sender.username,
+            recharging.operator.username,
+            solution.amount,
+            RECHARGING_SOLUTION_NAMES[kind],
+            solution.cheque_number if kind == 'cheque' else '',
+            solution.id_from_lydia if kind.startswith('lydia') else '',
+            solution.fee if kind.startswith('lydia') else ''
+        ]
+
+
+def transfert_export_rows(transferts):
+    """
+    Yield the rows of TRANSFERT_EXPORT_HEADER for transferts, oldest first.
+    """
+    transferts = transferts.select_related('sender', 'recipient').order_by('datetime', 'pk')
+    for transfert in iterate_prefetched(transferts):
+        yield [
+            export_datetime(transfert.datetime),
+            transfert.sender.username,
+            transfert.recipient.username,
+            transfert.amount,
+            transfert.justification or ''
+        ]
+
+
+def exceptionnalmovement_export_rows(exceptionnal_movements):
+    """
+    Yield the rows of EXCEPTIONNALMOVEMENT_EXPORT_HEADER for exceptionnal
+    movements, oldest first. Debits have a negative amount.
+    """
+    exceptionnal_movements = exceptionnal_movements.select_related(
+        'operator', 'recipient').order_by('datetime', 'pk')
+    for exceptionnal_movement in iterate_prefetched(exceptionnal_movements):
+        yield [
+            export_datetime(exceptionnal_movement.datetime),
+            exceptionnal_movement.operator.username,
+            exceptionnal_movement.recipient.username,
+            exceptionnal_movement.amount if exceptionnal_movement.is_credit
+            else -exceptionnal_movement.amount,
+            exceptionnal_movement.justification or ''
+        ]
+
+
+def normalize_column(name):
+    """
+    Return a column name in lower case, without accents nor spaces around.
+    """
+    name = unicodedata.normalize('NFKD', name.strip().lower())
+    return ''.join(char for char in name if not unicodedata.combining(char))
+
+
+def read_reconciliation_rows(lines, kind):
+    """
+    Parse the lines of a CSV statement, with the columns of
+    RECONCILIATION_COLUMNS in its header, separated by commas or semicolons.
+
+    :param lines: lines of the statement, header included.
+    :param kind: kind of solution of the statement, key of
+    RECONCILIATION_SOLUTIONS.
+    :type lines: list of strings
+    :returns: list of dicts, one by line with 'line', 'username', 'number',
+    'amount', 'date' and 'error', the reason why the line can't be
+    reconciled, or None.
+    :raises: ValueError if a column is missing.
+    """
+    if not lines:
+        raise ValueError('Le fichier est vide')
+    delimiter = ';' if lines[0].count(';') > lines[0].count(',') else ','
+    reader = csv.reader(lines, delimiter=delimiter)
+    header = [RECONCILIATION_COLUMNS.get(normalize_column(name)) for name in next(reader)]
+    missing = [name for name, column in RECONCILIATION_COLUMNS.items()
+               if column not in header and column != 'date']
+    if missing:
+        raise ValueError('Colonnes manquantes : ' + ', '.join(missing))
+
+    rows = []
+    for line, values in enumerate(reader, start=2):
+        if not any(value.strip() for value in values):
+            continue
+        row = {'line': line, 'username': '', 'number': '', 'amount': None, 'date': None,
+               'error': None}
+        for column, value in zip(header, values):
+            if column is not None:
+                row[column] = value.strip()
+
+        try:
+            row['amount'] = decimal.Decimal(row['amount'].replace(',', '.'))
+        except (AttributeError, decimal.InvalidOperation):
+            row['amount'] = None
+        if row['date']:
+            try:
+                row['date'] = datetime.datetime.strptime(row['date'], '%d/%m/%Y').date()
+            except ValueError:
+                row['error'] = 'Date invalide'
+        else:
+            row['date'] = None
+
+        if not row['number']:
+            row['error'] = 'Numéro manquant'
+        elif kind == 'cheque' and not re.match('^[0-9]{7}$', row['number']):
+            row['error'] = 'Numéro de chèque invalide'
+        elif row['amount'] is None or row['amount'] <= 0:
+            row['error'] = 'Montant invalide'
+        rows.append(row)
+    return rows
+
+
+def reconcile_rechargings(rows, kind, operator, chunk_size=RECONCILIATION_CHUNK_SIZE):
+    """
+    Reconcile the rows of a statement with the rechargings of Borgia.
+
+    Each row is matched to an existing Lydia or Cheque by its number and
+    amount. Rows without solution create one for the user named in the row.
+    Solutions without recharging get one, made by operator, and their sender
+    is credited.
+
+    :param rows: rows returned by read_reconciliation_rows.
+    :param kind: kind of solution, key of RECONCILIATION_SOLUTIONS.
+    :param operator: operator of the rechargings created.
+    :type operator: User object
+    :returns: {'created', 'matched', 'duplicates', 'unmatched'}, lists of
+    rows. Created rows have a 'user', unmatched and duplicates ones an
+    'error'.
+    :note:: Rows are processed by chunks of chunk_size, each in its own
+    transaction with bulk inserts, a few queries by chunk. The users and
+    solutions of a chunk are locked before being read, so that concurrent
+    imports of the same statement wait for each other instead of crediting
+    twice.
+    :note:: Lydia amounts of a statement are paid amounts, fee included.
+    Missing Lydias are created as online ones, with the fee of the
+    configuration, as the callback would have: a late callback is refused by
+    unique_online_lydia. If such a callback is recorded during the import,
+    the chunk is reconciled again and the row is matched.
+    """
+    report = {'created': [], 'matched': [], 'duplicates': [], 'unmatched': []}
+    numbers = set()
+    valid_rows = []
+    for row in rows:
+        if row['error']:
+            report['unmatched'].append(row)
+        elif row['number'] in numbers:
+            row['error'] = 'Numéro en double dans le fichier'
+            report['duplicates'].append(row)
+        else:
+            numbers.add(row['number'])
+            valid_rows.append(row)
+
+    fee_config = get_lydia_fee_config() if kind == 'lydia' else None
+    for start in range(0, len(valid_rows), chunk_size):
+        chunk = valid_rows[start:start + chunk_size]
+        try:
+            with transaction.atomic():
+                chunk_report = reconcile_chunk(chunk, kind, operator, fee_config)
+        except IntegrityError:
+            with transaction.atomic():
+                chunk_report = reconcile_chunk(chunk, kind, operator, fee_config)
+        for key, chunk_rows in chunk_report.items():
+            report[key] += chunk_rows
+    return report
+
+
+def set_bulk_created_pks(objs, queryset, key):
+    """
+    Set the pk of objects inserted by bulk_create, if the database didn't
+    return them (SQLite).
+
+    :param queryset: queryset of the objects inserted, with one object by key.
+    :param key: name of the field identifying an object in queryset.
+    """
+    if not objs or objs[0].pk is not None:
+        return
+    pks = dict(queryset.values_list(key, 'pk'))
+    for obj in objs:
+        obj.pk = pks[getattr(obj, key)]
+
+
+def statement_amount(solution):
+    """
+    Return the amount of a solution as written in a statement, the fee of a
+    Lydia included.
+    """
+    return solution.amount + getattr(solution, 'fee', 0)
+
+
+def reconcile_chunk(rows, kind, operator, fee_config=None):
+    """
+    Reconcile a chunk of rows, see reconcile_rechargings.
+
+    :param fee_config: fee configuration of Lydia, see get_lydia_fee_config.
+    :returns: report of the chunk, like reconcile_rechargings.
+    """
+    report = {'created': [], 'matched': [], 'unmatched': []}
+    model, number_field = RECONCILIATION_SOLUTIONS[kind]
+    content_type = ContentType.objects.get_for_model(model)
+    users = {user.username: user for user in User.objects.select_for_update().filter(
+        username__in=[row['username'] for row in rows if row['username']]).order_by('pk')}
+    solutions = collections.defaultdict(list)
+    for solution in model.objects.select_for_update(of=('self',)).select_related(
+            'sender').filter(**{number_field + '__in': [row['number'] for row in rows]}
+                             ).order_by('pk'):
+        solutions[getattr(solution, number_field)].append(solution)
+    recorded = set(Recharging.objects.filter(
+        content_type=content_type,
+        solution_id__in=[solution.pk for same in solutions.values() for solution in same]
+    ).values_list('solution_id', flat=True))
+
+    to_record = []
+    new_solutions = []
+    for row in rows:
+        existing = solutions.get(row['number'])
+        if existing:
+            same_amount = [solution for solution in existing
+                           if statement_amount(solution) == row['amount']]
+            if not same_amount:
+                row['error'] = 'Montant différent dans Borgia (' + ', '.join(
+                    str(statement_amount(solution)) + '€' for solution in existing) + ')'
+                report['unmatched'].append(row)
+            elif any(solution.pk in recorded for solution in same_amount):
+                report['matched'].append(row)
+            else:
+                row['user'] = same_amount[0].sender
+                to_record.append(same_amount[0])
+                report['created'].append(row)
+        elif row['username'] not in users:
+            row['error'] = 'Utilisateur inconnu'
+            report['unmatched'].append(row)
+        else:
+            row['user'] = users[row['username']]
+            solution = model(sender=row['user'], amount=row['amount'],
+                             **{number_field: row['number']})
+            if kind == 'lydia':
+                solution.is_online = True
+                solution.date_operation = row['date'] or localdate()
+                if fee_config is not None:
+                    solution.fee = calculate_lydia_fee_from_total(row['amount'], **fee_config)
+                    solution.amount = row['amount'] - solution.fee
+            else:
+                solution.signature_date = row['date'] or localdate()
+            new_solutions.append(solution)
+            report['created'].append(row)
+
+    if new_solutions:
+        last_pk = model.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+        model.objects.bulk_create(new_solutions)
+        set_bulk_created_pks(new_solutions, model.objects.filter(
+            pk__gt=last_pk, **{number_field + '__in': [getattr(solution, number_field)
+                                                       for solution in new_solutions]}),
+                             number_field)
+        to_record += new_solutions
+    if not to_record:
+        return report
+
+    rechargings = [Recharging(sender=solution.sender, operator=operator,
+                              content_solution=solution) for solution in to_record]
+    Recharging.objects.bulk_create(rechargings)
+    set_bulk_created_pks(rechargings, Recharging.objects.filter(
+        content_type=content_type, solution_id__in=[solution.pk for solution in to_record]),
+                         'solution_id')
+    LedgerEntry.objects.bulk_create([recharging.ledger_entry() for recharging in rechargings])
+
+    credits = {}
+    for solution in to_record:
+        user, amount = credits.get(solution.sender.pk, (solution.sender, 0))
+        credits[user.pk] = (user, amount + solution.amount)
+    for user, amount in credits.values():
+        user.credit(amount)
+    return report
+
+
+def cheque_deposits():
+    """
+    Return the deposits of cheques, most recent first, with their date, total
+    amount and number of cheques computed in database.
+
+    :returns: lazy QuerySet of dicts with 'deposit_id', 'date_cashed',
+    'total' and 'nb'.
+    """
+    return Cheque.objects.filter(is_cashed=True).exclude(deposit_id=None).values(
+        'deposit_id').annotate(date_cashed=Max('date_cashed'), total=Sum('amount'),
+                               nb=Count('pk')).order_by('-date_cashed', '-deposit_id')
+
+
+def bank_cheques(cheques, deposit_id, date_cashed):
+    """
+    Mark cheques as cashed with a single UPDATE, in a deposit.
+
+    :param cheques: cheques to bank, the ones already cashed are ignored.
+    :type cheques: Cheque QuerySet
+    :returns: number of cheques banked.
+    """
+    return cheques.filter(is_cashed=False).update(
+        is_cashed=True, deposit_id=deposit_id, date_cashed=date_cashed)
+
+
+def cheque_deposit_rows(cheques):
+    """
+    Yield the rows of CHEQUE_DEPOSIT_EXPORT_HEADER for cheques, followed by
+    their total.
+    """
+    total = decimal.Decimal(0)
+    cheques = cheques.select_related('sender').order_by('cheque_number', 'pk')
+    for cheque in iterate_prefetched(cheques):
+        total += cheque.amount
+        yield [
+            cheque.cheque_number,
+            str(cheque.sender),
+            cheque.signature_date,
+            cheque.amount
+        ]
+    yield ['Total', '', '', total]
@@ -1,34 +1,48 @@
 import datetime
 import decimal
+import re
 
 from django.contrib.auth import authenticate
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import (LoginRequiredMixin,
                                         PermissionRequiredMixin)
 from django.core.exceptions import ObjectDoesNotExist, PermissionDenied
-from django.db.models import Q
-from django.http import Http404
+from django.core.paginator import Paginator
+from django.db.models import Count, Q, Sum
+from django.http import Http404, HttpResponseBadRequest
 from django.shortcuts import HttpResponse, render
 from django.urls import reverse
-from django.utils.timezone import now
+from django.utils.timezone import localdate, now
 from django.views.decorators.csrf import csrf_exempt
 
+from borgia.mixins import ExportMixin, KeysetPaginationMixin
+from borgia.utils import EXPORT_FORMATS, export_response, filter_period
 from borgia.views import BorgiaFormView, BorgiaView
 from configurations.utils import configuration_get
-from finances.forms import (ExceptionnalMovementForm,
+from finances.forms import (ChequeDepositForm, ExceptionnalMovementForm,
                             GenericListSearchDateForm, RechargingCreateForm,
-                            RechargingListForm, SelfLydiaCreateForm,
+                            RechargingImportForm, RechargingListForm,
+                            SelfLydiaCreateForm,
                             TransfertCreateForm)
 from finances.models import (Cash, Cheque, ExceptionnalMovement, Lydia,
                              Recharging, Transfert)
-from finances.utils import (verify_token_lydia, 
-                            calculate_lydia_fee_from_total,
-                            calculate_total_amount_lydia)
+from finances.utils import (CHEQUE_DEPOSIT_EXPORT_HEADER,
+                            EXCEPTIONNALMOVEMENT_EXPORT_HEADER,
+                            RECHARGING_EXPORT_HEADER, RECHARGING_SOLUTIONS,
+                            TRANSFERT_EXPORT_HEADER, verify_token_lydia,
+                            bank_cheques, calculate_lydia_fee_from_total,
+                            calculate_total_amount_lydia, cheque_deposit_rows,
+                            cheque_deposits, create_online_lydia_recharging,
+                            exceptionnalmovement_export_rows,
+                            get_lydia_fee_config, reconcile_rechargings,
+                            recharging_export_rows, recharging_solutions,
+                            rechargings_aggregate, transfert_export_rows)
 from users.mixins import UserMixin
 from users.models import User
 
 
-class RechargingList(LoginRequiredMixin, PermissionRequiredMixin, BorgiaFormView):
+class RechargingList(LoginRequiredMixin, PermissionRequiredMixin, KeysetPaginationMixin,
+                     BorgiaFormView):
     """
     View to list recharging sales.
 
@@ -44,18 +58,24 @@ class RechargingList(LoginRequiredMixin, PermissionRequiredMixin, BorgiaFormView
     lm_active = 'lm_recharging_list'
 
     search = None
-    date_end = now() + datetime.timedelta(days=1)
-    date_begin = now() - datetime.timedelta(days=7)
+    date_end = None
+    date_begin = None
     operators = None
 
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        # Last 7 days by default
+        self.date_end = localdate()
+        self.date_begin = self.date_end - datetime.timedelta(days=7)
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
 
-        context['recharging_list'] = self.form_query(
-            Recharging.objects.all().order_by(
-                '-datetime'))[:1000]
-
-        context['info'] = self.info(context['recharging_list'])
+        rechargings = self.form_query(Recharging.objects.all())
+        context['recharging_list'] = self.paginate_queryset(
+            rechargings.with_solution().select_related('operator', 'sender'))
+        # Over all the rechargings of the period, not only the ones listed
+        context['info'] = rechargings_aggregate(rechargings)
         return context
 
     def get_initial(self):
@@ -64,58 +84,6 @@ class RechargingList(LoginRequiredMixin, PermissionRequiredMixin, BorgiaFormView
         initial['date_end'] = self.date_end
         return initial
 
-    def info(self, query):
-        info = {
-            'cash': {
-                'total': 0,
-                'nb': 0,
-                'ids': []
-            },
-            'cheque': {
-                'total': 0,
-                'nb': 0,
-                'ids': []
-            },
-            'lydia_face2face': {
-                'total': 0,
-                'nb': 0,
-                'ids': []
-            },
-            'lydia_online': {
-                'total': 0,
-                'nb': 0,
-                'ids': []
-            },
-            'total': {
-                'total': 0,
-                'nb': 0
-            }
-        }
-
-        for recharging in query:
-            if recharging.content_solution.__class__.__name__ == 'Cash':
-                info['cash']['total'] += recharging.content_solution.amount
-                info['cash']['nb'] += 1
-                info['cash']['ids'].append(recharging.content_solution)
-            elif recharging.content_solution.__class__.__name__ == 'Cheque':
-                info['cheque']['total'] += recharging.content_solution.amount
-                info['cheque']['nb'] += 1
-                info['cheque']['ids'].append(recharging.content_solution)
-            elif recharging.content_solution.__class__.__name__ == 'Lydia':
-                if recharging.content_solution.is_online is False:
-                    info['lydia_face2face']['total'] += recharging.content_solution.amount
-                    info['lydia_face2face']['nb'] += 1
-                    info['lydia_face2face']['ids'].append(
-                        recharging.content_solution)
-                else:
-                    info['lydia_online']['total'] += recharging.content_solution.amount
-                    info['lydia_online']['nb'] += 1
-                    info['lydia_online']['ids'].append(
-                        recharging.content_solution)
-            info['total']['total'] += recharging.content_solution.amount
-            info['total']['nb'] += 1
-        return info
-
     def form_query(self, query):
         if self.search:
             query = query.filter(
@@ -127,20 +95,14 @@ class RechargingList(LoginRequiredMixin, PermissionRequiredMixin, BorgiaFormView
                 | Q(sender__surname__contains=self.search)
             )
 
-        if self.date_begin:
-            query = query.filter(
-                datetime__gte=self.date_begin)
-
-        if self.date_end:
-            query = query.filter(
-                datetime__lte=self.date_end)
+        query = filter_period(query, self.date_begin, self.date_end)
 
         if self.operators:
             query = query.filter(operator__in=self.operators)
 
         return query
 
-    def form_valid(self, form):
+    def set_filters(self, form):
         if form.cleaned_data['search'] != '':
             self.search = form.cleaned_data['search']
 
@@ -153,9 +115,150 @@ class RechargingList(LoginRequiredMixin, PermissionRequiredMixin, BorgiaFormView
         if form.cleaned_data['operators']:
             self.operators = form.cleaned_data['operators']
 
+    def form_valid(self, form):
+        self.set_filters(form)
         return self.get(self.request, self.args, self.kwargs)
 
 
+class RechargingSolutionList(RechargingList):
+    """
+    List the payment solutions of a kind used by the rechargings of
+    RechargingList, page by page.
+
+    Loaded in the details of the synthesis of RechargingList, with the
+    values of its search form in GET parameters.
+
+    :param GET['kind']: kind of solution, key of RECHARGING_SOLUTIONS,
+    mandatory.
+    :param GET['page']: page number, 1 by default.
+    """
+    template_name = 'finances/recharging_solution_list.html'
+    http_method_names = ['get']
+    paginate_by = 20
+
+    def get(self, request, *args, **kwargs):
+        kind = request.GET.get('kind')
+        if kind not in RECHARGING_SOLUTIONS:
+            raise Http404
+
+        form = self.get_form_class()(request.GET)
+        if not form.is_valid():
+            return HttpResponseBadRequest()
+        self.set_filters(form)
+
+        solutions = recharging_solutions(
+            self.form_query(Recharging.objects.all()), kind).select_related(
+                'sender').order_by('-pk')
+        query = request.GET.copy()
+        query.pop('page', None)
+        return render(request, self.template_name, context={
+            'kind': kind,
+            'solution_list': Paginator(solutions, self.paginate_by).get_page(
+                request.GET.get('page')),
+            'query': query.urlencode()
+        })
+
+
+class RechargingExport(ExportMixin, RechargingList):
+    """
+    Export the rechargings of RechargingList as a CSV or XLSX file, with the
+    values of its search form in GET parameters.
+
+    :note:: Without dates, all the rechargings are exported.
+    """
+    export_filename = 'rechargements'
+    export_header = RECHARGING_EXPORT_HEADER
+
+    def get_export_rows(self):
+        return recharging_export_rows(self.form_query(Recharging.objects.all()))
+
+
+class RechargingImport(LoginRequiredMixin, PermissionRequiredMixin, BorgiaFormView):
+    """
+    Reconcile a Lydia or cheque statement with the rechargings, and create
+    the missing ones.
+
+    :note:: The logged in user is the operator of the rechargings created.
+    """
+    permission_required = 'finances.add_recharging'
+    menu_type = 'managers'
+    template_name = 'finances/recharging_import.html'
+    form_class = RechargingImportForm
+    lm_active = 'lm_recharging_list'
+
+    def form_valid(self, form):
+        context = self.get_context_data(form=form)
+        context['report'] = reconcile_rechargings(
+            form.cleaned_data['statement'], form.cleaned_data['kind'], self.request.user)
+        return render(self.request, self.template_name, context=context)
+
+
+class ChequeDepositList(LoginRequiredMixin, PermissionRequiredMixin, BorgiaFormView):
+    """
+    List the cheques not cashed yet and the last deposits, and bank a
+    selection of cheques in a new deposit.
+
+    :note:: Totals are computed in database, cheques are banked with a single
+    UPDATE.
+    """
+    permission_required = 'finances.change_cheque'
+    menu_type = 'managers'
+    template_name = 'finances/cheque_deposit_list.html'
+    form_class = ChequeDepositForm
+    lm_active = 'lm_cheque_deposit_list'
+    nb_deposit_list = 20
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        cheques = Cheque.objects.filter(is_cashed=False)
+        context['cheque_list'] = cheques.select_related('sender').order_by(
+            'signature_date', 'pk')
+        context['pending'] = cheques.aggregate(total=Sum('amount'), nb=Count('pk'))
+        context['deposit_list'] = cheque_deposits()[:self.nb_deposit_list]
+        return context
+
+    def get_initial(self):
+        initial = super().get_initial()
+        initial['date_cashed'] = localdate()
+        return initial
+
+    def form_valid(self, form):
+        self.nb_banked = bank_cheques(form.cleaned_data['cheques'],
+                                      form.cleaned_data['deposit_id'],
+                                      form.cleaned_data['date_cashed'])
+        return super().form_valid(form)
+
+    def get_success_message(self, cleaned_data):
+        return str(self.nb_banked) + ' chèques encaissés dans la remise ' + cleaned_data['deposit_id']
+
+    def get_success_url(self):
+        return reverse('url_cheque_deposit_list')
+
+
+class ChequeDepositExport(LoginRequiredMixin, PermissionRequiredMixin, BorgiaView):
+    """
+    Export the slip of a deposit of cheques as a CSV or XLSX file.
+
+    :param GET['deposit_id']: reference of the deposit, mandatory.
+    :param GET['format']: format of the file, in EXPORT_FORMATS, mandatory.
+    """
+    permission_required = 'finances.view_cheque'
+    menu_type = 'managers'
+
+    def get(self, request, *args, **kwargs):
+        export_format = request.GET.get('format')
+        if export_format not in EXPORT_FORMATS:
+            raise Http404
+
+        cheques = Cheque.objects.filter(deposit_id=request.GET.get('deposit_id'))
+        if not cheques.exists():
+            raise Http404
+
+        filename = 'remise_' + re.sub(r'[^\w-]', '_', request.GET['deposit_id'])
+        return export_response(export_format, filename, CHEQUE_DEPOSIT_EXPORT_HEADER,
+                               cheque_deposit_rows(cheques))
+
+
 class RechargingRetrieve(LoginRequiredMixin, PermissionRequiredMixin, BorgiaView):
     """
     Retrieve a recharging sale.
@@ -196,7 +299,8 @@ class RechargingRetrieve(LoginRequiredMixin, PermissionRequiredMixin, BorgiaView
         return render(request, self.template_name, context=context)
 
 
-class TransfertList(LoginRequiredMixin, PermissionRequiredMixin, BorgiaFormView):
+class TransfertList(LoginRequiredMixin, PermissionRequiredMixin, KeysetPaginationMixin,
+                    BorgiaFormView):
     """
     View to list transfert sales.
 
@@ -218,9 +322,8 @@ class TransfertList(LoginRequiredMixin, PermissionRequiredMixin, BorgiaFormView)
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
 
-        context['transfert_list'] = self.form_query(
-            Transfert.objects.all().order_by('-datetime')
-        )[:100]
+        context['transfert_list'] = self.paginate_queryset(self.form_query(
+            Transfert.objects.select_related('sender', 'recipient')))
 
         return context
 
@@ -235,17 +338,11 @@ class TransfertList(LoginRequiredMixin, PermissionRequiredMixin, BorgiaFormView)
                 | Q(sender__surname__contains=self.search)
             )
 
-        if self.date_begin:
-            query = query.filter(
-                datetime__gte=self.date_begin)
-
-        if self.date_end:
-            query = query.filter(
-                datetime__lte=self.date_end)
+        query = filter_period(query, self.date_begin, self.date_end)
 
         return query
 
-    def form_valid(self, form):
+    def set_filters(self, form):
         if form.cleaned_data['search'] != '':
             self.search = form.cleaned_data['search']
 
@@ -255,9 +352,23 @@ class TransfertList(LoginRequiredMixin, PermissionRequiredMixin, BorgiaFormView)
         if form.cleaned_data['date_end'] != '':
             self.date_end = form.cleaned_data['date_end']
 
+    def form_valid(self, form):
+        self.set_filters(form)
         return self.get(self.request, self.args, self.kwargs)
 
 
+class TransfertExport(ExportMixin, TransfertList):
+    """
+    Export the transferts of TransfertList as a CSV or XLSX file, with the
+    values of its search form in GET parameters.
+    """
+    export_filename = 'transferts'
+    export_header = TRANSFERT_EXPORT_HEADER
+
+    def get_export_rows(self):
+        return transfert_export_rows(self.form_query(Transfert.objects.all()))
+
+
 class TransfertRetrieve(LoginRequiredMixin, PermissionRequiredMixin, BorgiaView):
     """
     Retrieve a transfert sale.
@@ -335,7 +446,8 @@ class TransfertCreate(LoginRequiredMixin, PermissionRequiredMixin, BorgiaFormVie
         return reverse('url_members_workboard')
 
 
-class ExceptionnalMovementList(LoginRequiredMixin, PermissionRequiredMixin, BorgiaFormView):
+class ExceptionnalMovementList(LoginRequiredMixin, PermissionRequiredMixin, KeysetPaginationMixin,
+                               BorgiaFormView):
     """
     View to list exceptionnal movement sales.
 
@@ -358,9 +470,8 @@ class ExceptionnalMovementList(LoginRequiredMixin, PermissionRequiredMixin, Borg
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['exceptionnalmovement_list'] = self.form_query(
-            ExceptionnalMovement.objects.all().order_by('-datetime')
-        )[:100]
+        context['exceptionnalmovement_list'] = self.paginate_queryset(self.form_query(
+            ExceptionnalMovement.objects.select_related('operator', 'recipient')))
         return context
 
     def form_query(self, query):
@@ -374,17 +485,11 @@ class ExceptionnalMovementList(LoginRequiredMixin, PermissionRequiredMixin, Borg
                 | Q(recipient__surname__contains=self.search)
             )
 
-        if self.date_begin:
-            query = query.filter(
-                datetime__gte=self.date_begin)
-
-        if self.date_end:
-            query = query.filter(
-                datetime__lte=self.date_end)
+        query = filter_period(query, self.date_begin, self.date_end)
 
         return query
 
-    def form_valid(self, form):
+    def set_filters(self, form):
         if form.cleaned_data['search'] != '':
             self.search = form.cleaned_data['search']
 
@@ -394,9 +499,24 @@ class ExceptionnalMovementList(LoginRequiredMixin, PermissionRequiredMixin, Borg
         if form.cleaned_data['date_end'] != '':
             self.date_end = form.cleaned_data['date_end']
 
+    def form_valid(self, form):
+        self.set_filters(form)
         return self.get(self.request, self.args, self.kwargs)
 
 
+class ExceptionnalMovementExport(ExportMixin, ExceptionnalMovementList):
+    """
+    Export the exceptionnal movements of ExceptionnalMovementList as a CSV or
+    XLSX file, with the values of its search form in GET parameters.
+    """
+    export_filename = 'mouvements_exceptionnels'
+    export_header = EXCEPTIONNALMOVEMENT_EXPORT_HEADER
+
+    def get_export_rows(self):
+        return exceptionnalmovement_export_rows(
+            self.form_query(ExceptionnalMovement.objects.all()))
+
+
 class ExceptionnalMovementRetrieve(LoginRequiredMixin, PermissionRequiredMixin, BorgiaView):
     """
     Retrieve an exceptionnal movement sale.
@@ -457,7 +577,7 @@ class SelfTransactionList(LoginRequiredMixin, BorgiaFormView):
     def get_context_data(self, **kwargs):
         context = super(SelfTransactionList, self).get_context_data(**kwargs)
         context['transaction_list'] = self.form_query(
-            self.request.user.list_transaction())[:100]
+            self.request.user.ledger_entries.order_by('-datetime', '-pk'))[:100]
         return context
 
     # TODO: form to be used
@@ -619,22 +739,13 @@ class SelfLydiaCreate(LoginRequiredMixin, BorgiaFormView):
         else:
             self.state = "enabled"
 
-            self.enable_fee_lydia = configuration_get(
-                name='ENABLE_FEE_LYDIA').get_value()
+            fee_config = get_lydia_fee_config()
+            self.enable_fee_lydia = fee_config is not None
 
             if self.enable_fee_lydia:
-                base_fee_lydia = configuration_get(
-                    name='BASE_FEE_LYDIA').get_value()
-                self.base_fee_lydia = decimal.Decimal(
-                    base_fee_lydia).quantize(decimal.Decimal('.01'))
-                ratio_fee_lydia = configuration_get(
-                    name='RATIO_FEE_LYDIA').get_value()
-                self.ratio_fee_lydia = decimal.Decimal(
-                    ratio_fee_lydia).quantize(decimal.Decimal('.01'))
-                tax_fee_lydia = configuration_get(
-                    name='TAX_FEE_LYDIA').get_value()
-                self.tax_fee_lydia = decimal.Decimal(
-                    tax_fee_lydia).quantize(decimal.Decimal('.01'))
+                self.base_fee_lydia = fee_config['base_fee']
+                self.ratio_fee_lydia = fee_config['ratio_fee']
+                self.tax_fee_lydia = fee_config['tax_fee']
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -766,7 +877,7 @@ def self_lydia_callback(request):
     :raises: PermissionDenied if signatory generated is not sig.
     :returns: 300 if the user_pk doesn't match an user.
     :returns: 300 if a parameter is missing.
-    :returns: 200 if all's good.
+    :returns: 200 if all's good, or if the transaction was already processed.
     :rtype: Http request
     """
     params_dict = {
@@ -794,29 +905,18 @@ def self_lydia_callback(request):
             raise Http404
 
         total_amount = decimal.Decimal(params_dict['amount'])
-        if not configuration_get('ENABLE_FEE_LYDIA').get_value():
+        fee_config = get_lydia_fee_config()
+        if fee_config is None:
             fee = 0
             recharging_amount = total_amount
         else:
-            base_fee = decimal.Decimal(configuration_get('BASE_FEE_LYDIA').get_value()).quantize(decimal.Decimal('.01'))
-            ratio_fee = decimal.Decimal(configuration_get('RATIO_FEE_LYDIA').get_value()).quantize(decimal.Decimal('.01'))
-            tax_fee = decimal.Decimal(configuration_get('TAX_FEE_LYDIA').get_value()).quantize(decimal.Decimal('.01'))
-
             fee = calculate_lydia_fee_from_total(
-                total_amount, base_fee, ratio_fee, tax_fee)
+                total_amount, fee_config['base_fee'], fee_config['ratio_fee'],
+                fee_config['tax_fee'])
             recharging_amount = total_amount - fee
 
-        lydia = Lydia.objects.create(
-            sender=user,
-            amount=recharging_amount,
-            id_from_lydia=params_dict['transaction_identifier'],
-            fee=fee
-        )
-        recharging = Recharging.objects.create(
-            sender=user,
-            operator=user,
-            content_solution=lydia
-        )
-        recharging.pay()
+        # A replayed callback is acknowledged without crediting again
+        create_online_lydia_recharging(
+            user, params_dict['transaction_identifier'], recharging_amount, fee)
 
         return HttpResponse('200')
@@ -3,3 +3,9 @@ from django.apps import AppConfig
 
 class ModulesConfig(AppConfig):
     name = 'modules'
+
+    def ready(self):
+        # Import modules signals
+        from modules.signals import (invalidate_lateral_menus_on_module_save,
+                                     invalidate_sale_catalogs_on_save,
+                                     invalidate_sale_catalogs_on_configuration_save)
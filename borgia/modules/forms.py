@@ -1,9 +1,11 @@
+import uuid
+
 from django import forms
 from django.core.exceptions import ObjectDoesNotExist
 from django.core.validators import MinValueValidator
 
-from modules.models import CategoryProduct
-from shops.models import Product
+from modules.utils import SALE_ERRORS, check_sale, get_invoices_amount
+from shops.utils import get_product_choices
 from users.models import User
 
 
@@ -14,23 +16,28 @@ class ShopModuleSaleForm(forms.Form):
         self.client = kwargs.pop('client')
         self.balance_threshold_purchase = kwargs.pop(
             'balance_threshold_purchase')
+        self.catalog = kwargs.pop('catalog')
         super().__init__(*args, **kwargs)
 
         if self.module_class == 'operator_sales':
             self.fields['client'] = self.get_client_field()
+        # A new key for each displayed form, a form submitted again keeps it
+        self.fields['idempotency_key'] = forms.CharField(
+            max_length=64,
+            required=False,
+            initial=uuid.uuid4().hex,
+            widget=forms.HiddenInput())
 
-        for category in self.module.categories.all():
-            for category_product in category.categoryproduct_set.all():
-                if (category_product.get_price() > 0 and
-                        not category_product.product.is_removed and
-                        category_product.product.is_active):
+        for category in self.catalog.categories:
+            for category_product in category.products:
+                if category_product.is_active:
                     self.fields[str(category_product.pk)
                                 + '-' + str(category.pk)
                                 ] = forms.IntegerField(
-                                    label=category_product.__str__(),
+                                    label=category_product.label,
                                     widget=forms.NumberInput(
                                         attrs={'data_category_pk': category.pk,
-                                               'data_price': category_product.get_price(),
+                                               'data_price': category_product.price,
                                                'class': 'form-control buyable_product',
                                                'min': 0}),
                                     initial=0,
@@ -50,29 +57,28 @@ class ShopModuleSaleForm(forms.Form):
                 raise forms.ValidationError('Utilisateur non sélectionné')
             if not self.client.is_active:
                 raise forms.ValidationError("L'utilisateur a été desactivé")
-        total_price = 0
-        for field in self.cleaned_data:
-            if field != 'client':
-                invoice = self.cleaned_data[field]
-                if isinstance(invoice, int) and invoice > 0:
-                    try:
-                        category_product_pk = field.split('-')[0]
-                        total_price += (CategoryProduct.objects.get(
-                            pk=category_product_pk).get_price() * invoice)
-                    except ObjectDoesNotExist:
-                        pass
-        if (self.client.balance - total_price) < self.balance_threshold_purchase.get_value():
-            raise forms.ValidationError('Crédit insuffisant !')
-        if self.module.limit_purchase:
-            if total_price > self.module.limit_purchase:
-                raise forms.ValidationError(
-                    'Le montant est supérieur à la limite.')
-        if total_price <= 0:
-            raise forms.ValidationError('La commande doit être positive.')
+        error = check_sale(self.module, self.client,
+                           get_invoices_amount(self.catalog, self.get_invoices()),
+                           self.balance_threshold_purchase.get_value())
+        if error is not None:
+            raise forms.ValidationError(SALE_ERRORS[error])
 
         self.cleaned_data['client'] = self.client
         return self.cleaned_data
 
+    def get_invoices(self):
+        """
+        Return the number of each category product ordered, by category
+        product pk.
+        """
+        invoices = {}
+        for field in self.cleaned_data:
+            if field not in ('client', 'idempotency_key'):
+                invoice = self.cleaned_data[field]
+                if isinstance(invoice, int) and invoice > 0:
+                    invoices[int(field.split('-')[0])] = invoice
+        return invoices
+
     def get_client_field(self):
         return forms.CharField(
             label="Client",
@@ -89,15 +95,7 @@ class ModuleCategoryCreateForm(forms.Form):
         super().__init__(*args, **kwargs)
         self.fields['product'] = forms.ChoiceField(
             label='Produit',
-            choices=([(None, 'Sélectionner un produit')] + [
-                (str(product.pk)+'/'+str(product.get_unit_display()),
-                 product.__str__())
-                for product in Product.objects.filter(shop=shop, is_removed=False, is_active=True)
-            ] + [
-                (str(product.pk)+'/'+str(product.get_unit_display()),
-                 product.__str__() + ' DESACTIVE')
-                for product in Product.objects.filter(shop=shop, is_removed=False, is_active=False)
-            ]),
+            choices=get_product_choices(shop, mark_inactive=True),
             widget=forms.Select(
                 attrs={'class': 'form-control selectpicker',
                        'data-live-search': 'True'})
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-18 20:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('modules', '0002_category_order'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='categoryproduct',
+            name='order',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -1,7 +1,10 @@
+from django.contrib.auth.mixins import PermissionRequiredMixin
 from django.core.exceptions import ImproperlyConfigured, ObjectDoesNotExist
 from django.http import Http404
 
+from configurations.utils import configuration_get
 from modules.models import Category, OperatorSaleModule, SelfSaleModule
+from modules.utils import create_sale, get_replayed_sale, get_sale_catalog
 from shops.mixins import ShopMixin
 
 
@@ -81,6 +84,89 @@ class ShopModuleMixin(ShopMixin):
             )
 
 
+class ShopModuleSaleMixin(ShopModuleMixin):
+    """
+    Mixin for views selling products through a shop module.
+    For Permission :
+    For self sales, the user only needs the use_selfsalemodule permission.
+    For operator sales, the user also needs to manage the shop.
+    The module must be enabled.
+    """
+    permission_required_self = 'modules.use_selfsalemodule'
+    permission_required_operator = 'modules.use_operatorsalemodule'
+
+    def __init__(self):
+        super().__init__()
+        self.catalog = None
+
+    def has_permission(self):
+        if self.kwargs['module_class'] == 'self_sales':
+            has_perms = self.has_permission_selfsales()
+        else:
+            has_perms = super().has_permission()
+        if not has_perms:
+            return False
+        else:
+            if self.module.state is False:
+                raise Http404
+            else:
+                return True
+
+    def has_permission_selfsales(self):
+        """
+        Customized permission for self_sale in shops. 
+        The user still need the use_selfsalemodule permission
+        """
+        self.add_context_objects()
+        return PermissionRequiredMixin.has_permission(self)
+
+    def get_catalog(self):
+        """
+        Return the catalog of the module, loaded once for the request.
+        """
+        if self.catalog is None:
+            self.catalog = get_sale_catalog(self.module)
+        return self.catalog
+
+    def get_sale_form_kwargs(self):
+        """
+        Return the keyword arguments of ShopModuleSaleForm, except data.
+        """
+        kwargs = {
+            'module_class': self.module_class,
+            'module': self.module,
+            'balance_threshold_purchase': configuration_get('BALANCE_THRESHOLD_PURCHASE'),
+            'catalog': self.get_catalog()
+        }
+        if self.module_class == "self_sales":
+            kwargs['client'] = self.request.user
+        elif self.module_class == "operator_sales":
+            kwargs['client'] = None
+        else:
+            self.handle_unexpected_module_class()
+        return kwargs
+
+    def create_sale(self, form):
+        """
+        Create and pay the sale of the valid form.
+        """
+        if self.module_class == "self_sales":
+            client = self.request.user
+        elif self.module_class == "operator_sales":
+            client = form.cleaned_data['client']
+        else:
+            self.handle_unexpected_module_class()
+        return create_sale(self.module, self.request.user, client, form.get_invoices(),
+                           form.cleaned_data.get('idempotency_key'))
+
+    def get_replayed_sale(self, idempotency_key):
+        """
+        Return the sale already created with the idempotency key, if the
+        request is submitted again.
+        """
+        return get_replayed_sale(self.request.user, idempotency_key)
+
+
 class ShopModuleCategoryMixin(ShopModuleMixin):
     """
     """
@@ -0,0 +1,47 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from borgia.utils import invalidate_lateral_menus
+from configurations.models import Configuration
+from modules.models import (Category, CategoryProduct, OperatorSaleModule,
+                            SelfSaleModule)
+from modules.utils import invalidate_sale_catalogs
+from shops.models import Product
+from stocks.models import StockEntryProduct
+
+
+@receiver(post_save, sender=SelfSaleModule)
+@receiver(post_delete, sender=SelfSaleModule)
+@receiver(post_save, sender=OperatorSaleModule)
+@receiver(post_delete, sender=OperatorSaleModule)
+def invalidate_lateral_menus_on_module_save(**kwargs):
+    """
+    Lateral menus link to enabled modules.
+    """
+    invalidate_lateral_menus()
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=CategoryProduct)
+@receiver(post_delete, sender=CategoryProduct)
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=StockEntryProduct)
+@receiver(post_delete, sender=StockEntryProduct)
+def invalidate_sale_catalogs_on_save(**kwargs):
+    """
+    Catalogs contain categories, products and their prices, which depend on
+    the last stock entries.
+    """
+    invalidate_sale_catalogs()
+
+
+@receiver(post_save, sender=Configuration)
+@receiver(post_delete, sender=Configuration)
+def invalidate_sale_catalogs_on_configuration_save(instance, **kwargs):
+    """
+    Automatic prices depend on the margin profit.
+    """
+    if instance.name == 'MARGIN_PROFIT':
+        invalidate_sale_catalogs()
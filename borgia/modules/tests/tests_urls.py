@@ -8,6 +8,9 @@ class ModulesNamedURLTests(TestCase):
         "Named modules URLs should be reversible"
         expected_named_urls = [
             ('url_shop_module_sale', [], {'shop_pk': 53, 'module_class': 'self_sales'}),
+            ('url_shop_module_sale_api', [], {'shop_pk': 53, 'module_class': 'self_sales'}),
+            ('url_shop_module_catalog_api', [], {'shop_pk': 53, 'module_class': 'self_sales'}),
+            ('url_shop_module_sync_api', [], {'shop_pk': 53, 'module_class': 'self_sales'}),
             ('url_shop_module_config', [], {'shop_pk': 53, 'module_class': 'self_sales'}),
             ('url_shop_module_config_update', [], {'shop_pk': 53, 'module_class': 'self_sales'}),
             ('url_shop_module_category_create', [], {'shop_pk': 53, 'module_class': 'self_sales'}),
@@ -0,0 +1,353 @@
+import datetime
+import decimal
+import threading
+from unittest import mock
+
+from django.contrib.auth.models import Permission
+from django.core.cache import cache
+from django.core.exceptions import PermissionDenied
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase
+from django.utils.timezone import make_aware
+
+from borgia.tests.utils import retry_on_lock
+from configurations.models import Configuration
+from modules.models import Category, CategoryProduct, SelfSaleModule
+from modules.utils import (SALE_CATALOG_VERSION_KEY, SALE_RECIPIENT_PK, create_sale,
+                           get_replayed_sale, get_sale_catalog,
+                           invalidate_sale_catalogs, invalidate_sale_catalogs_once,
+                           set_category_products, sync_sales)
+from sales.models import Sale
+from shops.models import Product, Shop
+from shops.utils import update_automatic_prices
+from stocks.models import StockEntry, StockEntryProduct
+from users.models import User
+
+
+class SaleCatalogTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user1 = User.objects.create(username='user1')
+        self.margin_profit = Configuration.objects.create(
+            name='MARGIN_PROFIT', description='Margin', value='5', value_type='f')
+        self.shop1 = Shop.objects.create(
+            name='shop1', description='The first shop ever.', color='#F4FA58')
+        self.module1 = SelfSaleModule.objects.create(shop=self.shop1, state=True)
+        self.category1 = Category.objects.create(
+            name='Beers', module=self.module1, order=1)
+        self.category2 = Category.objects.create(
+            name='Food', module=self.module1, order=0)
+        self.product1 = Product.objects.create(
+            name='beer', unit='CL', shop=self.shop1, is_manual=True, manual_price=2)
+        self.product2 = Product.objects.create(
+            name='meat', unit='G', shop=self.shop1)
+        self.product3 = Product.objects.create(
+            name='skoll', shop=self.shop1, is_manual=True, manual_price=1, is_active=False)
+        self.categoryproduct1 = CategoryProduct.objects.create(
+            category=self.category1, product=self.product1, quantity=50)
+        self.categoryproduct2 = CategoryProduct.objects.create(
+            category=self.category2, product=self.product2, quantity=100)
+        self.categoryproduct3 = CategoryProduct.objects.create(
+            category=self.category1, product=self.product3, quantity=1, order=1)
+
+    def test_catalog(self):
+        with self.assertNumQueries(2):
+            catalog = get_sale_catalog(self.module1)
+        self.assertListEqual([category.name for category in catalog.categories],
+                             ['Food', 'Beers'])
+        beers = catalog.categories[1]
+        self.assertListEqual([product.pk for product in beers.products],
+                             [self.categoryproduct1.pk, self.categoryproduct3.pk])
+        product = catalog.products[self.categoryproduct1.pk]
+        self.assertEqual(product.price, decimal.Decimal(1))
+        self.assertEqual(product.label, str(self.categoryproduct1))
+        self.assertTrue(product.is_active)
+        # Meat has no price, skoll is deactivated
+        self.assertFalse(catalog.products[self.categoryproduct2.pk].is_active)
+        self.assertFalse(catalog.products[self.categoryproduct3.pk].is_active)
+
+    def test_cached(self):
+        get_sale_catalog(self.module1)
+        with self.assertNumQueries(0):
+            catalog = get_sale_catalog(self.module1)
+        self.assertEqual(len(catalog.products), 3)
+
+    def test_category_product_saved(self):
+        get_sale_catalog(self.module1)
+        self.categoryproduct1.quantity = 25
+        self.categoryproduct1.save()
+        catalog = get_sale_catalog(self.module1)
+        self.assertEqual(catalog.products[self.categoryproduct1.pk].price,
+                         decimal.Decimal('0.5'))
+
+    def test_category_deleted(self):
+        get_sale_catalog(self.module1)
+        self.category2.delete()
+        catalog = get_sale_catalog(self.module1)
+        self.assertListEqual([category.name for category in catalog.categories], ['Beers'])
+
+    def test_stock_entry_saved(self):
+        get_sale_catalog(self.module1)
+        stockentry = StockEntry.objects.create(operator=self.user1, shop=self.shop1)
+        StockEntryProduct.objects.create(
+            stockentry=stockentry, product=self.product2, quantity=1000, price=10)
+        catalog = get_sale_catalog(self.module1)
+        # 10€ / kg + 5%, for 100g
+        self.assertEqual(catalog.products[self.categoryproduct2.pk].price,
+                         decimal.Decimal('1.05'))
+        self.assertTrue(catalog.products[self.categoryproduct2.pk].is_active)
+
+    def test_margin_profit_saved(self):
+        stockentry = StockEntry.objects.create(operator=self.user1, shop=self.shop1)
+        StockEntryProduct.objects.create(
+            stockentry=stockentry, product=self.product2, quantity=1000, price=10)
+        get_sale_catalog(self.module1)
+        self.margin_profit.value = '10'
+        self.margin_profit.save()
+        get_sale_catalog(self.module1)
+        update_automatic_prices(Product.objects.all())
+        catalog = get_sale_catalog(self.module1)
+        self.assertEqual(catalog.products[self.categoryproduct2.pk].price,
+                         decimal.Decimal('1.10'))
+
+    def test_set_category_products(self):
+        get_sale_catalog(self.module1)
+        # Beer 50cl changed to 33cl, skoll removed, beer 25cl added
+        # Two savepoints, and deleted objects are loaded to send signals
+        with self.assertNumQueries(7):
+            set_category_products(self.category1, [(self.product1, 33), (self.product1, 25)])
+        self.assertListEqual(
+            list(self.category1.categoryproduct_set.order_by('pk').values_list(
+                'pk', 'product', 'quantity')),
+            [(self.categoryproduct1.pk, self.product1.pk, 33),
+             (self.categoryproduct1.pk + 3, self.product1.pk, 25)])
+        catalog = get_sale_catalog(self.module1)
+        self.assertEqual(catalog.products[self.categoryproduct1.pk].quantity, 33)
+        self.assertNotIn(self.categoryproduct3.pk, catalog.products)
+
+    def test_set_category_products_unchanged(self):
+        version = cache.get(SALE_CATALOG_VERSION_KEY)
+        with self.assertNumQueries(1):
+            set_category_products(self.category1, [(self.product1, 50), (self.product3, 1)])
+        self.assertEqual(cache.get(SALE_CATALOG_VERSION_KEY), version)
+
+    def test_set_category_products_reordered(self):
+        get_sale_catalog(self.module1)
+        set_category_products(self.category1, [(self.product3, 1), (self.product1, 50)])
+        self.assertListEqual(
+            list(self.category1.categoryproduct_set.order_by('order').values_list('pk', 'order')),
+            [(self.categoryproduct3.pk, 0), (self.categoryproduct1.pk, 1)])
+        beers = get_sale_catalog(self.module1).categories[1]
+        self.assertListEqual([product.pk for product in beers.products],
+                             [self.categoryproduct3.pk, self.categoryproduct1.pk])
+
+    def test_invalidate_sale_catalogs_once(self):
+        get_sale_catalog(self.module1)
+        with mock.patch('modules.utils.cache.set', wraps=cache.set) as cache_set:
+            with invalidate_sale_catalogs_once():
+                self.category1.delete()
+                self.category2.name = 'Meals'
+                self.category2.save()
+                self.assertEqual(cache_set.call_count, 0)
+            self.assertEqual(cache_set.call_count, 1)
+        catalog = get_sale_catalog(self.module1)
+        self.assertListEqual([category.name for category in catalog.categories], ['Meals'])
+
+
+class SaleCatalogCommitTestCase(TransactionTestCase):
+    def test_invalidated_on_commit(self):
+        with transaction.atomic():
+            invalidate_sale_catalogs()
+            # Catalogs built now read the old rows
+            version = cache.get(SALE_CATALOG_VERSION_KEY)
+        self.assertNotEqual(cache.get(SALE_CATALOG_VERSION_KEY), version)
+
+
+class CreateSaleIdempotencyTestCase(TransactionTestCase):
+    """
+    A sale submitted again with the same idempotency key is only paid once.
+
+    :note:: Operations are retried on lock errors, see retry_on_lock.
+    """
+    nb_threads = 8
+
+    def setUp(self):
+        cache.clear()
+        User.objects.create(pk=SALE_RECIPIENT_PK, username='AE_ENSAM')
+        self.user1 = User.objects.create(username='user1', balance=100)
+        self.user2 = User.objects.create(username='user2', balance=100)
+        self.shop1 = Shop.objects.create(
+            name='shop1', description='The first shop ever.', color='#F4FA58')
+        self.module1 = SelfSaleModule.objects.create(shop=self.shop1, state=True)
+        category1 = Category.objects.create(name='Beers', module=self.module1)
+        product1 = Product.objects.create(
+            name='beer', unit='CL', shop=self.shop1, is_manual=True, manual_price=2)
+        self.categoryproduct1 = CategoryProduct.objects.create(
+            category=category1, product=product1, quantity=50)
+
+    def create_sale(self, operator, idempotency_key):
+        return create_sale(self.module1, operator, operator,
+                           {self.categoryproduct1.pk: 2}, idempotency_key)
+
+    def test_replayed(self):
+        sale = self.create_sale(self.user1, 'key1')
+        self.assertEqual(self.create_sale(self.user1, 'key1').pk, sale.pk)
+        self.assertNotEqual(self.create_sale(self.user1, 'key2').pk, sale.pk)
+        self.assertNotEqual(self.create_sale(self.user1, None).pk, sale.pk)
+        self.user1.refresh_from_db()
+        self.assertEqual(self.user1.balance, decimal.Decimal(94))
+
+    def test_other_operator(self):
+        self.create_sale(self.user1, 'key1')
+        with self.assertRaises(PermissionDenied):
+            self.create_sale(self.user2, 'key1')
+        self.user2.refresh_from_db()
+        self.assertEqual(self.user2.balance, decimal.Decimal(100))
+
+    def test_created_concurrently(self):
+        sale = self.create_sale(self.user1, 'key1')
+        # The other submission wasn't committed yet when checked
+        calls = []
+
+        def replayed_sale_after_check(operator, idempotency_key):
+            calls.append(idempotency_key)
+            if len(calls) == 1:
+                return None
+            return get_replayed_sale(operator, idempotency_key)
+
+        with mock.patch('modules.utils.get_replayed_sale', replayed_sale_after_check):
+            self.assertEqual(self.create_sale(self.user1, 'key1').pk, sale.pk)
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(Sale.objects.count(), 1)
+        self.user1.refresh_from_db()
+        self.assertEqual(self.user1.balance, decimal.Decimal(98))
+
+    def test_concurrent_submissions(self):
+        barrier = threading.Barrier(self.nb_threads)
+        sale_pks = []
+        errors = []
+
+        def worker():
+            try:
+                operator = retry_on_lock(User.objects.get, pk=self.user1.pk)
+                barrier.wait()
+                sale = retry_on_lock(self.create_sale, operator, 'key1')
+                sale_pks.append(sale.pk)
+            except Exception as exception:  # pylint: disable=broad-except
+                errors.append(exception)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(self.nb_threads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertListEqual(errors, [])
+
+        sale = Sale.objects.get()
+        self.assertListEqual(sale_pks, [sale.pk] * self.nb_threads)
+        self.assertEqual(sale.amount(), decimal.Decimal(2))
+        self.user1.refresh_from_db()
+        self.assertEqual(self.user1.balance, decimal.Decimal(98))
+
+
+class SyncSalesTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        Configuration.objects.create(
+            name='BALANCE_THRESHOLD_PURCHASE', description='Threshold', value='0',
+            value_type='f')
+        User.objects.create(pk=SALE_RECIPIENT_PK, username='AE_ENSAM')
+        self.user1 = User.objects.create(username='user1', balance=6)
+        self.user2 = User.objects.create(username='user2', balance=100, is_active=False)
+        self.user3 = User.objects.create(username='user3', balance=100)
+        use_selfsalemodule = Permission.objects.get(codename='use_selfsalemodule')
+        self.user1.user_permissions.add(use_selfsalemodule)
+        self.user3.user_permissions.add(use_selfsalemodule)
+        self.shop1 = Shop.objects.create(
+            name='shop1', description='The first shop ever.', color='#F4FA58')
+        self.module1 = SelfSaleModule.objects.create(
+            shop=self.shop1, state=True, limit_purchase=10)
+        category1 = Category.objects.create(name='Beers', module=self.module1)
+        self.product1 = Product.objects.create(
+            name='beer', unit='CL', shop=self.shop1, is_manual=True, manual_price=2)
+        self.categoryproduct1 = CategoryProduct.objects.create(
+            category=category1, product=self.product1, quantity=50)
+
+    def offline_sale(self, idempotency_key, qty, client='user1', day=1):
+        return {
+            'idempotency_key': idempotency_key,
+            'client': client,
+            'datetime': '2026-10-0{0}T18:30:00+02:00'.format(day),
+            'lines': [{'category_product': self.categoryproduct1.pk, 'qty': qty}]
+        }
+
+    def assertOutcomesEqual(self, outcomes, expected):
+        self.assertListEqual([(outcome['idempotency_key'], outcome['status'], outcome['reason'])
+                              for outcome in outcomes], expected)
+
+    def test_sync(self):
+        outcomes = sync_sales(self.module1, [
+            self.offline_sale('key1', 2, day=1),
+            self.offline_sale('key2', 3, day=2),
+            # Only 1€ left
+            self.offline_sale('key3', 2, day=3),
+            self.offline_sale('key4', 1, day=4),
+            self.offline_sale('key5', 1, client='user2'),
+            self.offline_sale('key6', 1, client='user53'),
+            self.offline_sale('key7', 0),
+            {'idempotency_key': 'key8', 'client': 'user1'},
+            'key9'
+        ])
+        self.assertOutcomesEqual(outcomes, [
+            ('key1', 'accepted', None), ('key2', 'accepted', None),
+            ('key3', 'rejected', 'balance'), ('key4', 'accepted', None),
+            ('key5', 'rejected', 'client'), ('key6', 'rejected', 'client'),
+            ('key7', 'rejected', 'invalid'), ('key8', 'rejected', 'invalid'),
+            (None, 'rejected', 'invalid')
+        ])
+        sale = Sale.objects.get(pk=outcomes[1]['sale_id'])
+        self.assertEqual(sale.datetime, make_aware(datetime.datetime(2026, 10, 2, 16, 30),
+                                                   datetime.timezone.utc))
+        self.assertEqual(sale.amount(), decimal.Decimal(3))
+        self.assertEqual(sale.operator, self.user1)
+        self.user1.refresh_from_db()
+        self.assertEqual(self.user1.balance, decimal.Decimal(0))
+        self.product1.refresh_from_db()
+        self.assertEqual(self.product1.stock.stock_output, 300)
+
+    def test_limit_purchase(self):
+        self.user1.credit(100)
+        outcomes = sync_sales(self.module1, [self.offline_sale('key1', 11)])
+        self.assertOutcomesEqual(outcomes, [('key1', 'rejected', 'limit')])
+
+    def test_duplicate(self):
+        first_outcomes = sync_sales(self.module1, [self.offline_sale('key1', 1)])
+        outcomes = sync_sales(self.module1, [self.offline_sale('key1', 1),
+                                             self.offline_sale('key2', 1),
+                                             self.offline_sale('key2', 1)])
+        self.assertOutcomesEqual(outcomes, [('key1', 'duplicate', None),
+                                            ('key2', 'accepted', None),
+                                            ('key2', 'duplicate', None)])
+        self.assertEqual(outcomes[0]['sale_id'], first_outcomes[0]['sale_id'])
+        self.assertEqual(outcomes[2]['sale_id'], outcomes[1]['sale_id'])
+        self.user1.refresh_from_db()
+        self.assertEqual(self.user1.balance, decimal.Decimal(4))
+
+    def test_client_without_permission(self):
+        self.user1.user_permissions.clear()
+        outcomes = sync_sales(self.module1, [self.offline_sale('key1', 1)])
+        self.assertOutcomesEqual(outcomes, [('key1', 'rejected', 'client')])
+        self.user1.refresh_from_db()
+        self.assertEqual(self.user1.balance, decimal.Decimal(6))
+
+    def test_key_of_another_sale(self):
+        sale = sync_sales(self.module1, [self.offline_sale('key1', 1, client='user3')])[0]
+        outcomes = sync_sales(self.module1, [self.offline_sale('key1', 1),
+                                             self.offline_sale('key2', 1)])
+        self.assertOutcomesEqual(outcomes, [('key1', 'rejected', 'invalid'),
+                                            ('key2', 'accepted', None)])
+        self.assertNotEqual(outcomes[0]['sale_id'], sale['sale_id'])
+        self.user1.refresh_from_db()
+        self.assertEqual(self.user1.balance, decimal.Decimal(5))
@@ -1,8 +1,17 @@
+import decimal
+import json
+
+from django.db import connection
 from django.test import Client
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
 from borgia.tests.utils import get_login_url_redirected
-from modules.models import Category, OperatorSaleModule, SelfSaleModule
+from modules.models import (Category, CategoryProduct, OperatorSaleModule,
+                            SelfSaleModule)
+from modules.utils import get_sync_key, sign_sync_batch
+from sales.models import Sale
+from shops.models import Product
 from shops.tests.tests_views import BaseShopsViewsTest
 
 
@@ -79,12 +88,290 @@ class ShopModuleSaleViewTests(BaseGeneralShopModuleViewsTest):
         super().offline_user_redirection()
 
 
+class BaseShopModuleSaleTest(BaseGeneralShopModuleViewsTest):
+    def setUp(self):
+        super().setUp()
+        self.category1 = Category.objects.create(
+            name='SelfSaleCategory1',
+            module=self.selfsalemodule1
+        )
+        # 10cl of beer at 2€ / L
+        self.categoryproduct1 = CategoryProduct.objects.create(
+            category=self.category1,
+            product=self.product2,
+            quantity=10
+        )
+
+
+class ShopModuleSalePostTests(BaseShopModuleSaleTest):
+    url_view = 'url_shop_module_sale'
+
+    def post_sale(self, invoice):
+        field = str(self.categoryproduct1.pk) + '-' + str(self.category1.pk)
+        return self.client1.post(self.get_url(self.shop1.pk, 'self_sales'), {field: invoice})
+
+    def test_self_sale(self):
+        response_client1 = self.post_sale(3)
+        self.assertEqual(response_client1.status_code, 200)
+        sale = Sale.objects.get(sender=self.user1)
+        self.assertEqual(sale.amount(), decimal.Decimal('0.60'))
+        self.user1.refresh_from_db()
+        self.assertEqual(self.user1.balance, decimal.Decimal('52.40'))
+
+    def test_submitted_again(self):
+        field = str(self.categoryproduct1.pk) + '-' + str(self.category1.pk)
+        data = {field: 3, 'idempotency_key': 'f3b8e6a2c1d94b7e'}
+        for _ in range(2):
+            response_client1 = self.client1.post(
+                self.get_url(self.shop1.pk, 'self_sales'), data)
+            self.assertEqual(response_client1.status_code, 200)
+            self.assertEqual(response_client1.context['sale'].amount(), decimal.Decimal('0.60'))
+        self.assertEqual(Sale.objects.filter(sender=self.user1).count(), 1)
+        self.user1.refresh_from_db()
+        self.assertEqual(self.user1.balance, decimal.Decimal('52.40'))
+
+    def test_new_idempotency_key(self):
+        response_client1 = self.client1.get(self.get_url(self.shop1.pk, 'self_sales'))
+        first_key = response_client1.context['form']['idempotency_key'].value()
+        response_client1 = self.client1.get(self.get_url(self.shop1.pk, 'self_sales'))
+        self.assertTrue(first_key)
+        self.assertNotEqual(response_client1.context['form']['idempotency_key'].value(),
+                            first_key)
+
+    def test_no_configuration_queries(self):
+        # Warm-up
+        self.post_sale(1)
+        with CaptureQueriesContext(connection) as context:
+            response_client1 = self.post_sale(1)
+        self.assertEqual(response_client1.status_code, 200)
+        self.assertEqual(Sale.objects.filter(sender=self.user1).count(), 2)
+        self.assertFalse([query for query in context.captured_queries
+                          if 'configurations_configuration' in query['sql']])
+
+    def test_catalog_cached(self):
+        # Warm-up
+        self.client1.get(self.get_url(self.shop1.pk, 'self_sales'))
+        with CaptureQueriesContext(connection) as context:
+            response_client1 = self.client1.get(self.get_url(self.shop1.pk, 'self_sales'))
+        self.assertEqual(response_client1.status_code, 200)
+        self.assertContains(response_client1, str(self.categoryproduct1))
+        self.assertFalse([query for query in context.captured_queries
+                          if 'modules_category' in query['sql']])
+
+    def test_constant_queries(self):
+        category_products = [self.categoryproduct1]
+        for i in range(4):
+            product = Product.objects.create(
+                name='product' + str(i), shop=self.shop1, is_manual=True, manual_price=1)
+            category_products.append(CategoryProduct.objects.create(
+                category=self.category1, product=product, quantity=1))
+
+        def post_cart(invoices):
+            data = {str(category_product.pk) + '-' + str(self.category1.pk): invoice
+                    for category_product, invoice in zip(category_products, invoices)}
+            with CaptureQueriesContext(connection) as context:
+                response = self.client1.post(self.get_url(self.shop1.pk, 'self_sales'), data)
+            self.assertEqual(response.status_code, 200)
+            return len(context.captured_queries)
+
+        # Warm-up
+        post_cart([2, 0, 0, 0, 0])
+        self.assertEqual(post_cart([2, 0, 0, 0, 0]), post_cart([2, 2, 2, 2, 2]))
+
+        sale = Sale.objects.filter(sender=self.user1).latest('pk')
+        self.assertEqual(sale.saleproduct_set.count(), 5)
+        # 10cl of beer x 2 at 2€ / L, 4 products x 2 at 1€
+        self.assertEqual(sale.amount(), decimal.Decimal('8.40'))
+        self.product2.refresh_from_db()
+        self.assertEqual(self.product2.stock.stock_output, 20 * 3)
+        self.user1.refresh_from_db()
+        self.assertEqual(self.user1.balance, decimal.Decimal('53') - decimal.Decimal('0.40')
+                         - decimal.Decimal('0.40') - decimal.Decimal('8.40'))
+
+
+class ShopModuleSaleApiTests(BaseShopModuleSaleTest):
+    url_view = 'url_shop_module_sale_api'
+
+    def post_cart(self, client, module_class, cart):
+        return client.post(self.get_url(self.shop1.pk, module_class), json.dumps(cart),
+                           content_type='application/json')
+
+    def test_self_sale(self):
+        response_client1 = self.post_cart(self.client1, 'self_sales', {
+            'lines': [{'category_product': self.categoryproduct1.pk, 'qty': 3}]})
+        self.assertEqual(response_client1.status_code, 200)
+        sale = Sale.objects.get(sender=self.user1)
+        self.assertDictEqual(response_client1.json(), {
+            'sale_id': sale.pk, 'amount': '0.60', 'new_balance': '52.40'})
+
+    def test_submitted_again(self):
+        cart = {'lines': [{'category_product': self.categoryproduct1.pk, 'qty': 3}],
+                'idempotency_key': 'f3b8e6a2c1d94b7e'}
+        responses = [self.post_cart(self.client1, 'self_sales', cart) for _ in range(2)]
+        self.assertEqual(responses[0].status_code, 200)
+        self.assertDictEqual(responses[1].json(), responses[0].json())
+        self.assertEqual(Sale.objects.filter(sender=self.user1).count(), 1)
+
+    def test_idempotency_key_of_other_operator(self):
+        cart = {'lines': [{'category_product': self.categoryproduct1.pk, 'qty': 3}],
+                'idempotency_key': 'f3b8e6a2c1d94b7e'}
+        self.post_cart(self.client1, 'self_sales', cart)
+        cart['client'] = self.user1.username
+        response_client3 = self.post_cart(self.client3, 'operator_sales', cart)
+        self.assertEqual(response_client3.status_code, 403)
+        del cart['idempotency_key']
+        response_client3 = self.post_cart(self.client3, 'operator_sales', cart)
+        self.assertEqual(response_client3.status_code, 400)
+
+    def test_operator_sale(self):
+        category2 = Category.objects.create(
+            name='OperatorSaleCategory1',
+            module=self.operatorsalemodule1
+        )
+        categoryproduct2 = CategoryProduct.objects.create(
+            category=category2,
+            product=self.product2,
+            quantity=10
+        )
+        response_client3 = self.post_cart(self.client3, 'operator_sales', {
+            'client': self.user2.username,
+            'lines': [{'category_product': categoryproduct2.pk, 'qty': 1},
+                      {'category_product': categoryproduct2.pk, 'qty': 1}]})
+        self.assertEqual(response_client3.status_code, 200)
+        sale = Sale.objects.get(sender=self.user2)
+        self.assertEqual(sale.operator, self.user3)
+        self.assertEqual(response_client3.json()['amount'], '0.40')
+        self.assertEqual(response_client3.json()['new_balance'], '143.60')
+
+    def test_not_allowed_user(self):
+        response_client2 = self.post_cart(self.client2, 'operator_sales', {
+            'client': self.user1.username,
+            'lines': [{'category_product': self.categoryproduct1.pk, 'qty': 1}]})
+        self.assertEqual(response_client2.status_code, 403)
+
+    def test_insufficient_balance(self):
+        response_client1 = self.post_cart(self.client1, 'self_sales', {
+            'lines': [{'category_product': self.categoryproduct1.pk, 'qty': 1000}]})
+        self.assertEqual(response_client1.status_code, 400)
+        self.assertDictEqual(response_client1.json(), {'errors': ['Crédit insuffisant !']})
+        self.assertFalse(Sale.objects.filter(sender=self.user1).exists())
+
+    def test_limit_purchase(self):
+        self.selfsalemodule1.limit_purchase = decimal.Decimal('0.50')
+        self.selfsalemodule1.save()
+        response_client1 = self.post_cart(self.client1, 'self_sales', {
+            'lines': [{'category_product': self.categoryproduct1.pk, 'qty': 3}]})
+        self.assertEqual(response_client1.status_code, 400)
+        self.assertDictEqual(response_client1.json(),
+                             {'errors': ['Le montant est supérieur à la limite.']})
+
+    def test_invalid_cart(self):
+        for cart in ({}, {'lines': [{'category_product': self.categoryproduct1.pk}]},
+                     {'lines': [{'category_product': 'beer', 'qty': 1}]}, []):
+            with self.subTest(cart=cart):
+                response_client1 = self.post_cart(self.client1, 'self_sales', cart)
+                self.assertEqual(response_client1.status_code, 400)
+        response_client1 = self.post_cart(self.client1, 'self_sales', {
+            'lines': [{'category_product': 5353, 'qty': 1}]})
+        self.assertEqual(response_client1.status_code, 400)
+        self.assertDictEqual(response_client1.json(), {'errors': ['Produit inconnu']})
+        self.assertFalse(Sale.objects.filter(sender=self.user1).exists())
+
+
+class ShopModuleCatalogApiTests(BaseShopModuleSaleTest):
+    url_view = 'url_shop_module_catalog_api'
+
+    def test_get(self):
+        response_client1 = self.client1.get(self.get_url(self.shop1.pk, 'self_sales'))
+        self.assertEqual(response_client1.status_code, 200)
+        self.assertDictEqual(response_client1.json(), {'categories': [{
+            'pk': self.category1.pk,
+            'name': 'SelfSaleCategory1',
+            'products': [{
+                'category_product': self.categoryproduct1.pk,
+                'label': str(self.categoryproduct1),
+                'price': '0.20',
+                'is_active': True
+            }]
+        }]})
+
+    def test_etag(self):
+        url = self.get_url(self.shop1.pk, 'self_sales')
+        etag = self.client1.get(url)['ETag']
+        response_client1 = self.client1.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response_client1.status_code, 304)
+        self.assertEqual(response_client1.content, b'')
+
+        self.categoryproduct1.quantity = 20
+        self.categoryproduct1.save()
+        response_client1 = self.client1.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response_client1.status_code, 200)
+        self.assertNotEqual(response_client1['ETag'], etag)
+
+    def test_not_allowed_user(self):
+        response_client2 = self.client2.get(self.get_url(self.shop1.pk, 'operator_sales'))
+        self.assertEqual(response_client2.status_code, 403)
+
+
+class ShopModuleSyncApiTests(BaseShopModuleSaleTest):
+    url_view = 'url_shop_module_sync_api'
+
+    def post_batch(self, module_class, batch, signature=None):
+        body = json.dumps(batch).encode('utf-8')
+        if signature is None:
+            signature = sign_sync_batch(self.selfsalemodule1, body)
+        return Client().post(self.get_url(self.shop1.pk, module_class), body,
+                             content_type='application/json',
+                             HTTP_X_BORGIA_SIGNATURE=signature)
+
+    def test_sync(self):
+        response = self.post_batch('self_sales', {'sales': [{
+            'idempotency_key': 'key1',
+            'client': self.user1.username,
+            'datetime': '2026-10-01T18:30:00+02:00',
+            'lines': [{'category_product': self.categoryproduct1.pk, 'qty': 3}]
+        }]})
+        self.assertEqual(response.status_code, 200)
+        sale = Sale.objects.get(sender=self.user1)
+        self.assertListEqual(response.json()['sales'], [{
+            'idempotency_key': 'key1', 'status': 'accepted', 'sale_id': sale.pk,
+            'reason': None}])
+        self.user1.refresh_from_db()
+        self.assertEqual(self.user1.balance, decimal.Decimal('52.40'))
+
+    def test_wrong_signature(self):
+        response = self.post_batch('self_sales', {'sales': []}, signature='0' * 64)
+        self.assertEqual(response.status_code, 403)
+        response = self.post_batch('self_sales', {'sales': []}, signature='')
+        self.assertEqual(response.status_code, 403)
+
+    def test_invalid_batch(self):
+        response = self.post_batch('self_sales', {'sales': 'key1'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_operator_sales(self):
+        response = self.post_batch('operator_sales', {'sales': []})
+        self.assertEqual(response.status_code, 404)
+
+    def test_disabled_module(self):
+        self.selfsalemodule1.state = False
+        self.selfsalemodule1.save()
+        response = self.post_batch('self_sales', {'sales': []})
+        self.assertEqual(response.status_code, 404)
+
+
 class ShopModuleConfigViewTests(BaseGeneralShopModuleViewsTest):
     url_view = 'url_shop_module_config'
 
     def test_chief_get(self):
         super().chief_get()
 
+    def test_sync_key(self):
+        response_client3 = self.client3.get(self.get_url(self.shop1.pk, 'self_sales'))
+        self.assertContains(response_client3, get_sync_key(self.selfsalemodule1))
+        response_client3 = self.client3.get(self.get_url(self.shop1.pk, 'operator_sales'))
+        self.assertNotIn('sync_key', response_client3.context)
+
     def test_not_allowed_user_get(self):
         super().not_allowed_user_get()
 
@@ -205,6 +492,40 @@ class BaseFocusShopModuleCategoryViewsTest(BaseShopModuleCategoryViewsTest):
 class ShopModuleCategoryUpdateViewTests(BaseFocusShopModuleCategoryViewsTest):
     url_view = 'url_shop_module_category_update'
 
+    def get_product_choice(self, product):
+        return str(product.pk) + '/' + str(product.get_unit_display())
+
+    def test_post(self):
+        category3 = Category.objects.create(
+            name='SelfSaleCategory3', module=self.selfsalemodule1, order=1)
+        category4 = Category.objects.create(
+            name='SelfSaleCategory4', module=self.selfsalemodule1, order=2)
+        beer = CategoryProduct.objects.create(
+            category=self.category1, product=self.product2, quantity=50)
+        CategoryProduct.objects.create(
+            category=self.category1, product=self.product1, quantity=1)
+
+        response = self.client3.post(
+            self.get_url(self.shop1.pk, 'self_sales', self.category1.pk),
+            {'name': 'Beers', 'order': 2,
+             'form-TOTAL_FORMS': 3, 'form-INITIAL_FORMS': 0,
+             'form-0-product': self.get_product_choice(self.product2), 'form-0-quantity': 33,
+             'form-1-product': self.get_product_choice(self.product3), 'form-1-quantity': 100,
+             'form-2-product': '', 'form-2-quantity': ''})
+        self.assertEqual(response.status_code, 302)
+
+        self.assertListEqual(
+            list(self.selfsalemodule1.categories.order_by('order').values_list(
+                'pk', 'order', 'name')),
+            [(category3.pk, 0, 'SelfSaleCategory3'),
+             (category4.pk, 1, 'SelfSaleCategory4'),
+             (self.category1.pk, 2, 'Beers')])
+        self.assertListEqual(
+            list(self.category1.categoryproduct_set.order_by('pk').values_list(
+                'pk', 'product', 'quantity')),
+            [(beer.pk, self.product2.pk, 33),
+             (beer.pk + 2, self.product3.pk, 100)])
+
     def test_chief_get(self):
         super().chief_get()
 
@@ -1,6 +1,7 @@
 from django.urls import include, path
 
-from modules.views import (ShopModuleSaleView,
+from modules.views import (ShopModuleSaleView, ShopModuleSaleApiView,
+                           ShopModuleCatalogApiView, ShopModuleSyncApiView,
                            ShopModuleCategoryCreateView, ShopModuleCategoryDeleteView,
                            ShopModuleCategoryUpdateView, ShopModuleConfigUpdateView,
                            ShopModuleConfigView)
@@ -9,6 +10,14 @@ modules_patterns = [
     path('shops/<int:shop_pk>/modules/', include([
         path('<str:module_class>/', include([
             path('', ShopModuleSaleView.as_view(), name='url_shop_module_sale'),
+            path('api/', include([
+                path('sale/', ShopModuleSaleApiView.as_view(),
+                     name='url_shop_module_sale_api'),
+                path('catalog/', ShopModuleCatalogApiView.as_view(),
+                     name='url_shop_module_catalog_api'),
+                path('sync/', ShopModuleSyncApiView.as_view(),
+                     name='url_shop_module_sync_api')
+            ])),
             path('config/', ShopModuleConfigView.as_view(),
                  name='url_shop_module_config'),
             path('config/update/', ShopModuleConfigUpdateView.as_view(),
@@ -0,0 +1,495 @@
+"""
+Define modules utils.
+
+The catalog of a shop module (categories, products and prices) is cached.
+A version stamp stored in the Django cache is changed each time categories,
+products, stock entries or the margin profit change, so that catalogs are
+built again on next use.
+"""
+import collections
+import contextlib
+import decimal
+import hashlib
+import hmac
+import threading
+import uuid
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.core.exceptions import PermissionDenied
+from django.db import IntegrityError, transaction
+from django.db.models import F, Prefetch, prefetch_related_objects
+from django.utils.crypto import constant_time_compare, salted_hmac
+from django.utils.dateparse import parse_datetime
+from django.utils.timezone import is_naive, make_aware, now
+
+from configurations.utils import configuration_get
+from modules.models import CategoryProduct
+from sales.models import Sale, SaleProduct
+from stocks.models import ProductStock
+from users.models import User
+
+SALE_RECIPIENT_PK = 1
+SALE_CATALOG_VERSION_KEY = 'sale_catalog_version'
+SALE_CATALOG_CACHE_TIMEOUT = 60 * 60
+
+_deferred_invalidation = threading.local()
+
+SALE_ERRORS = {
+    'balance': 'Crédit insuffisant !',
+    'limit': 'Le montant est supérieur à la limite.',
+    'empty': 'La commande doit être positive.'
+}
+
+SaleCatalog = collections.namedtuple('SaleCatalog', ['categories', 'products'])
+SaleCatalogCategory = collections.namedtuple(
+    'SaleCatalogCategory', ['pk', 'name', 'order', 'products'])
+SaleCatalogProduct = collections.namedtuple(
+    'SaleCatalogProduct',
+    ['pk', 'category_pk', 'product_pk', 'label', 'quantity', 'price', 'is_active'])
+
+
+def get_sale_catalog_version():
+    """
+    Return the version stamp of cached catalogs.
+    """
+    version = cache.get(SALE_CATALOG_VERSION_KEY)
+    if version is None:
+        version = uuid.uuid4().hex
+        cache.set(SALE_CATALOG_VERSION_KEY, version, None)
+    return version
+
+
+def invalidate_sale_catalogs():
+    """
+    Change the version stamp of catalogs, all cached catalogs are built again
+    on next use.
+
+    Called by signals when categories, products, stock entries or the margin
+    profit change.
+
+    :note:: Inside invalidate_sale_catalogs_once, the version stamp is only
+    changed once at the end of the block.
+    :note:: Inside a transaction, the version stamp is changed again when it
+    is committed: catalogs built meanwhile read the old rows.
+    """
+    if getattr(_deferred_invalidation, 'depth', 0):
+        _deferred_invalidation.pending = True
+        return
+    cache.set(SALE_CATALOG_VERSION_KEY, uuid.uuid4().hex, None)
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(invalidate_sale_catalogs)
+
+
+@contextlib.contextmanager
+def invalidate_sale_catalogs_once():
+    """
+    Change the version stamp of catalogs once for all the changes made in the
+    block, instead of once per object saved or deleted.
+
+    :note:: Open it outside of the transaction of the changes, so that the
+    catalogs aren't built again before the transaction is committed.
+    """
+    _deferred_invalidation.depth = getattr(_deferred_invalidation, 'depth', 0) + 1
+    try:
+        yield
+    finally:
+        _deferred_invalidation.depth -= 1
+        if _deferred_invalidation.depth == 0 and getattr(_deferred_invalidation, 'pending', False):
+            _deferred_invalidation.pending = False
+            invalidate_sale_catalogs()
+
+
+def build_sale_catalog(module):
+    """
+    Build the catalog of the module, with two queries.
+
+    :param module: Shop module, mandatory.
+    :type module: SelfSaleModule or OperatorSaleModule object
+    :returns: categories ordered, with their products, and the products by
+    category product pk.
+    :rtype: SaleCatalog
+    :note:: A product is active if it can be sold: its price is positive and
+    it is neither removed nor deactivated.
+    """
+    categories = module.categories.order_by('order', 'pk').prefetch_related(Prefetch(
+        'categoryproduct_set',
+        queryset=CategoryProduct.objects.select_related('product').order_by('order', 'pk')))
+
+    catalog_categories = []
+    products = {}
+    for category in categories:
+        category_products = []
+        for category_product in category.categoryproduct_set.all():
+            price = category_product.get_price()
+            catalog_product = SaleCatalogProduct(
+                pk=category_product.pk,
+                category_pk=category.pk,
+                product_pk=category_product.product_id,
+                label=str(category_product),
+                quantity=category_product.quantity,
+                price=price,
+                is_active=(price > 0 and not category_product.product.is_removed
+                           and category_product.product.is_active)
+            )
+            category_products.append(catalog_product)
+            products[catalog_product.pk] = catalog_product
+        catalog_categories.append(SaleCatalogCategory(
+            pk=category.pk,
+            name=category.name,
+            order=category.order,
+            products=tuple(category_products)
+        ))
+    return SaleCatalog(categories=tuple(catalog_categories), products=products)
+
+
+def get_sale_catalog(module):
+    """
+    Return the catalog of the module, from the cache if it is up to date.
+
+    :param module: Shop module, mandatory.
+    :type module: SelfSaleModule or OperatorSaleModule object
+    :rtype: SaleCatalog
+    """
+    key = 'sale_catalog:{0}:{1}:{2}'.format(
+        get_sale_catalog_version(), module.get_module_class(), module.pk)
+    catalog = cache.get(key)
+    if catalog is None:
+        catalog = build_sale_catalog(module)
+        cache.set(key, catalog, SALE_CATALOG_CACHE_TIMEOUT)
+    return catalog
+
+
+def set_category_products(category, products):
+    """
+    Replace the products of the category, writing only the differences with
+    one delete, one bulk_update and one bulk_create.
+
+    Category products kept or whose quantity or position only changes keep
+    their pk, carts of sale terminals referring to them stay valid.
+
+    :param products: products and quantities of the category, in order.
+    :type category: Category object
+    :type products: list of (Product object, integer) tuples
+    """
+    remaining = [(order, product.pk, quantity)
+                 for order, (product, quantity) in enumerate(products)]
+    changed = []
+    kept = []
+    for category_product in category.categoryproduct_set.order_by('order', 'pk'):
+        match = next((item for item in remaining
+                      if item[1:] == (category_product.product_id, category_product.quantity)),
+                     None)
+        if match is None:
+            changed.append(category_product)
+        else:
+            remaining.remove(match)
+            kept.append((category_product, match[0]))
+
+    to_delete = []
+    for category_product in changed:
+        match = next((item for item in remaining
+                      if item[1] == category_product.product_id), None)
+        if match is None:
+            to_delete.append(category_product.pk)
+        else:
+            remaining.remove(match)
+            kept.append((category_product, match[0]))
+
+    to_update = []
+    for category_product, order in kept:
+        quantity = products[order][1]
+        if (category_product.order, category_product.quantity) != (order, quantity):
+            category_product.order = order
+            category_product.quantity = quantity
+            to_update.append(category_product)
+
+    if not (to_delete or to_update or remaining):
+        return
+    with transaction.atomic():
+        if to_delete:
+            CategoryProduct.objects.filter(pk__in=to_delete).delete()
+        if to_update:
+            CategoryProduct.objects.bulk_update(to_update, ['quantity', 'order'])
+        if remaining:
+            CategoryProduct.objects.bulk_create([
+                CategoryProduct(category=category, product_id=product_pk, quantity=quantity,
+                                order=order)
+                for order, product_pk, quantity in remaining])
+        # Bulk updates and inserts send no signal
+        invalidate_sale_catalogs()
+
+
+def get_invoices_amount(catalog, invoices):
+    """
+    Return the amount of the invoices, at the prices of the catalog.
+
+    :param invoices: Number of each category product ordered, by category
+    product pk. Category products not active in the catalog are ignored.
+    :type catalog: SaleCatalog
+    :type invoices: dict
+    """
+    amount = 0
+    for category_product_pk, invoice in invoices.items():
+        category_product = catalog.products.get(category_product_pk)
+        if category_product is not None and category_product.is_active:
+            amount += category_product.price * invoice
+    return amount
+
+
+def check_sale(module, client, amount, balance_threshold_purchase):
+    """
+    Return why the sale can't be done, None if it can.
+
+    :param balance_threshold_purchase: value of the BALANCE_THRESHOLD_PURCHASE
+    configuration.
+    :type module: SelfSaleModule or OperatorSaleModule object
+    :type client: User object
+    :type amount: Decimal
+    :returns: 'balance', 'limit' or 'empty', see SALE_ERRORS, or None.
+    """
+    if (client.balance - amount) < balance_threshold_purchase:
+        return 'balance'
+    if module.limit_purchase and amount > module.limit_purchase:
+        return 'limit'
+    if amount <= 0:
+        return 'empty'
+    return None
+
+
+def get_replayed_sale(operator, idempotency_key):
+    """
+    Return the sale already created with the idempotency key, None if there
+    is none.
+
+    :param operator: User submitting the sale again, mandatory.
+    :param idempotency_key: key given by the terminal, can be empty.
+    :type operator: User object
+    :type idempotency_key: string
+    :raises: PermissionDenied if the sale was operated by another user.
+    """
+    if not idempotency_key:
+        return None
+    try:
+        sale = Sale.objects.with_products().select_related('sender').get(
+            idempotency_key=idempotency_key)
+    except Sale.DoesNotExist:
+        return None
+    if sale.operator_id != operator.pk:
+        raise PermissionDenied
+    return sale
+
+
+def create_sale(module, operator, client, invoices, idempotency_key=None, datetime=None):
+    """
+    Create and pay a sale of the products of the module, with a constant
+    number of queries whatever the number of products.
+
+    Prices are the ones of the catalog of the module, which was displayed
+    and validated.
+
+    If a sale was already created with the idempotency key, for instance
+    when a terminal submits again a sale after a timeout, this sale is
+    returned and nothing is paid again. The key being unique, it holds for
+    concurrent submissions too.
+
+    :param module: Shop module used, mandatory.
+    :param operator: User operating the sale, mandatory.
+    :param client: User paying the sale, mandatory.
+    :param invoices: Number of each category product sold, by category product
+    pk, mandatory. Category products not active in the catalog are ignored.
+    :type module: SelfSaleModule or OperatorSaleModule object
+    :type operator, client: User object
+    :param idempotency_key: key given by the terminal, optional.
+    :param datetime: date of the sale, now if not given.
+    :type invoices: dict
+    :type idempotency_key: string
+    :type datetime: aware datetime
+    :returns: the sale paid, with its sale products prefetched.
+    :rtype: Sale object
+    :raises: PermissionDenied if the key was used by another operator.
+    """
+    replayed_sale = get_replayed_sale(operator, idempotency_key)
+    if replayed_sale is not None:
+        return replayed_sale
+
+    catalog = get_sale_catalog(module)
+
+    try:
+        with transaction.atomic():
+            sale = Sale.objects.create(
+                operator=operator,
+                sender=client,
+                recipient_id=SALE_RECIPIENT_PK,
+                module=module,
+                shop=module.shop,
+                idempotency_key=idempotency_key or None,
+                datetime=datetime or now()
+            )
+            sale_products = []
+            for category_product_pk, invoice in invoices.items():
+                catalog_product = catalog.products.get(category_product_pk)
+                if catalog_product is None or not catalog_product.is_active:
+                    continue
+                sale_products.append(SaleProduct(
+                    sale=sale,
+                    product_id=catalog_product.product_pk,
+                    quantity=catalog_product.quantity * invoice,
+                    # Rounded as saved, so that the amount debited is the amount of the sale
+                    price=(catalog_product.price * invoice).quantize(decimal.Decimal('0.01'))
+                ))
+            # bulk_create doesn't send post_save signals, stocks are updated here
+            SaleProduct.objects.bulk_create(sale_products)
+            quantities = {}
+            for sale_product in sale_products:
+                quantities[sale_product.product_id] = quantities.get(
+                    sale_product.product_id, 0) + sale_product.quantity
+            ProductStock.add_movements(quantities, 'stock_output', sale.datetime)
+
+            prefetch_related_objects([sale], Prefetch(
+                'saleproduct_set', queryset=SaleProduct.objects.select_related('product')))
+            sale.pay(sum(sale_product.price for sale_product in sale_products))
+    except IntegrityError:
+        # The same sale was submitted concurrently, and created first
+        replayed_sale = get_replayed_sale(operator, idempotency_key)
+        if replayed_sale is None:
+            raise
+        return replayed_sale
+
+    return sale
+
+
+def get_sync_key(module):
+    """
+    Return the secret key signing batches of offline sales sent by the
+    terminals of the module, derived from SECRET_KEY.
+    """
+    return salted_hmac('borgia.modules.sync', '{0}-{1}'.format(
+        module.get_module_class(), module.pk)).hexdigest()
+
+
+def sign_sync_batch(module, body):
+    """
+    Return the HMAC-SHA256 signature of the body of a batch, in hexadecimal.
+
+    :type body: bytes
+    """
+    return hmac.new(get_sync_key(module).encode('utf-8'), body, hashlib.sha256).hexdigest()
+
+
+def verify_sync_batch(module, body, signature):
+    """
+    Return True if the signature of the body of a batch is valid.
+    """
+    return constant_time_compare(sign_sync_batch(module, body), signature or '')
+
+
+def parse_offline_sale(catalog, offline_sale):
+    """
+    Return the idempotency key, the client username, the datetime and the
+    invoices of a sale recorded offline.
+
+    :raises: ValueError, KeyError, TypeError or AttributeError if the sale is
+    malformed or contains products not active in the catalog.
+    """
+    idempotency_key = offline_sale['idempotency_key']
+    if not isinstance(idempotency_key, str) or not 0 < len(idempotency_key) <= 64:
+        raise ValueError('Invalid idempotency key')
+    datetime = parse_datetime(offline_sale['datetime'])
+    if datetime is None:
+        raise ValueError('Invalid datetime')
+    if is_naive(datetime):
+        datetime = make_aware(datetime)
+    invoices = {}
+    for line in offline_sale['lines']:
+        category_product = catalog.products[int(line['category_product'])]
+        invoice = int(line['qty'])
+        if not category_product.is_active or invoice <= 0:
+            raise ValueError('Invalid line')
+        invoices[category_product.pk] = invoices.get(category_product.pk, 0) + invoice
+    return idempotency_key, str(offline_sale['client']), datetime, invoices
+
+
+def sync_sales(module, batch):
+    """
+    Create the sales recorded offline by a terminal of the module, in the
+    order of the batch and in one transaction.
+
+    Sales keep their datetime, prices are the ones of the catalog. Each
+    sale is checked like an online one, against the balance of the client
+    updated by the previous sales of the batch.
+
+    :param module: Self sale module of the terminal, mandatory.
+    :param batch: sales, each one {"idempotency_key": key, "client": username,
+    "datetime": ISO 8601, "lines": [{"category_product": pk, "qty": number}]}
+    :type module: SelfSaleModule object
+    :type batch: list
+    :returns: the outcome of each sale, {"idempotency_key", "status",
+    "sale_id", "reason"}. The status is "accepted", "duplicate" if the sale
+    was already created by the client on the module, or "rejected". The
+    reason of a rejection is "invalid", "client" or one of SALE_ERRORS.
+    :rtype: list
+    :note:: Like online self sales, the client must be active and allowed to
+    use self sale modules. A key already used by another sale is invalid.
+    """
+    catalog = get_sale_catalog(module)
+    balance_threshold_purchase = configuration_get('BALANCE_THRESHOLD_PURCHASE').get_value()
+    offline_sales = [offline_sale for offline_sale in batch if isinstance(offline_sale, dict)]
+    clients = User.objects.in_bulk(
+        [str(offline_sale.get('client')) for offline_sale in offline_sales],
+        field_name='username')
+    content_type = ContentType.objects.get_for_model(module)
+    # Sales made by a client of the batch on the module, with their client
+    sales = {idempotency_key: (pk, sender_username)
+             for idempotency_key, pk, sender_username in Sale.objects.filter(
+                 idempotency_key__in=[str(offline_sale.get('idempotency_key'))
+                                      for offline_sale in offline_sales],
+                 sender__in=clients.values(), operator=F('sender'),
+                 content_type=content_type, module_id=module.pk
+             ).values_list('idempotency_key', 'pk', 'sender__username')}
+
+    outcomes = []
+    with transaction.atomic():
+        for offline_sale in batch:
+            outcome = {'idempotency_key': None, 'status': 'rejected',
+                       'sale_id': None, 'reason': None}
+            outcomes.append(outcome)
+            try:
+                idempotency_key, username, datetime, invoices = parse_offline_sale(
+                    catalog, offline_sale)
+            except (ValueError, KeyError, TypeError, AttributeError):
+                outcome['reason'] = 'invalid'
+                if isinstance(offline_sale, dict):
+                    outcome['idempotency_key'] = offline_sale.get('idempotency_key')
+                continue
+            outcome['idempotency_key'] = idempotency_key
+
+            sale_pk, sale_username = sales.get(idempotency_key, (None, None))
+            if sale_username == username:
+                outcome['status'] = 'duplicate'
+                outcome['sale_id'] = sale_pk
+                continue
+            client = clients.get(username)
+            if (client is None or not client.is_active
+                    or not client.has_perm('modules.use_selfsalemodule')):
+                outcome['reason'] = 'client'
+                continue
+            outcome['reason'] = check_sale(
+                module, client, get_invoices_amount(catalog, invoices),
+                balance_threshold_purchase)
+            if outcome['reason'] is not None:
+                continue
+
+            try:
+                sale = create_sale(module, client, client, invoices, idempotency_key, datetime)
+            except PermissionDenied:
+                outcome['reason'] = 'invalid'
+                continue
+            if (sale.content_type_id, sale.module_id) != (content_type.pk, module.pk):
+                # Key used by the client on another module
+                outcome['reason'] = 'invalid'
+                continue
+            sales[idempotency_key] = (sale.pk, username)
+            outcome['status'] = 'accepted'
+            outcome['sale_id'] = sale.pk
+    return outcomes
@@ -1,26 +1,34 @@
+import hashlib
+import json
 from functools import partial, wraps
 
 from django.contrib.auth.decorators import login_required
-from django.contrib.auth.mixins import PermissionRequiredMixin
-from django.core.exceptions import ObjectDoesNotExist
+from django.db import transaction
+from django.db.models import F
 from django.forms.formsets import formset_factory
-from django.http import Http404
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import Http404, HttpResponse, JsonResponse
 from django.shortcuts import redirect, render
 from django.urls import reverse
+from django.utils.cache import get_conditional_response
+from django.utils.decorators import method_decorator
+from django.utils.http import quote_etag
+from django.views.decorators.csrf import csrf_exempt
+from django.views.generic.base import View
 
 from borgia.views import BorgiaFormView, BorgiaView
-from configurations.utils import configuration_get
 from modules.forms import (ModuleCategoryCreateForm,
                            ModuleCategoryCreateNameForm, ShopModuleConfigForm,
                            ShopModuleSaleForm)
-from modules.mixins import ShopModuleCategoryMixin, ShopModuleMixin
+from modules.mixins import (ShopModuleCategoryMixin, ShopModuleMixin,
+                            ShopModuleSaleMixin)
 from modules.models import Category, CategoryProduct, SelfSaleModule
-from sales.models import Sale, SaleProduct
-from shops.models import Product, Shop
-from users.models import User
+from modules.utils import (get_sync_key, invalidate_sale_catalogs_once,
+                           set_category_products, sync_sales, verify_sync_batch)
+from shops.utils import get_shop_products
 
 
-class ShopModuleSaleView(ShopModuleMixin, BorgiaFormView):
+class ShopModuleSaleView(ShopModuleSaleMixin, BorgiaFormView):
     """
     Generic FormView for handling invoice concerning product bases through a
     shop.
@@ -34,33 +42,9 @@ class ShopModuleSaleView(ShopModuleMixin, BorgiaFormView):
     :type self.permission_required_selfsale: string
     :type self.permission_required_operatorsale: string
     """
-    permission_required_self = 'modules.use_selfsalemodule'
-    permission_required_operator = 'modules.use_operatorsalemodule'
     template_name = 'modules/shop_module_sale.html'
     form_class = ShopModuleSaleForm
 
-    def has_permission(self):
-        if self.kwargs['module_class'] == 'self_sales':
-            has_perms = self.has_permission_selfsales()
-        else:
-            has_perms = super().has_permission()
-        if not has_perms:
-            return False
-        else:
-            if self.module.state is False:
-                raise Http404
-            else:
-                return True
-
-    def has_permission_selfsales(self):
-        """
-        Customized permission for self_sale in shops. 
-        The user still need the use_selfsalemodule permission
-        """
-        self.add_context_objects()
-        return PermissionRequiredMixin.has_permission(self)
-
-
     def get_menu_type(self):
         if self.module_class == "self_sales":
             return 'members'
@@ -69,61 +53,31 @@ class ShopModuleSaleView(ShopModuleMixin, BorgiaFormView):
 
     def get_form_kwargs(self):
         kwargs = super().get_form_kwargs()
-        kwargs['module_class'] = self.module_class
-        kwargs['module'] = self.module
-        kwargs['balance_threshold_purchase'] = configuration_get(
-            'BALANCE_THRESHOLD_PURCHASE')
-
-        if self.module_class == "self_sales":
-            kwargs['client'] = self.request.user
-        elif self.module_class == "operator_sales":
-            kwargs['client'] = None
-        else:
-            self.handle_unexpected_module_class()
+        kwargs.update(self.get_sale_form_kwargs())
         return kwargs
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['categories'] = self.module.categories.all().order_by('order')
+        context['categories'] = self.get_catalog().categories
         return context
 
+    def post(self, request, *args, **kwargs):
+        # Submitted again, the sale isn't validated nor paid again
+        sale = self.get_replayed_sale(request.POST.get('idempotency_key'))
+        if sale is not None:
+            return self.sale_resume(sale)
+        return super().post(request, *args, **kwargs)
+
     def form_valid(self, form):
         """
         Create a sale and like all products via SaleProduct objects.
         """
-        if self.module_class == "self_sales":
-            client = self.request.user
-        elif self.module_class == "operator_sales":
-            client = form.cleaned_data['client']
-        else:
-            self.handle_unexpected_module_class()
-
-        sale = Sale.objects.create(
-            operator=self.request.user,
-            sender=client,
-            recipient=User.objects.get(pk=1),
-            module=self.module,
-            shop=self.shop
-        )
-        for field in form.cleaned_data:
-            if field != 'client' and form.cleaned_data[field] != '':
-                invoice = int(form.cleaned_data[field])
-                if invoice > 0:
-                    try:
-                        category_product = CategoryProduct.objects.get(
-                            pk=field.split('-')[0])
-                    except ObjectDoesNotExist:
-                        pass
-                    else:
-                        SaleProduct.objects.create(
-                            sale=sale,
-                            product=category_product.product,
-                            quantity=category_product.quantity * invoice,
-                            price=category_product.get_price() * invoice
-                        )
-        sale.pay()
-
+        return self.sale_resume(self.create_sale(form))
 
+    def sale_resume(self, sale):
+        """
+        Display the resume of the sale.
+        """
         context = self.get_context_data()
 
         if self.module.logout_post_purchase:
@@ -153,6 +107,126 @@ def sale_shop_module_resume(request, context):
     return render(request, template_name, context=context)
 
 
+class ShopModuleSaleApiView(ShopModuleSaleMixin, View):
+    """
+    Create a sale from a JSON cart, for sale terminals.
+
+    The request body is {"client": username, "lines": [{"category_product":
+    pk, "qty": number}, ...], "idempotency_key": key}, the client is only
+    used for operator sales and the key is optional.
+    The same checks as ShopModuleSaleView are done. A cart submitted again
+    with the same key returns the sale already created.
+    Return {"sale_id", "amount", "new_balance"}, or {"errors": [...]} with
+    the status 400.
+    """
+
+    def post(self, request, *args, **kwargs):
+        catalog = self.get_catalog()
+        data = {}
+        try:
+            cart = json.loads(request.body.decode('utf-8'))
+            idempotency_key = cart.get('idempotency_key')
+            if idempotency_key is not None:
+                sale = self.get_replayed_sale(str(idempotency_key))
+                if sale is not None:
+                    return self.sale_response(sale)
+                data['idempotency_key'] = idempotency_key
+            if self.module_class == 'operator_sales':
+                data['client'] = cart.get('client', '')
+            for line in cart['lines']:
+                category_product = catalog.products.get(int(line['category_product']))
+                if category_product is None or not category_product.is_active:
+                    return self.errors_response(['Produit inconnu'])
+                field = str(category_product.pk) + '-' + str(category_product.category_pk)
+                data[field] = data.get(field, 0) + int(line['qty'])
+        except (ValueError, KeyError, TypeError, AttributeError):
+            return self.errors_response(['Commande invalide'])
+
+        form = ShopModuleSaleForm(data=data, **self.get_sale_form_kwargs())
+        if not form.is_valid():
+            return self.errors_response([error['message']
+                                         for errors in form.errors.get_json_data().values()
+                                         for error in errors])
+
+        return self.sale_response(self.create_sale(form))
+
+    @staticmethod
+    def sale_response(sale):
+        return JsonResponse({
+            'sale_id': sale.pk,
+            'amount': sale.amount(),
+            'new_balance': sale.sender.balance
+        })
+
+    @staticmethod
+    def errors_response(errors):
+        return JsonResponse({'errors': errors}, status=400)
+
+
+class ShopModuleCatalogApiView(ShopModuleSaleMixin, View):
+    """
+    Return the catalog of the module in JSON, for sale terminals.
+
+    The response has an ETag, if it matches the If-None-Match header of the
+    request, the status 304 is returned without content.
+    """
+
+    def get(self, request, *args, **kwargs):
+        content = json.dumps({
+            'categories': [{
+                'pk': category.pk,
+                'name': category.name,
+                'products': [{
+                    'category_product': product.pk,
+                    'label': product.label,
+                    'price': product.price,
+                    'is_active': product.is_active
+                } for product in category.products]
+            } for category in self.get_catalog().categories]
+        }, cls=DjangoJSONEncoder)
+        etag = quote_etag(hashlib.md5(content.encode('utf-8')).hexdigest())
+
+        response = HttpResponse(content, content_type='application/json')
+        response['ETag'] = etag
+        return get_conditional_response(request, etag=etag, response=response)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class ShopModuleSyncApiView(View):
+    """
+    Create the sales recorded offline by a self sale terminal, sent in one
+    batch when the network is back.
+
+    The request body is {"sales": [...]}, see modules.utils.sync_sales, and
+    must be signed: the X-Borgia-Signature header is the HMAC-SHA256 of the
+    body with the sync key of the module, displayed on its config page.
+    Return {"sales": [outcome, ...]}, in the order of the batch.
+
+    :raises: Http404 if the self sale module of the shop doesn't exist or
+    isn't enabled.
+    :returns: 403 if the signature isn't valid.
+    """
+
+    def post(self, request, *args, **kwargs):
+        if kwargs['module_class'] != 'self_sales':
+            raise Http404
+        module = SelfSaleModule.objects.select_related('shop').filter(
+            shop=kwargs['shop_pk'], state=True).first()
+        if module is None:
+            raise Http404
+        if not verify_sync_batch(module, request.body,
+                                 request.META.get('HTTP_X_BORGIA_SIGNATURE')):
+            return JsonResponse({'errors': ['Signature invalide']}, status=403)
+
+        try:
+            batch = json.loads(request.body.decode('utf-8'))['sales']
+            if not isinstance(batch, list):
+                raise TypeError
+        except (ValueError, KeyError, TypeError):
+            return JsonResponse({'errors': ['Lot invalide']}, status=400)
+        return JsonResponse({'sales': sync_sales(module, batch)})
+
+
 class ShopModuleConfigView(ShopModuleMixin, BorgiaView):
     """
     ConfigView for a shopModule.
@@ -165,6 +239,9 @@ class ShopModuleConfigView(ShopModuleMixin, BorgiaView):
     def get(self, request, *args, **kwargs):
         context = self.get_context_data(**kwargs)
         context['type'] = "self_sale"
+        if (self.module_class == 'self_sales'
+                and request.user.has_perm('modules.change_config_selfsalemodule')):
+            context['sync_key'] = get_sync_key(self.module)
         return render(request, self.template_name, context=context)
 
 
@@ -238,31 +315,15 @@ class ShopModuleCategoryCreateView(ShopModuleMixin, BorgiaView):
 
     def post(self, request, *args, **kwargs):
         cat_name_form = ModuleCategoryCreateNameForm(request.POST)
-        if cat_name_form.is_valid():
-            category = Category.objects.create(
-                name=cat_name_form.cleaned_data['name'],
-                order=cat_name_form.cleaned_data['order'],
-                module=self.module
-            )
-
         cat_form = self.form_class(request.POST)
-        for product_form in cat_form.cleaned_data:
-            try:
-                product = Product.objects.get(
-                    pk=product_form['product'].split('/')[0])
-                if product.unit:
-                    quantity = int(product_form['quantity'])
-                else:
-                    quantity = 1
-                CategoryProduct.objects.create(
-                    category=category,
-                    product=product,
-                    quantity=quantity
+        if cat_name_form.is_valid() and cat_form.is_valid():
+            with invalidate_sale_catalogs_once(), transaction.atomic():
+                category = Category.objects.create(
+                    name=cat_name_form.cleaned_data['name'],
+                    order=cat_name_form.cleaned_data['order'],
+                    module=self.module
                 )
-            except ObjectDoesNotExist:
-                pass
-            except KeyError:
-                pass
+                set_category_products(category, get_formset_products(cat_form, self.shop))
         return redirect(self.get_success_url())
 
     def get_success_url(self):
@@ -298,7 +359,7 @@ class ShopModuleCategoryUpdateView(ShopModuleCategoryMixin, BorgiaView):
         cat_form_data = [{'product': str(category_product.product.pk) + '/' +
                                      str(category_product.product.get_unit_display()),
                           'quantity': category_product.quantity}
-                         for category_product in self.category.categoryproduct_set.all()]
+                         for category_product in self.category.categoryproduct_set.order_by('order', 'pk')]
         context['cat_form'] = self.form_class(initial=cat_form_data)
         context['cat_name_form'] = ModuleCategoryCreateNameForm(
             initial={'name': self.category.name, 'order': self.category.order})
@@ -306,31 +367,17 @@ class ShopModuleCategoryUpdateView(ShopModuleCategoryMixin, BorgiaView):
 
     def post(self, request, *args, **kwargs):
         cat_name_form = ModuleCategoryCreateNameForm(request.POST)
-        if cat_name_form.is_valid():
-            self.category.name = cat_name_form.cleaned_data['name']
-            if cat_name_form.cleaned_data['order'] != self.category.order:
-               shift_category_orders(self.category,cat_name_form.cleaned_data['order'])
-            self.category.save()
-
         cat_form = self.form_class(request.POST)
-        CategoryProduct.objects.filter(category=self.category).delete()
-        for product_form in cat_form.cleaned_data:
-            try:
-                product = Product.objects.get(
-                    pk=product_form['product'].split('/')[0])
-                if product.unit:
-                    quantity = int(product_form['quantity'])
-                else:
-                    quantity = 1
-                CategoryProduct.objects.create(
-                    category=self.category,
-                    product=product,
-                    quantity=quantity
-                )
-            except ObjectDoesNotExist:
-                pass
-            except KeyError:
-                pass
+        with invalidate_sale_catalogs_once(), transaction.atomic():
+            if cat_name_form.is_valid():
+                self.category.name = cat_name_form.cleaned_data['name']
+                if cat_name_form.cleaned_data['order'] != self.category.order:
+                    shift_category_orders(self.category, cat_name_form.cleaned_data['order'])
+                self.category.save()
+            # An invalid formset leaves the products unchanged
+            if cat_form.is_valid():
+                set_category_products(self.category,
+                                      get_formset_products(cat_form, self.shop))
         return redirect(self.get_success_url())
 
     def get_success_url(self):
@@ -356,8 +403,9 @@ class ShopModuleCategoryDeleteView(ShopModuleCategoryMixin, BorgiaView):
         return render(request, self.template_name, context=context)
 
     def post(self, request, *args, **kwargs):
-        CategoryProduct.objects.filter(category=self.category).delete()
-        self.category.delete()
+        with invalidate_sale_catalogs_once(), transaction.atomic():
+            CategoryProduct.objects.filter(category=self.category).delete()
+            self.category.delete()
         return redirect(self.get_success_url())
 
     def get_success_url(self):
@@ -365,26 +413,51 @@ class ShopModuleCategoryDeleteView(ShopModuleCategoryMixin, BorgiaView):
                        kwargs={'shop_pk': self.shop.pk, 'module_class': self.module_class})
 
 
-def shift_category_orders(category,new_order):
-    module_id = category.module_id
-    content_type_id = category.content_type_id
+def shift_category_orders(category, new_order):
+    """
+    Move the category to new_order, shifting the categories in between of the
+    same module with one UPDATE.
+
+    :note:: The category itself isn't saved.
+    """
+    categories = Category.objects.filter(content_type_id=category.content_type_id,
+                                         module_id=category.module_id)
     order = category.order
     if new_order < order:
-       categories = Category.objects.filter(content_type_id=content_type_id,
-                                            module_id=module_id,
-                                            order__gte=new_order,order__lt=order)
-       if categories:
-          for cat in categories:
-              cat.order += 1
-              cat.save()
+        categories.filter(order__gte=new_order, order__lt=order).update(order=F('order') + 1)
     elif new_order > order:
-       categories = Category.objects.filter(content_type_id=content_type_id,
-                                            module_id=module_id,
-                                            order__lte=new_order,order__gt=order)
-       if categories:
-          for cat in categories:
-              cat.order -= 1
-              cat.save()
+        categories.filter(order__lte=new_order, order__gt=order).update(order=F('order') - 1)
     category.order = int(new_order)
-    category.save()
+
+
+def get_formset_products(formset, shop):
+    """
+    Return the products and quantities of a valid formset of
+    ModuleCategoryCreateForm, without query once the products of the shop
+    are loaded by the forms.
+
+    Products without unit are sold one by one. Incomplete forms and products
+    of other shops are ignored.
+
+    :type formset: formset of ModuleCategoryCreateForm
+    :type shop: Shop object
+    :rtype: list of (Product object, integer) tuples
+    """
+    product_forms = [product_form for product_form in formset.cleaned_data
+                     if product_form.get('product')]
+    products = {product.pk: product for product in get_shop_products(shop)}
+
+    category_products = []
+    for product_form in product_forms:
+        product = products.get(int(product_form['product'].split('/')[0]))
+        if product is None:
+            continue
+        if product.unit:
+            if product_form.get('quantity') is None:
+                continue
+            quantity = product_form['quantity']
+        else:
+            quantity = 1
+        category_products.append((product, quantity))
+    return category_products
 
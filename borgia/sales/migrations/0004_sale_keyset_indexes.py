@@ -0,0 +1,21 @@
+# Generated by Django 2.2.28 on 2026-10-18 19:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales', '0003_sale_idempotency_key'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='sale',
+            index=models.Index(fields=['datetime', 'id'], name='sales_sale_datetim_698be3_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sale',
+            index=models.Index(fields=['shop', 'datetime', 'id'], name='sales_sale_shop_id_c8561c_idx'),
+        ),
+    ]
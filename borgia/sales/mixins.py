@@ -16,7 +16,7 @@ class SaleMixin(ShopMixin):
         Raise Http404 is sale doesn't exist.
         """
         try:
-            self.sale = Sale.objects.get(pk=self.kwargs['sale_pk'])
+            self.sale = Sale.objects.with_products().get(pk=self.kwargs['sale_pk'])
         except ObjectDoesNotExist:
             raise Http404
 
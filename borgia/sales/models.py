@@ -4,13 +4,53 @@ from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
 from django.core.exceptions import ObjectDoesNotExist
 from django.core.validators import MinValueValidator
-from django.db import models
+from django.db import models, transaction
+from django.db.models import OuterRef, Prefetch, Subquery, Sum
+from django.db.models.functions import Coalesce
 from django.utils.timezone import now
 
+from finances.models import LedgerEntry
 from shops.models import Product, Shop
 from users.models import User
 
 
+class SaleQuerySet(models.QuerySet):
+    """
+    QuerySet of sales, with helpers to load the amounts, products and
+    modules of several sales at once.
+    """
+
+    def with_amount(self):
+        """
+        Annotate each sale with its amount as total_amount, which is then
+        used by Sale.amount().
+
+        :note:: The sum is computed in a subquery, so that it isn't altered by
+        filters on products.
+        """
+        amounts = SaleProduct.objects.filter(sale=OuterRef('pk')).order_by().values(
+            'sale').annotate(total=Sum('price')).values('total')
+        return self.annotate(total_amount=Coalesce(
+            Subquery(amounts, output_field=models.DecimalField(max_digits=9, decimal_places=2)),
+            decimal.Decimal(0)))
+
+    def with_products(self):
+        """
+        Prefetch sale products with their product, used by Sale.amount() and
+        Sale.string_products().
+        """
+        return self.prefetch_related(Prefetch(
+            'saleproduct_set', queryset=SaleProduct.objects.select_related('product')))
+
+    def with_module(self):
+        """
+        Prefetch the module of each sale with its shop, used by
+        Sale.from_shop(), with one query per type of module and one for
+        shops.
+        """
+        return self.prefetch_related('module__shop')
+
+
 class Sale(models.Model):
     """
     Define a Sale between two users.
@@ -30,6 +70,8 @@ class Sale(models.Model):
     :param module:
     :param shop:
     :param products:
+    :param idempotency_key: key given by the terminal creating the sale, a
+    sale submitted again with the same key isn't created twice.
 
 
     :type datetime: date string, default now
@@ -43,6 +85,7 @@ class Sale(models.Model):
     :type module:
     :type shop: Shop object
     :type products: Product object
+    :type idempotency_key: string
 
     :note:: Initial Django Permission (add, change, delete, view) are added.
     """
@@ -58,6 +101,19 @@ class Sale(models.Model):
     module = GenericForeignKey('content_type', 'module_id')
     shop = models.ForeignKey(Shop, on_delete=models.CASCADE)
     products = models.ManyToManyField(Product, through='SaleProduct')
+    idempotency_key = models.CharField("Clé d'idempotence", max_length=64, unique=True,
+                                       null=True, blank=True, editable=False)
+
+    objects = SaleQuerySet.as_manager()
+
+    class Meta:
+        """
+        Index the keys of the paginated sale lists.
+        """
+        indexes = [
+            models.Index(fields=['datetime', 'id']),
+            models.Index(fields=['shop', 'datetime', 'id'])
+        ]
 
     def __str__(self):
         """
@@ -68,8 +124,31 @@ class Sale(models.Model):
         """
         return 'Achat ' + self.shop.__str__() + ', ' + self.string_products()
 
-    def pay(self):
-        self.sender.debit(self.amount())
+    def pay(self, amount=None):
+        """
+        Debit the sender of the amount of the sale.
+
+        :param amount: amount of the sale if already known, computed else.
+        :type amount: Decimal
+        """
+        with transaction.atomic():
+            if amount is None:
+                amount = self.amount()
+            self.sender.debit(amount)
+            self.ledger_entry(amount).save()
+
+    def ledger_entry(self, amount):
+        """
+        Return the (unsaved) ledger entry of the sale, for the given amount.
+        """
+        return LedgerEntry(
+            user=self.sender,
+            datetime=self.datetime,
+            kind='sale',
+            amount=-amount,
+            label=self.shop.__str__() + ', ' + self.string_products(),
+            source=self
+        )
 
     def string_products(self):
         """
@@ -95,10 +174,20 @@ class Sale(models.Model):
             return None
 
     def amount(self):
-        amount = 0
-        for sale_product in self.saleproduct_set.all():
-            amount += sale_product.price
-        return amount
+        """
+        Return the amount of the sale.
+
+        Use the total_amount annotation (SaleQuerySet.with_amount) or the
+        prefetched sale products (SaleQuerySet.with_products) when present,
+        otherwise sum the prices in database.
+        """
+        if hasattr(self, 'total_amount'):
+            return self.total_amount
+        if 'saleproduct_set' in getattr(self, '_prefetched_objects_cache', {}):
+            return sum((sale_product.price for sale_product in self.saleproduct_set.all()),
+                       decimal.Decimal(0))
+        return self.saleproduct_set.aggregate(
+            total=Coalesce(Sum('price'), decimal.Decimal(0)))['total']
 
 
 class SaleProduct(models.Model):
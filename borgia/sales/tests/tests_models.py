@@ -0,0 +1,46 @@
+import decimal
+
+from sales.models import Sale
+from sales.tests.tests_views import BaseSalesViewsTest
+
+
+class SaleAmountTestCase(BaseSalesViewsTest):
+    amount = decimal.Decimal('5.79')
+
+    def test_amount(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(self.sale1.amount(), self.amount)
+
+    def test_amount_annotated(self):
+        sale = Sale.objects.with_amount().get(pk=self.sale1.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(sale.amount(), self.amount)
+
+    def test_amount_prefetched(self):
+        sale = Sale.objects.with_products().get(pk=self.sale1.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(sale.amount(), self.amount)
+            self.assertEqual(sale.string_products(), 'skoll x 2, beer x 3cl')
+
+    def test_amount_empty_sale(self):
+        sale = Sale.objects.create(
+            sender=self.user1, recipient=self.user3, operator=self.user3,
+            shop=self.shop1, module=self.operatorsalemodule1)
+        self.assertEqual(sale.amount(), 0)
+        self.assertEqual(Sale.objects.with_amount().get(pk=sale.pk).amount(), 0)
+
+    def test_amount_annotated_filtered_on_products(self):
+        sale = Sale.objects.filter(products=self.product1).with_amount().get()
+        self.assertEqual(sale.amount(), self.amount)
+
+    def test_from_shop_prefetched(self):
+        Sale.objects.create(
+            sender=self.user1, recipient=self.user3, operator=self.user1,
+            shop=self.shop1, module=self.selfsalemodule1)
+        # Content types, self and operator modules, shops
+        with self.assertNumQueries(4):
+            sales = list(Sale.objects.with_module().filter(
+                pk__gte=self.sale1.pk).order_by('pk'))
+        with self.assertNumQueries(0):
+            self.assertListEqual([sale.from_shop() for sale in sales],
+                                 [self.shop1, self.shop1])
@@ -1,6 +1,8 @@
 import decimal
 
+from django.db import connection
 from django.test import Client
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
 from borgia.tests.utils import get_login_url_redirected
@@ -34,6 +36,26 @@ class BaseSalesViewsTest(BaseShopModuleViewsTest):
             price=decimal.Decimal(4.56)
         )
 
+    def create_sales(self, number):
+        for _ in range(number):
+            sale = Sale.objects.create(
+                sender=self.user1,
+                recipient=self.user3,
+                operator=self.user3,
+                shop=self.shop1,
+                module=self.operatorsalemodule1
+            )
+            SaleProduct.objects.create(
+                sale=sale, product=self.product1, quantity=1, price=decimal.Decimal(1))
+            SaleProduct.objects.create(
+                sale=sale, product=self.product2, quantity=1, price=decimal.Decimal(2))
+
+    def count_queries(self, client, url):
+        with CaptureQueriesContext(connection) as context:
+            response = client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries)
+
 
 class SaleListViewTests(BaseSalesViewsTest):
     url_view = 'url_sale_list'
@@ -98,3 +120,30 @@ class SaleRetrieveViewTests(BaseSalesViewsTest):
         self.assertEqual(response_offline_user.status_code, 302)
         self.assertRedirects(response_offline_user, get_login_url_redirected(
             self.get_url(self.shop1.pk, self.sale1.pk)))
+
+
+class SaleQueriesTests(BaseSalesViewsTest):
+    """
+    Pages listing sales must run the same number of queries whatever the
+    number of sales.
+    """
+    def assertQueriesIndependentOfSales(self, client, url):
+        self.count_queries(client, url)
+        nb_queries = self.count_queries(client, url)
+        self.create_sales(10)
+        self.assertEqual(self.count_queries(client, url), nb_queries)
+
+    def test_sale_list(self):
+        self.assertQueriesIndependentOfSales(
+            self.client1, reverse('url_sale_list', kwargs={'shop_pk': self.shop1.pk}))
+
+    def test_shop_workboard(self):
+        self.assertQueriesIndependentOfSales(
+            self.client1, reverse('url_shop_workboard', kwargs={'shop_pk': self.shop1.pk}))
+
+    def test_shop_checkup(self):
+        self.assertQueriesIndependentOfSales(
+            self.client1, reverse('url_shop_checkup', kwargs={'shop_pk': self.shop1.pk}))
+
+    def test_members_workboard(self):
+        self.assertQueriesIndependentOfSales(self.client1, reverse('url_members_workboard'))
@@ -1,7 +1,8 @@
-from django.core.paginator import EmptyPage, PageNotAnInteger, Paginator
 from django.db.models import Q
 from django.shortcuts import render
 
+from borgia.mixins import KeysetPaginationMixin
+from borgia.utils import filter_period
 from borgia.views import BorgiaFormView, BorgiaView
 from sales.forms import SaleListSearchDateForm
 from sales.mixins import SaleMixin
@@ -9,7 +10,7 @@ from sales.models import Sale
 from shops.mixins import ShopMixin
 
 
-class SaleList(ShopMixin, BorgiaFormView):
+class SaleList(ShopMixin, KeysetPaginationMixin, BorgiaFormView):
     """
     View to list sales.
 
@@ -33,36 +34,15 @@ class SaleList(ShopMixin, BorgiaFormView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        sales_tab_header = []
-        seen = set(sales_tab_header)
-        page = self.request.POST.get('page', 1)
 
+        sale_list = Sale.objects.with_amount().with_products().select_related(
+            'operator', 'sender')
         try:
-            context['sale_list'] = Sale.objects.filter(
-                shop=self.shop).order_by('-datetime')
+            sale_list = sale_list.filter(shop=self.shop)
         except AttributeError:
-            context['sale_list'] = Sale.objects.all().order_by('-datetime')
-
-        # The sale_list is paginated by passing the filtered QuerySet to Paginator
-        paginator = Paginator(self.form_query(context['sale_list']), 50)
-        try:
-            # The requested page is grabbed
-            sales = paginator.page(page)
-        except PageNotAnInteger:
-            # If the requested page is not an integer
-            sales = paginator.page(1)
-        except EmptyPage:
-            # If the requested page is out of range, the last page is grabbed
-            sales = paginator.page(paginator.num_pages)
-
-        context['sale_list'] = sales
-
-        for sale in context['sale_list']:
-            if sale.from_shop() not in seen:
-                seen.add(sale.from_shop())
-                sales_tab_header.append(sale.from_shop())
+            pass
 
-        context['sales_tab_header'] = sales_tab_header
+        context['sale_list'] = self.paginate_queryset(self.form_query(sale_list))
 
         return context
 
@@ -83,13 +63,7 @@ class SaleList(ShopMixin, BorgiaFormView):
                 | Q(sender__username__icontains=self.search)
             )
 
-        if self.date_begin:
-            query = query.filter(
-                datetime__gte=self.date_begin)
-
-        if self.date_end:
-            query = query.filter(
-                datetime__lte=self.date_end)
+        query = filter_period(query, self.date_begin, self.date_end)
 
         if self.query_shop:
             query = query.filter(shop=self.query_shop)
@@ -0,0 +1,53 @@
+# Generated by Django 2.2.28 on 2026-10-18 18:52
+
+import decimal
+
+from django.db import migrations, models
+
+
+def compute_automatic_prices(apps, schema_editor):
+    """
+    Store the automatic price of existing products, computed like
+    Product.compute_automatic_price.
+    """
+    Configuration = apps.get_model('configurations', 'Configuration')
+    Product = apps.get_model('shops', 'Product')
+    StockEntryProduct = apps.get_model('stocks', 'StockEntryProduct')
+
+    try:
+        margin_profit = decimal.Decimal(
+            Configuration.objects.get(name='MARGIN_PROFIT').value)
+    except Configuration.DoesNotExist:
+        return
+
+    for product in Product.objects.all():
+        last_stockentry = StockEntryProduct.objects.filter(product=product).order_by(
+            '-stockentry__datetime').first()
+        if last_stockentry is None or last_stockentry.quantity == 0:
+            continue
+        unit_price = last_stockentry.price / last_stockentry.quantity
+        if product.unit == 'G':
+            unit_price *= 1000
+        elif product.unit == 'CL':
+            unit_price *= 100
+        product.automatic_price = round(
+            unit_price * product.correcting_factor * (1 + margin_profit / 100), 4)
+        product.save(update_fields=['automatic_price'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('configurations', '0001_initial'),
+        ('shops', '0001_initial'),
+        ('stocks', '0002_auto_20190103_1237'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='automatic_price',
+            field=models.DecimalField(decimal_places=4, default=0, editable=False, max_digits=9, verbose_name='Prix automatique'),
+        ),
+        migrations.RunPython(compute_automatic_prices, migrations.RunPython.noop),
+    ]
@@ -5,7 +5,7 @@ from django.views.generic.base import ContextMixin
 
 from borgia.utils import is_association_manager
 from shops.models import Product, Shop
-from shops.utils import is_shop_manager
+from shops.utils import get_shops_managed
 
 
 class ShopMixin(LoginRequiredMixin, PermissionRequiredMixin, ContextMixin):
@@ -53,7 +53,7 @@ class ShopMixin(LoginRequiredMixin, PermissionRequiredMixin, ContextMixin):
                 return True
             else:
                 self.is_association_manager = False
-                return is_shop_manager(self.shop, self.request.user)
+                return self.shop in get_shops_managed(self.request.user)
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -75,7 +75,7 @@ class ProductMixin(ShopMixin):
 
     def add_product_object(self):
         try:
-            self.product = Product.objects.get(pk=self.kwargs['product_pk'])
+            self.product = Product.objects.select_related('stock').get(pk=self.kwargs['product_pk'])
         except ObjectDoesNotExist:
             raise Http404
 
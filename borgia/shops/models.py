@@ -74,6 +74,8 @@ class Product(models.Model):
     :param is_removed: is the product removed.
     :param unit: unit of the product.
     :param correcting_factor: for automatic price.
+    :param automatic_price: price computed over the last stock entry, see
+    update_automatic_price.
     :type name: string
     :type is_manual: bool
     :type manual_price: decimal
@@ -82,6 +84,7 @@ class Product(models.Model):
     :type is_removed: bool
     :type unit: string
     :type correcting_factor: decimal
+    :type automatic_price: decimal
     """
     UNIT_CHOICES = (('CL', 'cl'), ('G', 'g'))
 
@@ -102,6 +105,9 @@ class Product(models.Model):
                                                 MinValueValidator(decimal.Decimal(0))])
     is_active = models.BooleanField('Actif', default=True)
     is_removed = models.BooleanField('Retiré', default=False)
+    automatic_price = models.DecimalField('Prix automatique', default=0,
+                                          decimal_places=4, max_digits=9,
+                                          editable=False)
 
     class Meta:
         """
@@ -149,12 +155,23 @@ class Product(models.Model):
                 return str(round(value, 0)) + ' produit'
 
     def get_automatic_price(self):
+        """
+        Return the automatic price stored for the product.
+        """
+        return self.automatic_price
+
+    def compute_automatic_price(self, margin_profit=None):
         """
         Return the price calculated over the last stockentry concerning the product.
         If there is no stock entry realisated, return 0.
+
+        :param margin_profit: value of the MARGIN_PROFIT configuration, read
+        if not given.
+        :type margin_profit: float
         """
         try:
-            margin_profit = configuration_get('MARGIN_PROFIT').get_value()
+            if margin_profit is None:
+                margin_profit = configuration_get('MARGIN_PROFIT').get_value()
 
             last_stockentry = self.stockentryproduct_set.order_by(
                 '-stockentry__datetime').first()
@@ -165,6 +182,16 @@ class Product(models.Model):
         except IndexError:
             return decimal.Decimal(0)
 
+    def update_automatic_price(self, margin_profit=None):
+        """
+        Compute and store the automatic price.
+
+        Called when a stock entry of the product is saved, when the
+        correcting_factor changes and when MARGIN_PROFIT changes.
+        """
+        self.automatic_price = self.compute_automatic_price(margin_profit)
+        self.save(update_fields=['automatic_price'])
+
     def deviating_price_from_auto(self):
         automatic_price = self.get_automatic_price()
         if automatic_price == 0:
@@ -233,7 +260,16 @@ class Product(models.Model):
         Calculate the theorical stock since the last inventory.
         Used in order to modify the correcting_factor comparing this value with
         the value given by the next inventory.
+
+        :note:: The current stock (offset 0) is read from the stock counters
+        of the product when they exist, see stocks.models.ProductStock.
         """
+        if offset == 0:
+            try:
+                return self.stock.current_stock_estimated()
+            except ObjectDoesNotExist:
+                pass
+
         stock_base = self.last_inventoryproduct_value(offset)
         stock_input = sum(
             se.quantity for se in self.stockentries_since_last_inventory(offset))
@@ -288,6 +324,7 @@ class Product(models.Model):
             self.correcting_factor = decimal.Decimal(
                 (stock_base + stock_input - next_stock) / stock_output
             )
+            self.automatic_price = self.compute_automatic_price()
             self.save()
         except (ZeroDivisionError, decimal.DivisionByZero, decimal.DivisionUndefined, decimal.InvalidOperation):
             pass
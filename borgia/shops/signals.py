@@ -1,9 +1,10 @@
 from django.contrib.auth.models import Group, Permission
 from django.contrib.contenttypes.models import ContentType
 from django.core.exceptions import ObjectDoesNotExist
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 
+from borgia.utils import invalidate_lateral_menus
 from shops.models import Shop
 from shops.utils import (DEFAULT_PERMISSIONS_ASSOCIATES,
                          DEFAULT_PERMISSIONS_CHIEFS)
@@ -56,3 +57,12 @@ def create_shop_groups(instance, created, **kwargs):
         else:
             vice_presidents.permissions.add(manage_chiefs)
             vice_presidents.save()
+
+
+@receiver(post_save, sender=Shop)
+@receiver(post_delete, sender=Shop)
+def invalidate_lateral_menus_on_shop_save(**kwargs):
+    """
+    Lateral menus list shops.
+    """
+    invalidate_lateral_menus()
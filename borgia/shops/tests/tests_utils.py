@@ -0,0 +1,140 @@
+import datetime
+import decimal
+from functools import partial, wraps
+
+from django.contrib.auth.models import Group
+from django.forms.formsets import formset_factory
+from django.utils import timezone
+
+from modules.forms import ModuleCategoryCreateForm
+from modules.tests.tests_views import BaseShopModuleViewsTest
+from sales.models import Sale, SaleProduct
+from shops.models import Product, Shop
+from shops.tests.tests_views import BaseShopsViewsTest
+from shops.utils import (get_product_choices, get_shops_managed, is_shop_manager,
+                         sales_aggregate, sales_series)
+from stocks.forms import InventoryProductForm, StockEntryProductForm
+from users.models import User
+
+
+class SalesAggregationTestCase(BaseShopModuleViewsTest):
+    def setUp(self):
+        super().setUp()
+        # Monday 2 March 2020, noon
+        self.monday = timezone.make_aware(datetime.datetime(2020, 3, 2, 12))
+
+    def create_sales(self, number, datetime_sale, products=None):
+        """
+        Create sales in bulk, each one with one sale product of 1€ per
+        product given.
+        """
+        if products is None:
+            products = [self.product1]
+        Sale.objects.bulk_create([Sale(
+            datetime=datetime_sale, sender=self.user1, recipient=self.user1,
+            operator=self.user3, shop=self.shop1, module=self.operatorsalemodule1
+        ) for _ in range(number)])
+        sales = Sale.objects.filter(datetime=datetime_sale)
+        SaleProduct.objects.bulk_create([SaleProduct(
+            sale=sale, product=product, quantity=1, price=decimal.Decimal(1)
+        ) for sale in sales for product in products])
+
+    def test_sales_aggregate(self):
+        self.create_sales(3, self.monday, products=[self.product1, self.product2])
+        self.create_sales(1, self.monday + datetime.timedelta(days=1))
+        sales = Sale.objects.filter(shop=self.shop1)
+        self.assertDictEqual(sales_aggregate(sales), {
+            'value': decimal.Decimal(7), 'nb': 4, 'mean': decimal.Decimal('1.75')})
+        # A filter on several products doesn't duplicate sales
+        self.assertEqual(sales_aggregate(sales.filter(
+            products__pk__in=[self.product1.pk, self.product2.pk]))['nb'], 4)
+
+    def test_sales_aggregate_empty(self):
+        self.assertDictEqual(sales_aggregate(Sale.objects.filter(shop=self.shop1)), {
+            'value': 0, 'nb': 0, 'mean': 0})
+
+    def test_sales_series(self):
+        self.create_sales(2, self.monday)
+        self.create_sales(3, self.monday + datetime.timedelta(days=6))
+        self.create_sales(4, self.monday + datetime.timedelta(days=7))
+        sales = Sale.objects.filter(shop=self.shop1)
+
+        weeks = sales_series(sales, 'week')
+        self.assertListEqual(
+            [(week.date(), value) for week, value in sorted(weeks.items())],
+            [(datetime.date(2020, 3, 2), 5), (datetime.date(2020, 3, 9), 4)])
+
+        months = sales_series(sales, 'month')
+        self.assertListEqual(
+            [(month.date(), value) for month, value in months.items()],
+            [(datetime.date(2020, 3, 1), 9)])
+
+    def test_queries_independent_of_sales_number(self):
+        """
+        Benchmark: the aggregation runs in the database, with the same
+        queries for 10 or 2000 sales.
+        """
+        sales = Sale.objects.filter(shop=self.shop1)
+        for number in (10, 2000):
+            self.create_sales(number, self.monday + datetime.timedelta(days=number))
+            with self.assertNumQueries(1):
+                sales_aggregate(sales)
+            with self.assertNumQueries(1):
+                sales_series(sales, 'week')
+            with self.assertNumQueries(1):
+                sales_series(sales, 'month')
+        self.assertEqual(sales_aggregate(sales)['value'], 2010)
+
+
+class ShopsManagedTestCase(BaseShopsViewsTest):
+    def setUp(self):
+        super().setUp()
+        self.shop = Shop.objects.create(name='shop', description='Prefix of shop1.',
+                                        color='#F4FA58')
+        self.user2.groups.add(Group.objects.get(name='associates-shop2'))
+
+    def test_get_shops_managed(self):
+        self.assertListEqual(get_shops_managed(User.objects.get(pk=self.user3.pk)),
+                             [self.shop1, self.shop2])
+        self.assertListEqual(get_shops_managed(User.objects.get(pk=self.user2.pk)),
+                             [self.shop2])
+        self.assertListEqual(get_shops_managed(User.objects.get(pk=self.user1.pk)), [])
+
+    def test_memoized(self):
+        user3 = User.objects.get(pk=self.user3.pk)
+        with self.assertNumQueries(1):
+            get_shops_managed(user3)
+            self.assertTrue(is_shop_manager(self.shop1, user3))
+            self.assertFalse(is_shop_manager(self.shop, user3))
+
+
+class ProductChoicesTestCase(BaseShopsViewsTest):
+    def setUp(self):
+        super().setUp()
+        self.product1.is_active = False
+        self.product1.save()
+        Product.objects.create(name='removed', shop=self.shop1, is_removed=True)
+        Product.objects.create(name='other', shop=self.shop2)
+
+    def test_get_product_choices(self):
+        self.assertListEqual(get_product_choices(Shop.objects.get(pk=self.shop1.pk)), [
+            (None, 'Sélectionner un produit'),
+            (str(self.product1.pk) + '/unit', 'skoll'),
+            (str(self.product2.pk) + '/cl', 'beer'),
+            (str(self.product3.pk) + '/g', 'meat')])
+        self.assertListEqual(
+            [label for _, label in get_product_choices(self.shop1, mark_inactive=True)],
+            ['Sélectionner un produit', 'beer', 'meat', 'skoll DESACTIVE'])
+
+    def test_constant_queries(self):
+        formsets = [
+            formset_factory(StockEntryProductForm, extra=40),
+            formset_factory(InventoryProductForm, extra=40),
+            formset_factory(wraps(ModuleCategoryCreateForm)(
+                partial(ModuleCategoryCreateForm, shop=self.shop1)), extra=40)
+        ]
+        shop1 = Shop.objects.get(pk=self.shop1.pk)
+        with self.assertNumQueries(1):
+            for formset in formsets:
+                for form in formset(form_kwargs={'shop': shop1}).forms:
+                    self.assertEqual(len(form.fields['product'].choices), 4)
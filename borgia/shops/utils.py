@@ -1,9 +1,18 @@
+import decimal
+
 from django.contrib.auth.models import Group
+from django.db.models import (CharField, Count, Exists, OuterRef, Q, Sum,
+                              Value)
+from django.db.models.functions import (Coalesce, Concat, TruncMonth,
+                                        TruncWeek)
 from django.urls import reverse
 
 from borgia.utils import (get_permission_name_group_managing,
                           group_name_display, simple_lateral_link)
-from shops.models import Shop
+from configurations.utils import configuration_get
+from modules.utils import invalidate_sale_catalogs
+from sales.models import Sale, SaleProduct
+from shops.models import Product, Shop
 
 DEFAULT_PERMISSIONS_CHIEFS = ['add_user', 'view_user',
                               'change_shop', 'view_shop',
@@ -23,26 +32,127 @@ DEFAULT_PERMISSIONS_ASSOCIATES = ['add_user', 'view_user',
                                   'add_inventory', 'view_inventory']
 
 
+def get_shop_products(shop):
+    """
+    Return the list of products of the shop which are not removed, ordered by
+    pk.
+
+    Products are loaded with one query and memoized on the shop object, all
+    the forms of a formset given the same shop share them.
+    """
+    try:
+        return shop.products_cache
+    except AttributeError:
+        pass
+
+    shop.products_cache = list(Product.objects.filter(shop=shop, is_removed=False).order_by('pk'))
+    return shop.products_cache
+
+
+def get_product_choices(shop, mark_inactive=False):
+    """
+    Return the choices of a product select, values being 'pk/unit'.
+
+    :param mark_inactive: list active products first, then inactive products
+    labelled as such.
+    :type shop: Shop object
+    :type mark_inactive: boolean
+    :note:: See get_shop_products, no query is run once the products of the
+    shop object are loaded.
+    """
+    products = get_shop_products(shop)
+    if mark_inactive:
+        labelled_products = (
+            [(product, product.__str__()) for product in products if product.is_active]
+            + [(product, product.__str__() + ' DESACTIVE') for product in products
+               if not product.is_active])
+    else:
+        labelled_products = [(product, product.__str__()) for product in products]
+    return [(None, 'Sélectionner un produit')] + [
+        (str(product.pk) + '/' + str(product.get_unit_display()), label)
+        for product, label in labelled_products]
+
+
 def is_shop_manager(shop, user):
     """
     Return True if the user is a chief or associate.
     """
-    if user in shop.get_managers():
-        return True
-    else:
-        return False
+    return shop in get_shops_managed(user)
 
 
 def get_shops_managed(user):
     """
     Return the list of shop managed by the user.
+
+    Shops are resolved with one query from the names of the user groups
+    (chiefs-<shop> and associates-<shop>), and memoized on the user object.
     """
-    shop_list = []
-    for shop in Shop.objects.all():
-        if is_shop_manager(shop, user):
-            shop_list.append(shop)
+    try:
+        return user.shops_managed_cache
+    except AttributeError:
+        pass
+
+    managers_groups = user.groups.filter(
+        Q(name=Concat(Value('chiefs-'), OuterRef('name'), output_field=CharField()))
+        | Q(name=Concat(Value('associates-'), OuterRef('name'), output_field=CharField())))
+    user.shops_managed_cache = list(Shop.objects.annotate(
+        is_managed=Exists(managers_groups)).filter(is_managed=True).order_by('pk'))
+    return user.shops_managed_cache
 
-    return shop_list
+
+def update_automatic_prices(products):
+    """
+    Compute and store the automatic price of products, for instance when
+    MARGIN_PROFIT changes.
+
+    :param products: products to update.
+    :type products: Product QuerySet
+    """
+    margin_profit = configuration_get('MARGIN_PROFIT').get_value()
+    products = list(products)
+    for product in products:
+        product.automatic_price = product.compute_automatic_price(margin_profit)
+    Product.objects.bulk_update(products, ['automatic_price'], batch_size=500)
+    # bulk_update doesn't send post_save signals
+    invalidate_sale_catalogs()
+
+
+def sales_aggregate(sales):
+    """
+    Return the total value, the number and the mean value of sales, computed
+    in one query.
+
+    :param sales: sales to aggregate, can be filtered on products.
+    :type sales: Sale QuerySet
+    :returns: {'value': Decimal, 'nb': int, 'mean': Decimal}
+    """
+    result = Sale.objects.filter(pk__in=sales.values('pk')).aggregate(
+        value=Coalesce(Sum('saleproduct__price'), decimal.Decimal(0)),
+        nb=Count('pk', distinct=True))
+    if result['nb']:
+        result['mean'] = round(result['value'] / result['nb'], 2)
+    else:
+        result['mean'] = 0
+    return result
+
+
+def sales_series(sales, period):
+    """
+    Return the value of sales per week or per month, computed in one grouped
+    query.
+
+    :param sales: sales to aggregate, can be filtered on products.
+    :param period: 'week' or 'month'.
+    :type sales: Sale QuerySet
+    :type period: string
+    :returns: dict of values indexed by the first day of each period with at
+    least one sale, as aware datetimes in the current timezone.
+    """
+    trunc = {'week': TruncWeek, 'month': TruncMonth}[period]
+    values = SaleProduct.objects.filter(sale__in=sales.values('pk')).annotate(
+        period=trunc('sale__datetime')).order_by().values('period').annotate(
+            value=Sum('price')).values_list('period', 'value')
+    return dict(values)
 
 
 def get_shops_tree(user, is_association_manager):
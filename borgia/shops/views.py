@@ -1,11 +1,11 @@
 import datetime
-import decimal
 
 from django.contrib.auth.mixins import (LoginRequiredMixin,
                                         PermissionRequiredMixin)
 from django.db.models import Q
 from django.shortcuts import redirect, render
 from django.urls import reverse
+from django.utils import timezone
 
 from borgia.views import BorgiaFormView, BorgiaView
 from configurations.utils import configuration_get
@@ -16,6 +16,7 @@ from shops.forms import (ProductCreateForm, ProductListForm, ProductUpdateForm,
                          ShopCreateForm, ShopUpdateForm)
 from shops.mixins import ProductMixin, ShopMixin
 from shops.models import Product, Shop
+from shops.utils import sales_aggregate, sales_series
 
 
 class ShopCreate(LoginRequiredMixin, PermissionRequiredMixin, BorgiaFormView):
@@ -100,7 +101,7 @@ class ShopCheckup(ShopMixin, BorgiaFormView):
     date_begin = None
     date_end = None
     products = None
-    sales_value = None
+    sales_info = None
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -139,15 +140,16 @@ class ShopCheckup(ShopMixin, BorgiaFormView):
             q_sales = q_sales.filter(
                 products__pk__in=[p.pk for p in self.products])
 
-        if self.sales_value is None:
-            self.sales_value = sum(s.amount() for s in q_sales)
+        if self.sales_info is None:
+            self.sales_info = sales_aggregate(q_sales)
 
         if self.date_begin == datetime.date.today().replace(day=1) and self.date_end == datetime.date.today():
             current_month = True
 
         return {
-            'value': self.sales_value,
-            'nb': q_sales.count(),
+            'value': self.sales_info['value'],
+            'nb': self.sales_info['nb'],
+            'mean': self.sales_info['mean'],
             'is_current_month': current_month
         }
 
@@ -157,16 +159,10 @@ class ShopCheckup(ShopMixin, BorgiaFormView):
     def info_transaction(self):
         q_sales = Sale.objects.filter(shop=self.shop)
         info_sales = self.info_sales(q_sales)
-        value = info_sales.get('value')
-        nb = info_sales.get('nb')
-        try:
-            mean = round(value / nb, 2)
-        except (ZeroDivisionError, decimal.DivisionByZero, decimal.DivisionUndefined):
-            mean = 0
         return {
-            'value': value,
-            'nb': nb,
-            'mean': mean
+            'value': info_sales.get('value'),
+            'nb': info_sales.get('nb'),
+            'mean': info_sales.get('mean')
         }
 
     def info_checkup(self):
@@ -209,12 +205,14 @@ class ShopWorkboard(ShopMixin, BorgiaView):
     def get_sales(self):
         sales = {}
         s_list = Sale.objects.filter(shop=self.shop).order_by('-datetime')
-        sales['weeks'] = self.weeklist(
-            datetime.datetime.now() - datetime.timedelta(days=30),
-            datetime.datetime.now())
-        sales['data_weeks'] = self.sale_data_weeks(s_list, sales['weeks'])[0]
-        sales['total'] = self.sale_data_weeks(s_list, sales['weeks'])[1]
-        sales['all'] = s_list[:7]
+        start = timezone.localtime() - datetime.timedelta(days=30)
+        sales['weeks'] = self.weeklist(start, timezone.localtime())
+        # Sales of the whole first week are included
+        week_start = (start - datetime.timedelta(days=start.weekday())).replace(
+            hour=0, minute=0, second=0, microsecond=0)
+        sales['data_weeks'], sales['total'] = self.sale_data_weeks(
+            s_list.filter(datetime__gte=week_start), sales['weeks'])
+        sales['all'] = s_list.with_amount().with_products().select_related('sender')[:7]
         return sales
 
     # TODO: purchases with stock
@@ -232,15 +230,15 @@ class ShopWorkboard(ShopMixin, BorgiaView):
         return amounts, total
 
     @staticmethod
-    def sale_data_weeks(weeklist, weeks):
+    def sale_data_weeks(sales, weeks):
         amounts = [0 for _ in range(0, len(weeks))]
         total = 0
-        for obj in weeklist:
-            string = (str(obj.datetime.isocalendar()[1])
-                      + '-' + str(obj.datetime.year))
+        for week_start, amount in sales_series(sales, 'week').items():
+            iso_year, iso_week = week_start.isocalendar()[:2]
+            string = str(iso_week) + '-' + str(iso_year)
             if string in weeks:
-                amounts[weeks.index(string)] += obj.amount()
-                total += obj.amount()
+                amounts[weeks.index(string)] += amount
+                total += amount
         return amounts, total
 
     @staticmethod
@@ -275,7 +273,7 @@ class ProductList(ShopMixin, BorgiaFormView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        query = self.shop.product_set.filter(is_removed=False)
+        query = self.shop.product_set.filter(is_removed=False).select_related('stock')
         if self.search:
             query = query.filter(name__icontains=self.search)
         context['product_list'] = query
@@ -17,7 +17,16 @@ jQuery(function($) {
           keywords: request.term
         },
         success: function(data) {
-          response(data)
+          response($.map(data, function(user) {
+            var label = user.username
+            if (user.name && user.name != user.username) {
+              label += ' - ' + user.name
+            }
+            if (user.balance !== undefined) {
+              label += ' (' + user.balance + '€)'
+            }
+            return { label: label, value: user.username }
+          }))
         }
       })
     }
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class StocksConfig(AppConfig):
     name = 'stocks'
+
+    def ready(self):
+        # Import stocks signals
+        from stocks.signals import create_product_stock
@@ -1,18 +1,15 @@
 from django import forms
 from django.forms.formsets import BaseFormSet
 
-from shops.models import Product, Shop
+from shops.models import Shop
+from shops.utils import get_product_choices
 
 
 class StockEntryProductForm(forms.Form):
     def __init__(self, *args, **kwargs):
         shop = kwargs.pop('shop')
         super().__init__(*args, **kwargs)
-        product_choice = ([(None, 'Sélectionner un produit')] +
-                          [(str(product.pk)+'/'+str(product.get_unit_display()), product.__str__())
-                           for product in Product.objects.filter(shop=shop, is_removed=False)]
-                          )
-        self.fields['product'].choices = product_choice
+        self.fields['product'].choices = get_product_choices(shop)
 
     product = forms.ChoiceField(label='Produit', widget=forms.Select(
         attrs={'class': 'form-control selectpicker',
@@ -130,11 +127,7 @@ class InventoryProductForm(forms.Form):
         shop = kwargs.pop('shop')
         super().__init__(*args, **kwargs)
 
-        product_choice = ([(None, 'Sélectionner un produit')] +
-                          [(str(product.pk)+'/'+str(product.get_unit_display()), product.__str__())
-                           for product in Product.objects.filter(shop=shop, is_removed=False)]
-                          )
-        self.fields['product'].choices = product_choice
+        self.fields['product'].choices = get_product_choices(shop)
 
     product = forms.ChoiceField(label='Produit', widget=forms.Select(
         attrs={'class': 'form-control selectpicker',
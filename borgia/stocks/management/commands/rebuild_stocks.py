@@ -0,0 +1,21 @@
+"""
+Reconcile product stocks with the history.
+"""
+from django.core.management.base import BaseCommand
+
+from shops.models import Product
+from stocks.models import ProductStock
+
+
+class Command(BaseCommand):
+    help = 'Compute again the stock of every product from its last inventory, ' \
+           'stock entries and sales.'
+
+    def handle(self, *args, **options):
+        count = 0
+        for product in Product.objects.all().iterator():
+            ProductStock.rebuild(product)
+            count += 1
+
+        self.stdout.write(self.style.SUCCESS(
+            '{0} product stocks rebuilt.'.format(count)))
@@ -0,0 +1,29 @@
+# Generated by Django 2.2.28 on 2026-10-18 18:50
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shops', '0001_initial'),
+        ('stocks', '0002_auto_20190103_1237'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductStock',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('stock_base', models.PositiveIntegerField(default=0)),
+                ('stock_input', models.PositiveIntegerField(default=0)),
+                ('stock_output', models.PositiveIntegerField(default=0)),
+                ('inventory', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='stocks.Inventory')),
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='stock', to='shops.Product')),
+            ],
+            options={
+                'default_permissions': (),
+            },
+        ),
+    ]
@@ -2,6 +2,7 @@ from decimal import Decimal
 
 from django.core.validators import MinValueValidator
 from django.db import models
+from django.db.models import Case, F, Q, Sum, Value, When
 from django.utils.timezone import now
 
 from shops.models import Product, Shop
@@ -99,3 +100,101 @@ class InventoryProduct(models.Model):
 
     def get_quantity_display(self):
         return self.product.get_quantity_display(self.quantity)
+
+
+class ProductStock(models.Model):
+    """
+    Stock of a product since its last inventory, kept up to date on each
+    movement instead of being recomputed from the history.
+
+    :param product: Related product, mandatory.
+    :param inventory: Last inventory of the product, the stock is counted as
+    of this inventory. Null if the product has never been inventoried.
+    :param stock_base: Quantity counted by the last inventory.
+    :param stock_input: Quantity of stock entries since the last inventory.
+    :param stock_output: Quantity sold since the last inventory, without the
+    correcting factor.
+    :type product: Product object
+    :type inventory: Inventory object
+    :type stock_base, stock_input, stock_output: integer
+
+    :note:: Updated by stocks signals when a SaleProduct, StockEntryProduct
+    or InventoryProduct is created. The rebuild_stocks command reconciles it
+    with the history.
+    """
+    product = models.OneToOneField(Product, related_name='stock', on_delete=models.CASCADE)
+    inventory = models.ForeignKey(Inventory, related_name='+', blank=True, null=True,
+                                  on_delete=models.SET_NULL)
+    stock_base = models.PositiveIntegerField(default=0)
+    stock_input = models.PositiveIntegerField(default=0)
+    stock_output = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        """
+        Remove default permissions for ProductStock
+        """
+        default_permissions = ()
+
+    def current_stock_estimated(self):
+        return self.stock_base + self.stock_input - \
+            self.stock_output * Decimal(self.product.correcting_factor)
+
+    @classmethod
+    def rebuild(cls, product):
+        """
+        Compute the stock of the product from its history, save and return it.
+        """
+        last_inventoryproduct = product.last_inventoryproduct()
+        if last_inventoryproduct is None:
+            inventory = None
+            stock_base = 0
+        else:
+            inventory = last_inventoryproduct.inventory
+            stock_base = last_inventoryproduct.quantity
+        stock_input = product.stockentries_since_last_inventory().aggregate(
+            total=Sum('quantity'))['total'] or 0
+        stock_output = product.sales_since_last_inventory().aggregate(
+            total=Sum('quantity'))['total'] or 0
+
+        stock, _ = cls.objects.update_or_create(product=product, defaults={
+            'inventory': inventory,
+            'stock_base': stock_base,
+            'stock_input': stock_input,
+            'stock_output': stock_output
+        })
+        return stock
+
+    @classmethod
+    def add_movement(cls, product, field, quantity, datetime):
+        """
+        Add quantity to the stock_input or stock_output counter of the
+        product, if the movement happened after its last inventory.
+
+        :param product: Product moved, mandatory.
+        :param field: 'stock_input' or 'stock_output', mandatory.
+        :param quantity: Quantity moved, mandatory.
+        :param datetime: Date of the movement, mandatory.
+        """
+        cls.add_movements({product.pk: quantity}, field, datetime)
+
+    @classmethod
+    def add_movements(cls, quantities, field, datetime):
+        """
+        Same as add_movement for several products, with one query.
+
+        Used when the movements are created in bulk, without signals.
+
+        :param quantities: Quantity moved, by product pk, mandatory.
+        :type quantities: dict
+        """
+        if not quantities:
+            return
+        updated = cls.objects.filter(product__in=list(quantities)).filter(
+            Q(inventory__isnull=True) | Q(inventory__datetime__lte=datetime)
+        ).update(**{field: F(field) + Case(
+            *[When(product=product_pk, then=Value(quantity))
+              for product_pk, quantity in quantities.items()],
+            output_field=models.PositiveIntegerField())})
+        if updated < len(quantities):
+            for product in Product.objects.filter(pk__in=list(quantities), stock__isnull=True):
+                cls.rebuild(product)
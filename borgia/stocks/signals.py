@@ -0,0 +1,55 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from sales.models import SaleProduct
+from shops.models import Product
+from stocks.models import InventoryProduct, ProductStock, StockEntryProduct
+
+
+@receiver(post_save, sender=Product)
+def create_product_stock(instance, created, raw, **kwargs):
+    """
+    Create the empty stock of a new product.
+    """
+    if created and not raw:
+        ProductStock.objects.create(product=instance)
+
+
+@receiver(post_save, sender=SaleProduct)
+def update_stock_output(instance, created, raw, **kwargs):
+    """
+    Count sold quantities in the product stock.
+    """
+    if created and not raw:
+        ProductStock.add_movement(instance.product, 'stock_output',
+                                  instance.quantity, instance.sale.datetime)
+
+
+@receiver(post_save, sender=StockEntryProduct)
+def update_stock_input(instance, created, raw, **kwargs):
+    """
+    Count entered quantities in the product stock.
+    """
+    if created and not raw:
+        ProductStock.add_movement(instance.product, 'stock_input',
+                                  instance.quantity, instance.stockentry.datetime)
+
+
+@receiver(post_save, sender=InventoryProduct)
+def reset_product_stock(instance, created, raw, **kwargs):
+    """
+    Start the product stock again from the new inventory.
+    """
+    if created and not raw:
+        ProductStock.rebuild(instance.product)
+
+
+@receiver(post_save, sender=StockEntryProduct)
+@receiver(post_delete, sender=StockEntryProduct)
+def update_automatic_price(instance, raw=False, **kwargs):
+    """
+    Compute again the automatic price of the product, which depends on its
+    last stock entry.
+    """
+    if not raw:
+        instance.product.update_automatic_price()
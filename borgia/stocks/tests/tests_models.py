@@ -1,9 +1,15 @@
+import datetime
 import decimal
+from io import StringIO
+
+from django.core.management import call_command
 
 from borgia.tests.tests_views import BaseBorgiaViewsTestCase
+from modules.models import SelfSaleModule
+from sales.models import Sale, SaleProduct
 from shops.models import Product, Shop
-from stocks.models import (Inventory, InventoryProduct, StockEntry,
-                           StockEntryProduct)
+from stocks.models import (Inventory, InventoryProduct, ProductStock,
+                           StockEntry, StockEntryProduct)
 
 
 class BaseStocksTestCase(BaseBorgiaViewsTestCase):
@@ -82,3 +88,102 @@ class StockEntryTestCase(BaseStocksTestCase):
 
         total = self.stockentry2.total()
         self.assertEqual(total, decimal.Decimal('5.0'))
+
+
+class ProductStockTestCase(BaseStocksTestCase):
+    def setUp(self):
+        super().setUp()
+        self.module1 = SelfSaleModule.objects.create(shop=self.shop1, state=True)
+
+    def sell(self, product, quantity, **kwargs):
+        sale = Sale.objects.create(sender=self.user1, recipient=self.user1, operator=self.user1,
+                                   shop=self.shop1, module=self.module1, **kwargs)
+        SaleProduct.objects.create(sale=sale, product=product, quantity=quantity)
+
+    def inventory(self, product, quantity):
+        inventory = Inventory.objects.create(operator=self.user1, shop=self.shop1)
+        InventoryProduct.objects.create(inventory=inventory, product=product, quantity=quantity)
+        return inventory
+
+    def assertStockEqual(self, product, expected):
+        stock = ProductStock.objects.get(product=product)
+        self.assertTupleEqual(
+            (stock.stock_base, stock.stock_input, stock.stock_output), expected)
+        # Same as the stock computed from the history
+        history_stock = ProductStock.rebuild(product)
+        self.assertTupleEqual(
+            (history_stock.stock_base, history_stock.stock_input, history_stock.stock_output),
+            expected)
+
+    def test_movements(self):
+        self.assertStockEqual(self.product1, (0, 3, 0))
+        self.sell(self.product1, 2)
+        self.assertStockEqual(self.product1, (0, 3, 2))
+
+        self.product1.correcting_factor = decimal.Decimal('1.5')
+        self.product1.save()
+        self.assertEqual(Product.objects.get(pk=self.product1.pk).current_stock_estimated(), 0)
+
+    def test_inventory(self):
+        self.sell(self.product3, 2)
+        inventory = self.inventory(self.product3, 8)
+        self.assertStockEqual(self.product3, (8, 0, 0))
+        self.assertEqual(ProductStock.objects.get(product=self.product3).inventory, inventory)
+
+        self.sell(self.product3, 1)
+        # Movements dated before the inventory aren't counted
+        self.sell(self.product3, 5, datetime=inventory.datetime - datetime.timedelta(hours=1))
+        self.assertStockEqual(self.product3, (8, 0, 1))
+        self.assertEqual(Product.objects.get(pk=self.product3.pk).current_stock_estimated(), 7)
+
+    def test_missing_stock(self):
+        ProductStock.objects.filter(product=self.product1).delete()
+        product1 = Product.objects.get(pk=self.product1.pk)
+        self.assertEqual(product1.current_stock_estimated(), 3)
+        self.sell(self.product1, 1)
+        self.assertStockEqual(self.product1, (0, 3, 1))
+
+    def test_current_stock_estimated_queries(self):
+        product1 = Product.objects.select_related('stock').get(pk=self.product1.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(product1.current_stock_estimated(), 3)
+            self.assertEqual(product1.get_current_stock_estimated_display(), '3cl')
+
+    def test_rebuild_stocks(self):
+        ProductStock.objects.filter(product=self.product1).update(stock_input=42)
+        ProductStock.objects.filter(product=self.product2).delete()
+        call_command('rebuild_stocks', stdout=StringIO())
+        self.assertStockEqual(self.product1, (0, 3, 0))
+        self.assertStockEqual(self.product2, (0, 7, 0))
+
+
+class ProductAutomaticPriceTestCase(BaseStocksTestCase):
+    def test_stockentry_saved(self):
+        # 1€ for 3cl, 5% of margin, for 1L
+        product1 = Product.objects.get(pk=self.product1.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(product1.get_price(), decimal.Decimal('35.0000'))
+
+        stockentry = StockEntry.objects.create(operator=self.user1, shop=self.shop1)
+        stockentry_product = StockEntryProduct.objects.create(
+            stockentry=stockentry, product=self.product1, quantity=100, price=decimal.Decimal(2))
+        self.assertEqual(Product.objects.get(pk=self.product1.pk).get_price(),
+                         decimal.Decimal('2.1000'))
+
+        stockentry_product.delete()
+        self.assertEqual(Product.objects.get(pk=self.product1.pk).get_price(),
+                         decimal.Decimal('35.0000'))
+
+    def test_correcting_factor_updated(self):
+        # 12 units entered, 6 sold, 3 remaining: correcting factor of 1.5
+        module1 = SelfSaleModule.objects.create(shop=self.shop1, state=True)
+        sale = Sale.objects.create(sender=self.user1, recipient=self.user1, operator=self.user1,
+                                   shop=self.shop1, module=module1)
+        SaleProduct.objects.create(sale=sale, product=self.product3, quantity=6)
+        inventory = Inventory.objects.create(operator=self.user1, shop=self.shop1)
+        InventoryProduct.objects.create(inventory=inventory, product=self.product3, quantity=3)
+        inventory.update_correcting_factors()
+
+        product3 = Product.objects.get(pk=self.product3.pk)
+        self.assertEqual(product3.correcting_factor, decimal.Decimal('1.5'))
+        self.assertEqual(product3.get_automatic_price(), decimal.Decimal('0.5250'))
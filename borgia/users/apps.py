@@ -1,5 +1,10 @@
 from django.apps import AppConfig
 
 
-class AccountsConfig(AppConfig):
-    name = 'accounts'
+class UsersConfig(AppConfig):
+    name = 'users'
+
+    def ready(self):
+        # Import users signals
+        from users.signals import (invalidate_lateral_menus_on_save,
+                                   rebuild_search_tokens)
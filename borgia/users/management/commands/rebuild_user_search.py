@@ -0,0 +1,31 @@
+"""
+Rebuild the index of the username autocomplete.
+"""
+from django.core.management.base import BaseCommand
+
+from users.models import User, UserSearchToken
+
+
+class Command(BaseCommand):
+    help = 'Index again every user for the username autocomplete, for instance ' \
+           'after users were created or updated in bulk.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Number of users indexed at once.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        count = 0
+        users = []
+        for user in User.objects.all().iterator():
+            users.append(user)
+            if len(users) >= batch_size:
+                UserSearchToken.rebuild(users)
+                count += len(users)
+                users = []
+        UserSearchToken.rebuild(users)
+        count += len(users)
+
+        self.stdout.write(self.style.SUCCESS(
+            '{0} users indexed.'.format(count)))
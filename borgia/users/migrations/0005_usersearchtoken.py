@@ -0,0 +1,58 @@
+# Generated by Django 2.2.28 on 2026-10-18 19:22
+
+import re
+import unicodedata
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def normalize_search_text(value):
+    value = unicodedata.normalize('NFKD', value or '')
+    value = ''.join(char for char in value if not unicodedata.combining(char))
+    return [word for word in re.split(r'\W+', value.lower()) if word]
+
+
+def create_search_tokens(apps, schema_editor):
+    """
+    Index active users, like UserSearchToken.rebuild.
+    """
+    User = apps.get_model('users', 'User')
+    UserSearchToken = apps.get_model('users', 'UserSearchToken')
+
+    tokens = []
+    for user in User.objects.filter(is_active=True):
+        for kind in ('username', 'family', 'surname', 'last_name', 'first_name'):
+            words = normalize_search_text(getattr(user, kind))
+            if not words:
+                continue
+            values = {''.join(words)}
+            if kind != 'username':
+                values.update(words)
+            for value in values:
+                tokens.append(UserSearchToken(user=user, kind=kind, token=value[:255]))
+    UserSearchToken.objects.bulk_create(tokens)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0004_auto_20241110_1247'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserSearchToken',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('username', "Nom d'utilisateur"), ('family', "Fam'ss"), ('surname', 'Bucque'), ('last_name', 'Nom'), ('first_name', 'Prénom')], max_length=15, verbose_name='Champ')),
+                ('token', models.CharField(db_index=True, max_length=255, verbose_name='Mot')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_tokens', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'default_permissions': (),
+            },
+        ),
+        migrations.RunPython(create_search_tokens, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 2.2.28 on 2026-10-18 20:32
+
+import re
+import unicodedata
+
+from django.db import migrations
+
+
+def normalize_search_text(value):
+    value = unicodedata.normalize('NFKD', value or '')
+    value = ''.join(char for char in value if not unicodedata.combining(char))
+    return [word for word in re.split(r'\W+', value.lower()) if word]
+
+
+def index_family_first_number(apps, schema_editor):
+    """
+    Index the fam'ss whole and by its first number only, like
+    UserSearchToken.get_tokens.
+    """
+    User = apps.get_model('users', 'User')
+    UserSearchToken = apps.get_model('users', 'UserSearchToken')
+
+    UserSearchToken.objects.filter(kind='family').delete()
+    tokens = []
+    for user in User.objects.filter(is_active=True).exclude(family=None).only('family'):
+        words = normalize_search_text(user.family)
+        if not words:
+            continue
+        for value in {''.join(words), words[0]}:
+            tokens.append(UserSearchToken(user=user, kind='family', token=value[:255]))
+    UserSearchToken.objects.bulk_create(tokens, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0005_usersearchtoken'),
+    ]
+
+    operations = [
+        migrations.RunPython(index_family_first_number, migrations.RunPython.noop),
+    ]
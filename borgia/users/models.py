@@ -1,9 +1,11 @@
 import decimal
-import itertools
+import re
+import unicodedata
 
 from django.contrib.auth.models import AbstractUser
+from django.core.cache import cache
 from django.core.validators import RegexValidator, MinValueValidator
-from django.db import models
+from django.db import models, transaction
 from django.utils import timezone
 
 from borgia.utils import (PRESIDENTS_GROUP_NAME, VICE_PRESIDENTS_GROUP_NAME, TREASURERS_GROUP_NAME,
@@ -178,7 +180,9 @@ class User(AbstractUser):
         for se in events:
             solde_prev += se.get_price_of_user(self)
         self.virtual_balance = self.balance - solde_prev
-        self.save()
+        # Only write the forecast: saving the whole instance would write back a
+        # balance that may have been changed by a concurrent sale.
+        self.save(update_fields=['virtual_balance'])
 
     def credit(self, amount):
         """
@@ -198,8 +202,7 @@ class User(AbstractUser):
         if amount <= 0:
             raise ValueError('The amount must be positive')
 
-        self.balance += amount
-        self.save()
+        self.update_balance(amount)
 
     def debit(self, amount):
         """
@@ -219,32 +222,210 @@ class User(AbstractUser):
         if amount <= 0:
             raise ValueError('The amount must be strictly positive')
 
-        self.balance -= amount
-        self.save()
+        self.update_balance(-amount)
 
-    def list_transaction(self):
+    def update_balance(self, delta):
         """
-        Return the list of sales concerning the user.
+        Apply a signed delta to the balance of the user.
 
-        :returns: list of objects
+        The new balance is computed by the database with an F expression, in a
+        single UPDATE touching only the balance column. Two terminals selling
+        to the same user at the same time can't overwrite each other's debit.
+        The instance is then refreshed with the stored balance.
+
+        note:: Use credit or debit instead, they check the amount.
+
+        :param delta: signed amount of money in euro
+        :returns: nothing
         """
+        if isinstance(delta, float):
+            delta = decimal.Decimal(str(delta))
+        with transaction.atomic():
+            User.objects.filter(pk=self.pk).update(
+                balance=models.F('balance') + delta)
+            self.refresh_from_db(fields=['balance'])
+            # update() sends no signal
+            self.invalidate_client()
+
+    def invalidate_client(self):
+        """
+        Remove the user from the cache of get_client.
+
+        :note:: The entry is removed again when the transaction is committed,
+        a lookup running meanwhile may have cached the former balance.
+        """
+        key = client_cache_key(self.username)
+        cache.delete(key)
+        transaction.on_commit(lambda: cache.delete(key))
+
+
+def normalize_search_text(value):
+    """
+    Return the words of value in lower case, without accents.
+
+    example:: 'Jean-Hervé' gives ['jean', 'herve']
+    """
+    value = unicodedata.normalize('NFKD', value or '')
+    value = ''.join(char for char in value if not unicodedata.combining(char))
+    return [word for word in re.split(r'\W+', value.lower()) if word]
+
+
+class UserSearchToken(models.Model):
+    """
+    Word of an active user, indexed to search users by prefix.
+
+    :param user: user, mandatory.
+    :param kind: field of the user the word comes from, mandatory.
+    :param token: word normalized by normalize_search_text, mandatory.
+    :type user: User object
+    :type kind: string, must be in KIND_CHOICES
+    :type token: string
+
+    :note:: Tokens are rebuilt by signals when a user is saved. The username
+    gives one token, other fields give one token per word and one for all
+    their words.
+    """
+    # Ordered by relevance
+    KIND_CHOICES = (
+        ('username', "Nom d'utilisateur"),
+        ('family', "Fam'ss"),
+        ('surname', 'Bucque'),
+        ('last_name', 'Nom'),
+        ('first_name', 'Prénom')
+    )
+    INDEXED_FIELDS = [kind for kind, _ in KIND_CHOICES] + ['is_active']
+
+    user = models.ForeignKey(User, related_name='search_tokens', on_delete=models.CASCADE)
+    kind = models.CharField('Champ', choices=KIND_CHOICES, max_length=15)
+    token = models.CharField('Mot', max_length=255, db_index=True)
+
+    class Meta:
+        """
+        Remove default permissions for UserSearchToken
+        """
+        default_permissions = ()
+
+    @classmethod
+    def get_tokens(cls, user):
+        """
+        Return the (unsaved) tokens of the user, none if the user isn't
+        active.
+
+        :note:: The fam'ss is indexed whole and by its first number only, a
+        search for 4 doesn't find the fam'ss 12-4.
+        """
+        if not user.is_active:
+            return []
+        tokens = []
+        for kind, _ in cls.KIND_CHOICES:
+            words = normalize_search_text(getattr(user, kind))
+            if not words:
+                continue
+            values = {''.join(words)}
+            if kind == 'family':
+                values.add(words[0])
+            elif kind != 'username':
+                values.update(words)
+            for value in values:
+                tokens.append(cls(user=user, kind=kind, token=value[:255]))
+        return tokens
+
+    @classmethod
+    def rebuild(cls, users):
+        """
+        Replace the tokens of users.
+
+        :type users: list of User objects
+        """
+        tokens = []
+        for user in users:
+            tokens += cls.get_tokens(user)
+        with transaction.atomic():
+            cls.objects.filter(user__in=[user.pk for user in users]).delete()
+            cls.objects.bulk_create(tokens)
 
-        sales = self.sender_sale.all()
-        transferts = self.recipient_transfert.union(
-            self.sender_transfert.all())
-        rechargings = self.sender_recharging.all()
-        exceptionnal_movements = self.recipient_exceptionnal_movement.all()
-        events = self.event_set.filter(done=True)
-        for event in events:
-            event.amount = event.get_price_of_user(self)
-
-        list_transaction = sorted(
-            list(itertools.chain(sales, transferts, rechargings,
-                                 exceptionnal_movements, events)),
-            key=lambda instance: instance.datetime, reverse=True
-        )
 
-        return list_transaction
+def search_users(keywords, limit):
+    """
+    Return active users matching keywords, most relevant first, with two
+    queries: tokens are searched with their index, then users are loaded.
+
+    A user matches if the username starts with keywords, or if the fam'ss or
+    its first number is exactly keywords. From three characters, a user also matches
+    if a word of the bucque, last name or first name starts with keywords.
+    Exact matches come first, then by field (see UserSearchToken.KIND_CHOICES)
+    and by most recent year.
+
+    :param keywords: text typed, accents and case are ignored.
+    :param limit: maximum number of users returned.
+    :type keywords: string
+    :type limit: integer
+    :rtype: list of User objects
+    """
+    key = ''.join(normalize_search_text(keywords))
+    if not key:
+        return []
+
+    prefix = models.Q(token__startswith=key)
+    matching = models.Q(kind='family', token=key) | models.Q(prefix, kind='username')
+    if len(key) > 2:
+        matching |= models.Q(prefix, kind__in=['surname', 'last_name', 'first_name'])
+
+    kinds = [kind for kind, _ in UserSearchToken.KIND_CHOICES]
+    rank = models.Case(
+        *[models.When(kind=kind, token=key, then=index)
+          for index, kind in enumerate(kinds)],
+        *[models.When(kind=kind, then=len(kinds) + index)
+          for index, kind in enumerate(kinds)],
+        output_field=models.IntegerField())
+    user_pks = list(UserSearchToken.objects.filter(matching).values('user').annotate(
+        rank=models.Min(rank)).order_by(
+            'rank', models.F('user__year').desc(nulls_last=True), 'user__username'
+        ).values_list('user', flat=True)[:limit])
+    users = User.objects.in_bulk(user_pks)
+    return [users[pk] for pk in user_pks]
+
+
+CLIENT_CACHE_TIMEOUT = 5
+
+
+def client_cache_key(username):
+    """
+    Return the cache key of the user for get_client.
+    """
+    return 'client:{0}'.format(username)
+
+
+def get_client(username):
+    """
+    Return what a sale terminal displays of the active user, cached a few
+    seconds.
+
+    :param username: username of the user, mandatory.
+    :type username: string
+    :returns: dict with the pk, username, name, avatar (url or None),
+    balance and virtual_balance (forecast balance) of the user, None if
+    there is no such active user.
+    :note:: The cache is invalidated when the user is saved and when the
+    balance changes, see User.invalidate_client.
+    """
+    key = client_cache_key(username)
+    client = cache.get(key)
+    if client is None:
+        try:
+            user = User.objects.get(username=username, is_active=True)
+        except User.DoesNotExist:
+            return None
+        client = {
+            'pk': user.pk,
+            'username': user.username,
+            'name': user.__str__(),
+            'avatar': user.avatar.url if user.avatar else None,
+            'balance': user.balance,
+            'virtual_balance': user.virtual_balance
+        }
+        cache.set(key, client, CLIENT_CACHE_TIMEOUT)
+    return client
 
 
 def get_list_year():
@@ -0,0 +1,45 @@
+from django.contrib.auth.models import Group, Permission
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from borgia.utils import invalidate_lateral_menus
+from users.models import User, UserSearchToken
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+@receiver(post_save, sender=Permission)
+@receiver(post_delete, sender=Permission)
+def invalidate_lateral_menus_on_save(**kwargs):
+    """
+    Lateral menus depend on groups and permissions.
+    """
+    invalidate_lateral_menus()
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+@receiver(m2m_changed, sender=User.user_permissions.through)
+@receiver(m2m_changed, sender=Group.permissions.through)
+def invalidate_lateral_menus_on_m2m_changed(action, **kwargs):
+    """
+    Lateral menus depend on group memberships and permissions of users.
+    """
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        invalidate_lateral_menus()
+
+
+@receiver(post_save, sender=User)
+def rebuild_search_tokens(instance, update_fields, **kwargs):
+    """
+    Index the user for the username autocomplete.
+    """
+    if update_fields is None or set(update_fields) & set(UserSearchToken.INDEXED_FIELDS):
+        UserSearchToken.rebuild([instance])
+
+
+@receiver(post_save, sender=User)
+def invalidate_client_on_save(instance, **kwargs):
+    """
+    Sale terminals display the name, avatar and balances of the user.
+    """
+    instance.invalidate_client()
@@ -13,36 +13,6 @@ def has_perm(user, permission_required):
     return user.has_perm(permission_required)
 
 
-@register.filter(name='get_transaction_model')
-def get_transaction_model(transaction):
-    return transaction.__class__.__name__
-
-@register.filter(name='get_transaction_label')
-def get_transaction_label(transaction):
-    name = transaction.__class__.__name__
-    if name == "Event":
-       return ("Evénement",
-               transaction.description.capitalize() + ' le ' + transaction.date.strftime("%d %h %Y"))
-    elif name == "Recharging":
-       recharging_solution = transaction.content_solution.__class__.__name__
-       label = recharging_solution
-       if recharging_solution == 'Lydia':
-          label += " n°"+ transaction.content_solution.id_from_lydia
-       elif recharging_solution == 'Cheque':
-          label += " n°" + transaction.content_solution.cheque_number
-       return ("Rechargement", label)
-    elif name == "Transfert":
-       return ("Transfert",
-         'De ' + transaction.sender.__str__() +
-         ' à ' + transaction.recipient.__str__() +
-         ', '+ transaction.justification
-       )
-    elif name == "Sale":
-       return ("Achat"+" "+ transaction.shop.name,
-               transaction.string_products())
-    elif name == "ExceptionnalMovement":
-       return ("Mouvement exceptionnel", 'De '+transaction.operator.__str__()+' le '+ transaction.datetime.strftime("%d %h %Y"))
-
 @register.inclusion_tag('breadcrumbs.html', takes_context=True)
 def breadcrumbs(context):
     try:
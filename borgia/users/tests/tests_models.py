@@ -1,6 +1,19 @@
-from django.test import TestCase
+import decimal
+import os
+import threading
+import time
+from io import StringIO
+from unittest import skipUnless
 
-from users.models import User, get_list_year
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+
+from borgia.tests.utils import retry_on_lock
+from users.models import (User, UserSearchToken, get_client, get_list_year,
+                          normalize_search_text, search_users)
 
 
 class UserTest(TestCase):
@@ -124,3 +137,221 @@ class ListYearTest(TestCase):
 
     def test_list_year(self):
         self.assertListEqual(get_list_year(), [2016, 2011, 1901])
+
+
+class UserSearchTest(TestCase):
+    def setUp(self):
+        self.user1 = User.objects.create(
+            username='alex.palo', first_name='Alexandre', last_name='Palo',
+            surname='Pal\'Hervé', family='53-96', year=2015)
+        self.user2 = User.objects.create(
+            username='alexis', first_name='Alexis', last_name='Dupont', family='12',
+            year=2017)
+        self.user3 = User.objects.create(
+            username='jdupont', first_name='Jean-Hervé', last_name='Dupont', family='53',
+            year=2016)
+        self.user4 = User.objects.create(
+            username='alexander', first_name='Alexander', is_active=False)
+
+    def assertSearchEqual(self, keywords, expected, limit=10):
+        self.assertListEqual([user.username for user in search_users(keywords, limit)],
+                             expected)
+
+    def test_normalize_search_text(self):
+        self.assertListEqual(normalize_search_text(" Jean-Hervé D'ÉTÉ "),
+                             ['jean', 'herve', 'd', 'ete'])
+        self.assertListEqual(normalize_search_text(None), [])
+
+    def test_username(self):
+        self.assertSearchEqual('ALEX', ['alexis', 'alex.palo'])
+        self.assertSearchEqual('alex.p', ['alex.palo'])
+
+    def test_family(self):
+        # Exact matches first, then by year
+        self.assertSearchEqual('53', ['jdupont', 'alex.palo'])
+        self.assertSearchEqual('5', [])
+        # Anchored on the first number, or the whole fam'ss
+        self.assertSearchEqual('96', [])
+        self.assertSearchEqual('53-96', ['alex.palo'])
+
+    def test_names(self):
+        self.assertSearchEqual('herve', ['alex.palo', 'jdupont'])
+        self.assertSearchEqual('dupon', ['alexis', 'jdupont'])
+        self.assertSearchEqual('jean herve', ['jdupont'])
+        # Names only from three characters
+        self.assertSearchEqual('du', [])
+
+    def test_ranked(self):
+        # Username matches, then the exact first name before the prefix
+        self.assertSearchEqual('alexi', ['alexis'])
+        self.assertSearchEqual('alexandre', ['alex.palo'])
+        self.assertSearchEqual('alex', ['alexis'], limit=1)
+
+    def test_updated(self):
+        self.user2.family = '53'
+        self.user2.save()
+        self.assertSearchEqual('53', ['alexis', 'jdupont', 'alex.palo'])
+        self.user2.is_active = False
+        self.user2.save()
+        self.assertSearchEqual('53', ['jdupont', 'alex.palo'])
+        # Saving other fields doesn't index again
+        with self.assertNumQueries(1):
+            self.user1.save(update_fields=['theme'])
+
+    def test_rebuild_user_search(self):
+        UserSearchToken.objects.all().delete()
+        call_command('rebuild_user_search', batch_size=2, stdout=StringIO())
+        self.assertSearchEqual('53', ['jdupont', 'alex.palo'])
+
+
+class UserSearchBenchmarkTest(TestCase):
+    """
+    The username autocomplete is called on each keystroke, it must stay fast
+    with many users.
+
+    :note:: The timing is only checked on 10000 users if the environment
+    variable BORGIA_BENCHMARK is set, as it depends on the machine.
+    """
+    keywords = ['a', 'al', 'ale', 'alex', 'user12', '53', 'herve', 'elis', 'name99',
+                'bucque5']
+
+    @staticmethod
+    def create_users(nb_users):
+        first_names = ['Alexandre', 'Jean', 'Hervé', 'Pierre', 'Louis', 'Élise', 'Marie']
+        User.objects.bulk_create([User(
+            username='user{0}'.format(i),
+            first_name=first_names[i % len(first_names)],
+            last_name='Name{0}'.format(i),
+            surname='Bucque{0}'.format(i),
+            family=str(i % 150),
+            year=1990 + i % 30
+        ) for i in range(nb_users)], batch_size=500)
+        call_command('rebuild_user_search', stdout=StringIO())
+
+    def test_queries(self):
+        self.create_users(300)
+        self.assertEqual(UserSearchToken.objects.values('user').distinct().count(), 300)
+        for keyword in self.keywords:
+            with CaptureQueriesContext(connection) as context:
+                users = search_users(keyword, 10)
+            self.assertLessEqual(len(context.captured_queries), 2)
+            self.assertLessEqual(len(users), 10)
+        self.assertEqual(len(search_users('herve', 10)), 10)
+
+    @skipUnless(os.environ.get('BORGIA_BENCHMARK'), 'Set BORGIA_BENCHMARK to run benchmarks')
+    def test_benchmark(self):
+        self.create_users(10000)
+        # Warm-up
+        for keyword in self.keywords:
+            search_users(keyword, 10)
+
+        durations = []
+        for keyword in self.keywords:
+            start = time.perf_counter()
+            search_users(keyword, 10)
+            durations.append(time.perf_counter() - start)
+        self.assertLess(sum(durations) / len(durations), 0.01)
+
+
+class GetClientTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(
+            username='alex.palo', first_name='Alexandre', last_name='Palo',
+            balance=decimal.Decimal('12.50'))
+
+    def test_get_client(self):
+        client = get_client('alex.palo')
+        self.assertEqual(client['pk'], self.user.pk)
+        self.assertEqual(client['name'], 'Alexandre Palo')
+        self.assertIsNone(client['avatar'])
+        self.assertEqual(client['balance'], decimal.Decimal('12.50'))
+        self.assertIsNone(get_client('unknown'))
+
+        self.user.is_active = False
+        self.user.save()
+        self.assertIsNone(get_client('alex.palo'))
+
+    def test_cached(self):
+        get_client('alex.palo')
+        with self.assertNumQueries(0):
+            get_client('alex.palo')
+
+    def test_invalidated_on_balance_change(self):
+        get_client('alex.palo')
+        self.user.debit(decimal.Decimal('2.50'))
+        self.assertEqual(get_client('alex.palo')['balance'], decimal.Decimal('10.00'))
+
+        User.objects.get(pk=self.user.pk).credit(5)
+        self.assertEqual(get_client('alex.palo')['balance'], decimal.Decimal('15.00'))
+
+    def test_invalidated_on_save(self):
+        get_client('alex.palo')
+        self.user.first_name = 'Jean'
+        self.user.save()
+        self.assertEqual(get_client('alex.palo')['name'], 'Jean Palo')
+
+
+class ConcurrentBalanceTest(TransactionTestCase):
+    """
+    Several terminals debiting and crediting the same user at the same time
+    must not lose any update.
+
+    :note:: Operations are retried on lock errors, see retry_on_lock.
+    """
+    nb_threads = 8
+    nb_operations = 25
+
+    def setUp(self):
+        self.user = User.objects.create(username='concurrentUser', balance=0)
+
+    def run_in_threads(self, operations):
+        """
+        Run each operation nb_operations times, in its own thread.
+        """
+        barrier = threading.Barrier(len(operations))
+        errors = []
+
+        def worker(operation):
+            try:
+                # Each thread uses its own instance, loaded before any update,
+                # as a view would do.
+                user = retry_on_lock(User.objects.get, pk=self.user.pk)
+                barrier.wait()
+                for _ in range(self.nb_operations):
+                    retry_on_lock(operation, user)
+            except Exception as exception:  # pylint: disable=broad-except
+                errors.append(exception)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=(operation,))
+                   for operation in operations]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertListEqual(errors, [])
+
+    def test_concurrent_debits(self):
+        self.run_in_threads(
+            [lambda user: user.debit(decimal.Decimal('1.10'))] * self.nb_threads)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.balance,
+                         decimal.Decimal('-1.10') * self.nb_threads * self.nb_operations)
+
+    def test_concurrent_credits_and_debits(self):
+        half = self.nb_threads // 2
+        self.run_in_threads(
+            [lambda user: user.credit(decimal.Decimal('2.50'))] * half
+            + [lambda user: user.debit(1)] * half)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.balance,
+                         decimal.Decimal('1.50') * half * self.nb_operations)
+
+    def test_stale_instance_save_keeps_balance(self):
+        stale_user = User.objects.get(pk=self.user.pk)
+        self.user.credit(10)
+        stale_user.forecast_balance()
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.balance, 10)
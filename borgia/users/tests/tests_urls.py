@@ -15,6 +15,7 @@ class UsersNamedURLTests(TestCase):
             ('url_group_update', [], {'group_pk': 53}),
             ('url_ajax_username_from_username_part', [], {}),
             ('url_balance_from_username', [], {}),
+            ('url_client_from_username', [], {}),
         ]
         for name, args, kwargs in expected_named_urls:
             with self.subTest(name=name):
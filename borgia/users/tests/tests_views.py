@@ -203,3 +203,43 @@ class UpdateGroupViewTestCase(BaseBorgiaViewsTestCase):
             self.get_url(1))
         self.assertEqual(response_offline_user.status_code, 302)
         self.assertRedirects(response_offline_user, get_login_url_redirected(self.get_url(1)))
+
+
+class ClientFromUsernameViewTestCase(BaseBorgiaViewsTestCase):
+    url_view = 'url_client_from_username'
+
+    def get_url(self, username):
+        return reverse(self.url_view) + '?username=' + username
+
+    def test_allowed_user_get(self):
+        response = self.client1.get(self.get_url('user2'))
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['username'], 'user2')
+        self.assertEqual(data['balance'], '144.00')
+        self.assertIsNone(data['avatar'])
+        self.assertFalse(data['under_threshold'])
+
+    def test_under_threshold(self):
+        self.user2.debit(150)
+        data = self.client1.get(self.get_url('user2')).json()
+        self.assertEqual(data['balance'], '-6.00')
+        self.assertTrue(data['under_threshold'])
+
+    def test_cached(self):
+        self.client1.get(self.get_url('user2'))
+        # Session, operator and its permissions, the client is cached
+        with self.assertNumQueries(4):
+            self.client1.get(self.get_url('user2'))
+
+    def test_unknown_user(self):
+        response = self.client1.get(self.get_url('unknown'))
+        self.assertEqual(response.status_code, 400)
+
+    def test_not_allowed_user_get(self):
+        response = self.client2.get(self.get_url('user1'))
+        self.assertEqual(response.status_code, 403)
+
+    def test_offline_user_redirection(self):
+        response = Client().get(self.get_url('user1'))
+        self.assertEqual(response.status_code, 302)
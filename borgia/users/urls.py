@@ -4,6 +4,7 @@ from users.views import (GroupUpdateView, UserAddByListXlsxDownload,
                          UserCreateView, UserDeactivateView, UserListView,
                          UserRetrieveView, UserUpdateView,
                          UserUploadXlsxView, balance_from_username,
+                         client_from_username,
                          username_from_username_part)
 
 users_patterns = [
@@ -21,5 +22,6 @@ users_patterns = [
     ])),
     path('groups/<int:group_pk>/update/', GroupUpdateView.as_view(), name='url_group_update'),
     path('ajax/username_from_username_part/', username_from_username_part, name='url_ajax_username_from_username_part'),
-    path('ajax/balance_from_username/', balance_from_username, name='url_balance_from_username')
+    path('ajax/balance_from_username/', balance_from_username, name='url_balance_from_username'),
+    path('ajax/client_from_username/', client_from_username, name='url_client_from_username')
 ]
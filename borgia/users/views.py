@@ -1,10 +1,10 @@
 import datetime
 import json
 import random
-import re
 import string
 
 import openpyxl
+from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import (LoginRequiredMixin,
@@ -24,7 +24,7 @@ from configurations.utils import configuration_get
 from users.forms import (GroupUpdateForm, UserCreationCustomForm, UserDownloadXlsxForm,
                          UserSearchForm, UserUpdateForm, UserUploadXlsxForm)
 from users.mixins import GroupMixin, UserMixin
-from users.models import User
+from users.models import User, get_client, search_users
 
 
 class UserListView(LoginRequiredMixin, PermissionRequiredMixin, BorgiaFormView):
@@ -199,6 +199,8 @@ class UserRetrieveView(UserMixin, BorgiaView):
         elif self.user.has_perm('users.change_user'):
             self.menu_type = "managers"
         context = self.get_context_data(**kwargs)
+        context['transaction_list'] = self.user.ledger_entries.order_by(
+            '-datetime', '-pk')[:25]
         return render(request, self.template_name, context=context)
 
 
@@ -627,34 +629,30 @@ class UserAddByListXlsxDownload(LoginRequiredMixin, PermissionRequiredMixin, Bor
 
 
 def username_from_username_part(request):
+    """
+    Return active users matching the keywords typed, for the username
+    autocomplete, most relevant first.
+
+    :param GET['keywords']: text typed, mandatory.
+    :returns: list of {"username", "name", "balance"}. The name is only given
+    to authenticated users, as the login page uses the autocomplete, and the
+    balance to operators of sale modules. At most USER_SEARCH_LIMIT users
+    (setting, 10 by default) are returned.
+    :rtype: Http request, JSON
+    """
+    show_name = request.user.is_authenticated
+    show_balance = request.user.has_perm('modules.use_operatorsalemodule')
     data = []
-    try:
-        key = request.GET.get('keywords')
-        regex = r"^" + re.escape(key) + r"(\W|$)"
-
-        where_search = User.objects.filter(
-            family__regex=regex, is_active=True).order_by('-year')
-        if len(key) > 2:
-            if key.isalpha():
-                # Nom de famille, début ou entier à partir de 3 caractères
-                where_search = where_search | User.objects.filter(
-                    last_name__istartswith=key, is_active=True)
-                # Prénom, début ou entier à partir de 3 caractères
-                where_search = where_search | User.objects.filter(
-                    first_name__istartswith=key, is_active=True)
-                # Buque, début ou entier à partir de 3 caractères
-                where_search = where_search | User.objects.filter(
-                    surname__istartswith=key, is_active=True)
-
-                # Suppression des doublons
-                where_search = where_search.distinct()
-
-        for e in where_search:
-            data.append(e.username)
-    except KeyError:
-        pass
-
-    return HttpResponse(json.dumps(data))
+    for user in search_users(request.GET.get('keywords', ''),
+                             getattr(settings, 'USER_SEARCH_LIMIT', 10)):
+        result = {'username': user.username}
+        if show_name:
+            result['name'] = user.__str__()
+        if show_balance:
+            result['balance'] = str(user.balance)
+        data.append(result)
+
+    return HttpResponse(json.dumps(data), content_type='application/json')
 
 
 @login_required
@@ -672,3 +670,36 @@ def balance_from_username(request):
             return HttpResponseBadRequest()
     else:
         raise PermissionDenied
+
+
+@login_required
+def client_from_username(request):
+    """
+    Return what an operator sale terminal displays of the client, in one
+    request instead of an autocomplete and a balance lookup.
+
+    :param GET['username']: username of the client, mandatory.
+    :returns: {"username", "name", "avatar", "balance", "virtual_balance",
+    "under_threshold"}, under_threshold being true if the balance is under
+    the BALANCE_THRESHOLD_PURCHASE configuration. Status 400 if there is no
+    such active user.
+    :rtype: Http request, JSON
+    :raises: PermissionDenied if the user can't use operator sale modules.
+    """
+    if not request.user.has_perm('modules.use_operatorsalemodule'):
+        raise PermissionDenied
+
+    client = get_client(request.GET.get('username', ''))
+    if client is None:
+        return HttpResponseBadRequest()
+
+    threshold = configuration_get('BALANCE_THRESHOLD_PURCHASE').get_value()
+    data = {
+        'username': client['username'],
+        'name': client['name'],
+        'avatar': client['avatar'],
+        'balance': str(client['balance']),
+        'virtual_balance': str(client['virtual_balance']),
+        'under_threshold': client['balance'] < threshold
+    }
+    return HttpResponse(json.dumps(data), content_type='application/json')
@@ -168,3 +168,4 @@ SESSION_COOKIE_AGE = 7200
 
 
 DEFAULT_TEMPLATE = "light"  # Default template, en minuscule
+USER_SEARCH_LIMIT = 10  # Nombre maximal de résultats de l'autocomplétion des utilisateurs
@@ -96,6 +96,15 @@ DATABASES = {
     }
 }
 
+# Cache, must be shared by all processes serving Borgia (configurations are
+# kept in memory and reloaded when their version in this cache changes)
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': '/var/tmp/borgia_cache',
+    }
+}
+
 # Password validation
 AUTHENTICATION_BACKENDS = [
     'django.contrib.auth.backends.ModelBackend'
@@ -172,3 +181,4 @@ SESSION_COOKIE_AGE = 7200
 
 
 DEFAULT_TEMPLATE = "light"  # Default template, en minuscule
+USER_SEARCH_LIMIT = 10  # Nombre maximal de résultats de l'autocomplétion des utilisateurs